@@ -1,7 +1,20 @@
 if __name__ == "__main__":
+    import os
     import wx
+    from . import metrics
+    from .config import AppConfig
     from .config_screen import ConfigScreen
+    # SONOROUS_METRICS turns metrics on, and is the file (or http:// endpoint) they're exported to
+    exporter = None
+    if target := os.environ.get("SONOROUS_METRICS"):
+        metrics.enable()
+        if target.startswith(("http://", "https://")):
+            exporter = metrics.Exporter(url=target)
+        else:
+            exporter = metrics.Exporter(path=target)
     app = wx.App()
-    config = ConfigScreen()
+    config = ConfigScreen(configuration=AppConfig.load())
     config.Show()
-    app.MainLoop()
\ No newline at end of file
+    app.MainLoop()
+    if exporter is not None:
+        exporter.destroy()
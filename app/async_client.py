@@ -0,0 +1,185 @@
+import asyncio
+import enet
+from .protocol import ClientProtocol, ClientState, timeout_time
+from . import channels
+
+service_interval = 0.01  # Seconds between services of ENet's timers (resends, pings) while no packets arrive
+send_buffer = 65536  # Bytes of reliable data that may be unacknowledged before send() waits
+end = object()  # Queued to end the async iterators when the connection does
+
+
+class AsyncClient(ClientProtocol):
+    """A networking client for asyncio programs, such as bots and bridges. It has no thread of its own and doesn't import wx: ENet is serviced from the event loop whenever its socket is readable and every service_interval seconds, so one process can run hundreds of these on a single loop.
+
+    Control messages are read with `async for message in client.events()`, and audio with `async for user_id, seq_number, opus_audio in client.audio()`. Both end when the connection does. Audio frames are views of the received packet. If the reader falls more than audio_queue_size frames behind, the oldest are dropped and counted, so a slow reader can't make the client buffer without end.
+
+    Every method must be called from the event loop's thread. Call close() when done."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        fast_session: bool = False,
+        resumption: bool = False,
+        bundling: bool = False,
+        bundle_frames: int = 1,
+        bundle_size: int = 1200,
+        connect_timeout: int = timeout_time,
+        audio_queue_size: int = 500,
+    ):
+        """connect_timeout is in ms. The others are as for Client."""
+        super().__init__(fast_session, resumption, bundling, bundle_frames, bundle_size)
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.address = enet.Address(host.encode(), port)
+        self.net = enet.Host(None, 1, channels.count, 0, 0)
+        self.peer = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.timer: asyncio.TimerHandle | None = None
+        self.servicing = False
+        self.flush_pending = False
+        self.connected: asyncio.Future | None = None  # Until authenticated
+        self.drained = asyncio.Event()  # Set while there's room in the send buffer
+        self.messages: asyncio.Queue = asyncio.Queue()
+        self.frames: asyncio.Queue = asyncio.Queue(audio_queue_size)
+        self.dropped_frames = 0
+
+    async def connect(self):
+        """Connects and authenticates. Raises TimeoutError if that takes longer than connect_timeout, and ConnectionError if the server drops the connection first."""
+        if self.state in [ClientState.CONNECTING, ClientState.AUTHENTICATING, ClientState.CONNECTED]:
+            self.disconnect()
+        self.loop = asyncio.get_running_loop()
+        self.new_connection()
+        self.peer = self.net.connect(self.address, channels.count)
+        self.state = ClientState.CONNECTING
+        self.connected = self.loop.create_future()
+        self.start_servicing()
+        try:
+            await asyncio.wait_for(self.connected, self.connect_timeout / 1000)
+        except TimeoutError:
+            self.state = ClientState.TIMEOUT
+            self.peer.reset()
+            self.peer = None
+            self.session = None
+            self.stop_servicing()
+            raise TimeoutError(f"Could not connect to {self.host}:{self.port}") from None
+
+    def start_servicing(self):
+        self.servicing = True
+        self.drained.set()
+        self.loop.add_reader(self.net.socket.fileno(), self.service)
+        self.timer = self.loop.call_soon(self.service_timers)
+
+    def stop_servicing(self):
+        if not self.servicing:
+            return
+        self.servicing = False
+        self.loop.remove_reader(self.net.socket.fileno())
+        self.timer.cancel()
+        self.drained.set()  # Lets blocked senders find out
+
+    def service_timers(self):
+        self.service()
+        if self.servicing:
+            self.timer = self.loop.call_later(service_interval, self.service_timers)
+
+    def service(self):
+        """Handles every pending event and sends what's queued."""
+        event = self.net.service(0)
+        while event is not None and event.type != enet.EVENT_TYPE_NONE:
+            self.handle_event(event)
+            if self.peer is None:
+                return
+            event = self.net.check_events()  # None once there's nothing left
+        self.tick()
+        self.net.flush()
+        if self.peer.reliableDataInTransit <= send_buffer:
+            self.drained.set()
+
+    def transmit(self, channel: int, data: bytes, flags: int):
+        self.peer.send(channel, enet.Packet(data, flags=flags))
+        if not self.flush_pending:
+            # Whatever else gets sent in this iteration of the loop goes out with it
+            self.flush_pending = True
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        self.flush_pending = False
+        if self.peer is not None:
+            self.net.flush()
+
+    def deliver_audio(self, user_id: int, seq_number: int, opus_audio: memoryview):
+        if self.frames.full():
+            self.frames.get_nowait()
+            self.dropped_frames += 1
+        self.frames.put_nowait((user_id, seq_number, opus_audio))
+
+    def deliver_message(self, message):
+        self.messages.put_nowait(message)
+
+    def on_authenticated(self):
+        if not self.connected.done():
+            self.connected.set_result(None)
+
+    def on_disconnected(self):
+        self.stop_servicing()
+        self.finish()
+        if not self.connected.done():
+            self.connected.set_exception(ConnectionError(f"{self.host}:{self.port} closed the connection"))
+
+    def finish(self):
+        """End the iterators, once they got to what was received before"""
+        self.messages.put_nowait(end)
+        if self.frames.full():
+            self.frames.get_nowait()
+            self.dropped_frames += 1
+        self.frames.put_nowait(end)
+
+    async def events(self):
+        """Yields the control messages from the server until the connection ends."""
+        while (message := await self.messages.get()) is not end:
+            yield message
+
+    async def audio(self):
+        """Yields (user_id, seq_number, opus_audio) for every received frame until the connection ends."""
+        while (frame := await self.frames.get()) is not end:
+            yield frame
+
+    async def send(self, channel, event, data=None):
+        """Sends a control event. Waits while more than send_buffer bytes of reliable data haven't been acknowledged yet, so a fast sender can't outrun the connection."""
+        self.send_message(channel, event, data)
+        while self.servicing and self.peer.reliableDataInTransit > send_buffer:
+            self.drained.clear()
+            await self.drained.wait()
+
+    async def send_audio(self, audio):
+        """Sends an Opus frame. Audio isn't sent reliably, so this never waits."""
+        self.send_frame(audio)
+
+    def disconnect(self):
+        """Disconnect on purpose. The iterators end once they got to what was already received."""
+        if self.peer is None or self.state not in [
+            ClientState.CONNECTING,
+            ClientState.AUTHENTICATING,
+            ClientState.CONNECTED,
+        ]:
+            raise ConnectionError("Attempted to disconnect a disconnected client")
+        self.peer.disconnect_now()
+        self.net.flush()
+        self.peer = None
+        self.state = ClientState.DISCONNECTED
+        self.session = None
+        self.stop_servicing()
+        self.finish()
+
+    async def close(self):
+        """Disconnects if still connected."""
+        if self.peer is not None and self.state in [
+            ClientState.CONNECTING,
+            ClientState.AUTHENTICATING,
+            ClientState.CONNECTED,
+        ]:
+            self.disconnect()
+        self.stop_servicing()
+        self.stop_trace()
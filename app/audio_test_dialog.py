@@ -1,5 +1,6 @@
 import wx
 from .config import AppConfig
+from .playout import PlayoutEngine
 from .remote_user import RemoteUser
 from .transmitter import Transmitter
 
@@ -7,7 +8,8 @@ class AudioTestDialog(wx.Dialog):
     def __init__(self, parent: wx.Window|None, config: AppConfig):
         super().__init__(parent, title = "Audio test")
         self.config=config
-        self.output = RemoteUser(self.config.context, 1, "test")
+        self.engine = PlayoutEngine(self.config.context)
+        self.output = RemoteUser(self.engine, 1, "test")
         self.input = Transmitter(self.config.input_device_id, self.output.put_packet)
         panel = wx.Panel(self)
         sizer = wx.BoxSizer(wx.VERTICAL)
@@ -20,6 +22,7 @@ class AudioTestDialog(wx.Dialog):
     def Destroy(self):
         self.output.destroy()
         self.input.destroy()
+        self.engine.destroy()
         return super().Destroy()
     def on_echo_change(self, event):
         self.input.transmitting = self.echo.GetValue()
\ No newline at end of file
@@ -1,4 +1,7 @@
 # channel constants
 audio_out=0
 audio_in=1
-auth=2
\ No newline at end of file
+auth=2
+audio_bundle_out=3  # Bundled audio from the server, so a packet's channel says how to read it
+audio_bundle_in=4  # Bundled audio to the server
+count=10  # Channels every connection is set up with
@@ -1,27 +1,22 @@
-import os
-from enum import Enum
-from typing import Callable
-import wx
+import random
+import select
+import socket
 import time
-import msgpack
+from collections import deque
+from typing import Callable
 import threading
 import enet
-from .session import Session
-from . import structs, timer, channels
-
-
-class ClientState(Enum):
-    CONNECTING = 1
-    AUTHENTICATING = 2
-    CONNECTED = 3
-    TIMEOUT = 4
-    DISCONNECTED = 5
+from .congestion import CongestionController, packet_loss_scale
+from .event_handler import ControlDispatcher
+from .protocol import ClientProtocol, ClientState, timeout_time
+from . import channels, metrics, timer
 
+service_timeout = 5  # ms. Longest the network thread waits for packets before servicing ENet's timers. Queued sends wake it up straight away
+# Upper bounds of the buckets reconnect times are counted in, in seconds: 1 ms doubling up to about 16 s, past the longest backoff
+reconnect_buckets = tuple(0.001 * 2**i for i in range(15))
 
-timeout_time = 5000
 
-
-class Client(threading.Thread):
+class Client(ClientProtocol, threading.Thread):
     """The networking client. the on_* callbacks passed to this will be called in the UI (main) thread, and should take an instance of this as there only argument. Every instantiation of this must be pared with a destroy() call at some point to prevent memory leaks."""
 
     def __init__(
@@ -32,24 +27,77 @@ class Client(threading.Thread):
         on_disconnect: Callable,
         on_connect: Callable,
         on_connection_timeout: Callable,
+        fast_session: bool = False,
+        resumption: bool = False,
+        auto_reconnect: bool = False,
+        connect_timeout: int = timeout_time,
+        reconnect_backoff: tuple[float, float] = (0.25, 10.0),
+        call_after: Callable | None = None,
+        bundling: bool = False,
+        bundle_frames: int = 1,
+        bundle_size: int = 1200,
     ):
-        super().__init__(name="Network-thread", daemon=True)
+        """fast_session selects the fast Session mode (counter nonces, authenticated packets, replay protection). The server must be using it as well.
+
+        With resumption, a resumption ticket the server hands out is used to restore the session on the next connect in a single round trip, instead of going through the RSA handshake. With auto_reconnect, the client reconnects by itself after losing the connection, waiting a random delay that grows exponentially between the two reconnect_backoff bounds (in seconds). connect_timeout is in ms.
+
+        call_after is how the on_* callbacks get run, and defaults to wx.CallAfter. Pass something else to run the client without a GUI.
+
+        With bundling, the client offers the server to carry several frames per audio packet, each entry being an audio_bundle_entry followed by the Opus frame. Bundled packets go on their own channels (audio_bundle_out and audio_bundle_in), so either side can read a packet without knowing whether the offer was answered yet. The server may then put the frames of several speakers in one packet, and we put up to bundle_frames of our own frames in one (which delays all but the last of them). No packet grows past bundle_size bytes. The server answers with the sizes it accepts, and until it does (or if it doesn't know about bundling) every packet carries a single frame."""
+        threading.Thread.__init__(self, name="Network-thread", daemon=True)
+        ClientProtocol.__init__(self, fast_session, resumption, bundling, bundle_frames, bundle_size)
         self.host = host
         self.port = port
         self.event_handler = event_handler_factory(self)
+        # Control events are handled on their own thread, the network thread only decodes and queues them
+        self.dispatcher = ControlDispatcher(self.event_handler)
         self.on_connect = on_connect
         self.on_disconnect = on_disconnect
         self.on_connection_timeout = on_connection_timeout
-        self.session: Session | None = None
+        if call_after is None:
+            import wx
+
+            call_after = wx.CallAfter
+        self.call_after = call_after
+        self.auto_reconnect = auto_reconnect
+        self.connect_timeout = connect_timeout
+        self.reconnect_backoff = reconnect_backoff
+        self.reconnect_attempts = 0
+        self.reconnect_at: float | None = None  # time.monotonic() to reconnect at
+        self.reconnect_started: float | None = None  # When we lost the connection we're reconnecting from
+        # Measured for the last reconnect, in ms since the connection was lost. Every reconnect is observed by the reconnect histograms as well
+        self.time_to_connected: float | None = None
+        self.time_to_first_audio: float | None = None
         self.timeout_timer = timer.Timer()
         self.address = enet.Address(host.encode(), port)
-        self.net = enet.Host(None, 1, 10, 0, 0)
+        self.net = enet.Host(None, 1, channels.count, 0, 0)
         self.peer = None
         self.running = True
         self.should_poll = True  # for pausing and unpausing networking: No events will be processed and nothing would be done unless this is True
-        self.state = ClientState.DISCONNECTED
-        self.auth_random_bytes = os.urandom(32)
         self.lock = threading.RLock()
+        # Outgoing (channel, data, flags) tuples. Any thread appends, only the network thread pops and hands them to ENet, so senders never wait on the lock.
+        self.send_queue: deque[tuple[int, bytes, int]] = deque()
+        self.wakeup = threading.Event()
+        # ENet holds the GIL while it blocks in service(), so the network thread waits in select() instead. A byte written here wakes it up when something gets queued
+        self.send_signal, self.send_waiter = socket.socketpair()
+        self.send_signal.setblocking(False)
+        self.send_waiter.setblocking(False)
+        self.congestion: CongestionController | None = None  # Set one to have it sample the peer while connected
+        self.congestion_timer = timer.Timer()
+        labels = metrics.instance_labels()
+        self.instruments = [
+            metrics.registry.gauge("client.rtt", labels, function=lambda: self.peer.roundTripTime if self.peer else None),
+            metrics.registry.gauge(
+                "client.packet_loss", labels, function=lambda: self.peer.packetLoss / packet_loss_scale if self.peer else None
+            ),
+            metrics.registry.gauge("client.send_queue", labels, function=lambda: len(self.send_queue)),
+            metrics.registry.counter("client.rejected_packets", labels, function=lambda: self.rejected_packets),
+            metrics.registry.counter("client.unknown_events", labels, function=lambda: self.event_handler.unknown_events),
+            metrics.registry.gauge("client.control_queue", labels, function=lambda: self.dispatcher.queue.qsize()),
+        ]
+        self.reconnect_connected_time = metrics.registry.histogram("client.reconnect.time_to_connected", labels, reconnect_buckets)
+        self.reconnect_audio_time = metrics.registry.histogram("client.reconnect.time_to_first_audio", labels, reconnect_buckets)
+        self.instruments += [self.reconnect_connected_time, self.reconnect_audio_time]
         self.start()
 
     def connect(self):
@@ -60,9 +108,24 @@ class Client(threading.Thread):
                 ClientState.CONNECTING,
             ]:
                 self.disconnect()
-            self.auth_random_bytes = os.urandom(32)
-            self.peer = self.net.connect(self.address, 10)
+            self.send_queue.clear()
+            self.new_connection()
+            self.reconnect_at = None
+            self.timeout_timer.restart()
+            self.peer = self.net.connect(self.address, channels.count)
             self.state = ClientState.CONNECTING
+        self.wakeup.set()
+
+    def schedule_reconnect(self):
+        """Called on the network thread after losing the connection."""
+        if not self.auto_reconnect or not self.running:
+            return
+        if self.reconnect_attempts == 0:
+            self.reconnect_started = time.monotonic()
+        low, high = self.reconnect_backoff
+        delay = random.uniform(low, min(high, low * 2**self.reconnect_attempts))
+        self.reconnect_attempts += 1
+        self.reconnect_at = time.monotonic() + delay
 
     def run(self):
         while self.running:
@@ -77,102 +140,134 @@ class Client(threading.Thread):
                 ]
             ):
                 self.loop()
-                time.sleep(0.0004)
                 continue
-            time.sleep(0.05)
+            if self.reconnect_at is not None and time.monotonic() >= self.reconnect_at:
+                self.connect()
+                continue
+            # Nothing to service, so sleep until connect() or destroy() wakes us up
+            self.wakeup.wait(0.05)
+            self.wakeup.clear()
 
     def loop(self):
+        """Handles every event that is pending and flushes the send queue, then waits up to service_timeout ms for packets to arrive or be queued."""
         with self.lock:
+            self.flush_send_queue()
             event = self.net.service(0)
-            if event.type == enet.EVENT_TYPE_CONNECT:
-                self.state = ClientState.AUTHENTICATING
-                self.session = None
-            elif event.type == enet.EVENT_TYPE_DISCONNECT:
-                self.state = ClientState.DISCONNECTED
-                self.peer = None
-                self.session = None
-                wx.CallAfter(self.on_disconnect, self)
-            elif event.type == enet.EVENT_TYPE_RECEIVE:
-                channel = event.channelID
-                if self.state is ClientState.AUTHENTICATING:
-                    if channel == channels.auth:
-                        data = event.packet.data
-                        if not self.session:
-                            # The servre gave us its public key
-                            self.session = Session(data)
-                            self.peer.send(
-                                channels.auth,
-                                enet.Packet(
-                                    self.session.get_encrypted_aes_key(),
-                                    flags=enet.PACKET_FLAG_RELIABLE,
-                                ),
-                            )
-                            self.peer.send(
-                                channels.auth,
-                                enet.Packet(
-                                    self.session.encrypt(self.auth_random_bytes),
-                                    flags=enet.PACKET_FLAG_RELIABLE,
-                                ),
-                            )
-                        elif data == self.auth_random_bytes:
-                            self.state = ClientState.CONNECTED
-                        else:
-                            return self.disconnect()
-                elif self.state is ClientState.CONNECTED:
-                    data = self.session.decrypt(event.packet.data)
-                    if channel == channels.audio_out:
-                        user_id, seq_number = structs.audio_packet_header.unpack(
-                            data[:2]
-                        )
-                        opus_data = data[2:]
-                        self.event_handler.audio(user_id, seq_number, opus_data)
-                        return
-                    data = msgpack.loads(event.packet.data)
-                    getattr(self.event_handler, f'event_{data["event"]}')(data["data"])
-            elif (
+            while event is not None and event.type != enet.EVENT_TYPE_NONE:
+                self.handle_event(event)
+                if self.peer is None:
+                    break
+                event = self.net.check_events()  # None once there's nothing left
+            self.tick()
+            if self.flush_send_queue():
+                self.net.flush()
+            if (
+                self.congestion is not None
+                and self.state is ClientState.CONNECTED
+                and self.congestion_timer.elapsed >= self.congestion.interval
+            ):
+                self.congestion_timer.restart()
+                self.congestion.sample_peer(self.peer)
+            if (
                 self.state in [ClientState.CONNECTING, ClientState.AUTHENTICATING]
-                and self.timeout_timer.elapsed >= timeout_time
+                and self.timeout_timer.elapsed >= self.connect_timeout
             ):
                 self.timeout_timer.restart()
                 self.state = ClientState.TIMEOUT
+                self.peer.reset()
                 self.peer = None
                 self.session = None
-                wx.CallAfter(self.on_connection_timeout, self)
+                self.call_after(self.on_connection_timeout, self)
+                self.schedule_reconnect()
+                return
+        select.select(
+            [self.net.socket.fileno(), self.send_waiter], [], [], service_timeout / 1000
+        )
+        try:
+            self.send_waiter.recv(4096)
+        except BlockingIOError:
+            pass
 
-    def send(self, channel, event, data=None):
-        if self.state is not ClientState.CONNECTED:
-            raise BrokenPipeError(
-                "Attempted sending a packet to a client that is not connected."
-            )
+    def notify(self):
+        """Wakes the network thread up to send what was queued."""
+        try:
+            self.send_signal.send(b"\0")
+        except BlockingIOError:
+            pass  # Already full of wakeups
+
+    def flush_send_queue(self) -> int:
+        """Hands every queued packet to ENet. Must only be called from the network thread while holding the lock. Returns how many packets were queued."""
+        count = 0
+        while self.send_queue:
+            channel, data, flags = self.send_queue.popleft()
+            if self.peer is None:
+                continue
+            self.peer.send(channel, enet.Packet(data, flags=flags))
+            count += 1
+        return count
+
+    def transmit(self, channel: int, data: bytes, flags: int):
+        self.send_queue.append((channel, data, flags))
+        self.notify()
+
+    def deliver_audio(self, user_id: int, seq_number: int, opus_audio: memoryview):
+        self.event_handler.audio(user_id, seq_number, opus_audio)
+
+    def deliver_message(self, message):
+        self.dispatcher.put(message)
+
+    def on_authenticated(self):
+        self.reconnect_attempts = 0
+        if self.reconnect_started is not None:
+            elapsed = time.monotonic() - self.reconnect_started
+            self.time_to_connected = elapsed * 1000
+            self.reconnect_connected_time.observe(elapsed)
+        self.call_after(self.on_connect, self)
+
+    def on_disconnected(self):
+        self.call_after(self.on_disconnect, self)
+        self.schedule_reconnect()
+
+    def receive_audio(self, data: bytes, bundled: bool = False):
+        if self.reconnect_started is not None:
+            elapsed = time.monotonic() - self.reconnect_started
+            self.time_to_first_audio = elapsed * 1000
+            self.reconnect_audio_time.observe(elapsed)
+            self.reconnect_started = None
+        super().receive_audio(data, bundled)
+
+    def start_trace(self, path: str):
         with self.lock:
-            if channel in [channels.audio_in, channels.audio_out]:
-                raise ValueError("Can't send non-audio packets to audio channel")
-            if data is None:
-                data = {}
-            packet = enet.Packet(
-                self.session.encrypt(msgpack.dumps({"event": event, "data": data})),
-                flags=enet.PACKET_FLAG_RELIABLE,
-            )
-            self.peer.send(channel, packet)
+            super().start_trace(path)
 
-    def send_audio(self, audio):
-        if self.state is not ClientState.CONNECTED:
-            raise BrokenPipeError(
-                "Attempted sending a packet to a client that is not connected."
-            )
+    def stop_trace(self):
         with self.lock:
-            packet = enet.Packet(self.session.encrypt(audio))
-            self.peer.send(channels.audio_in, packet)
+            super().stop_trace()
+
+    def send(self, channel, event, data=None):
+        self.send_message(channel, event, data)
+
+    def send_audio(self, audio):
+        self.send_frame(audio)
 
     def destroy(self):
         self.running = False
+        self.wakeup.set()
         with self.lock:
             if self.state is ClientState.CONNECTED:
                 self.disconnect()
         self.join()
+        self.stop_trace()
+        self.dispatcher.destroy()
+        metrics.registry.unregister(*self.instruments)
+        self.send_signal.close()
+        self.send_waiter.close()
 
     def disconnect(self):
+        """Disconnect on purpose. This cancels any pending automatic reconnect."""
         with self.lock:
+            self.reconnect_at = None
+            self.reconnect_started = None
             if self.peer is None or self.state not in [
                 ClientState.CONNECTING,
                 ClientState.AUTHENTICATING,
@@ -184,4 +279,4 @@ class Client(threading.Thread):
             self.peer = None
             self.state = ClientState.DISCONNECTED
             self.session = None
-            wx.CallAfter(self.on_disconnect, self)
+            self.call_after(self.on_disconnect, self)
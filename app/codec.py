@@ -0,0 +1,136 @@
+import ctypes
+from pyogg import opus
+from .pcm_pool import PcmFrame
+
+applications = {
+    "voip": opus.OPUS_APPLICATION_VOIP,
+    "audio": opus.OPUS_APPLICATION_AUDIO,
+    "restricted_lowdelay": opus.OPUS_APPLICATION_RESTRICTED_LOWDELAY,
+}
+
+
+class Encoder:
+    """A thin wrapper around the libopus encoder that encodes into a reused output buffer and exposes the encoder ctls."""
+
+    def __init__(
+        self,
+        channels: int = 2,
+        sample_rate: int = 48000,
+        application: str = "audio",
+        max_packet_size: int = 4000,
+    ):
+        self.channels = channels
+        self.sample_rate = sample_rate
+        error = ctypes.c_int()
+        self.state = opus.opus_encoder_create(
+            sample_rate, channels, applications[application], ctypes.byref(error)
+        )
+        if error.value != opus.OPUS_OK:
+            raise RuntimeError(
+                f"Couldn't create an opus encoder: {opus.opus_strerror(error.value).decode()}"
+            )
+        self.output = bytearray(max_packet_size)
+        self.output_view = memoryview(self.output)
+        self.output_buffer = (ctypes.c_ubyte * max_packet_size).from_buffer(self.output)
+
+    def ctl(self, request: int, value: int):
+        result = opus.opus_encoder_ctl(self.state, request, ctypes.c_int(value))
+        if result != opus.OPUS_OK:
+            raise RuntimeError(f"Opus encoder ctl {request} failed: {opus.opus_strerror(result).decode()}")
+
+    def set_bitrate(self, bitrate: int):
+        self.ctl(opus.OPUS_SET_BITRATE_REQUEST, bitrate)
+
+    def set_complexity(self, complexity: int):
+        self.ctl(opus.OPUS_SET_COMPLEXITY_REQUEST, complexity)
+
+    def set_inband_fec(self, enabled: bool):
+        self.ctl(opus.OPUS_SET_INBAND_FEC_REQUEST, int(enabled))
+
+    def set_packet_loss_percentage(self, percentage: int):
+        """The loss the encoder should expect, which decides how much redundancy FEC adds."""
+        self.ctl(opus.OPUS_SET_PACKET_LOSS_PERC_REQUEST, percentage)
+
+    def set_dtx(self, enabled: bool):
+        """With DTX on, libopus emits packets of 2 bytes or less during silence. Those don't need to be sent."""
+        self.ctl(opus.OPUS_SET_DTX_REQUEST, int(enabled))
+
+    def encode(self, pcm: ctypes.Array, frame_size: int) -> memoryview:
+        """Encode frame_size samples per channel of 16 bit PCM. The returned view is only valid until the next call."""
+        result = opus.opus_encode(
+            self.state, pcm, frame_size, self.output_buffer, len(self.output)
+        )
+        if result < 0:
+            raise RuntimeError(f"Opus encoding failed: {opus.opus_strerror(result).decode()}")
+        return self.output_view[:result]
+
+    def __del__(self):
+        if getattr(self, "state", None):
+            opus.opus_encoder_destroy(self.state)
+
+
+class Decoder:
+    """A thin wrapper around the libopus decoder that decodes straight into a PcmFrame instead of returning a new buffer for every packet. It follows the channel count of the stream it's fed."""
+
+    def __init__(
+        self, channels: int = 2, sample_rate: int = 48000, max_packet_size: int = 4000
+    ):
+        self.sample_rate = sample_rate
+        self.state = None
+        self.set_channels(channels)
+        self.packet = (ctypes.c_ubyte * max_packet_size)()  # Staging area for incoming packets
+        self.packet_view = memoryview(self.packet).cast("B")
+
+    def set_channels(self, channels: int):
+        """(Re)creates the decoder state for the given channel count."""
+        error = ctypes.c_int()
+        state = opus.opus_decoder_create(self.sample_rate, channels, ctypes.byref(error))
+        if error.value != opus.OPUS_OK:
+            raise RuntimeError(
+                f"Couldn't create an opus decoder: {opus.opus_strerror(error.value).decode()}"
+            )
+        if self.state:
+            opus.opus_decoder_destroy(self.state)
+        self.state = state
+        self.channels = channels
+
+    def decode_into(
+        self, packet: bytes | memoryview, frame: PcmFrame, fec: bool = False, samples: int = 0
+    ) -> int:
+        """Decode packet (any bytes-like object) into frame, setting its length. Returns the number of samples per channel decoded.
+
+        With fec, the frame before packet is decoded instead, from the redundancy in-band FEC put in packet, and samples must be the length of that frame. libopus falls back to concealment if packet has no FEC data."""
+        size = len(packet)
+        if size > len(self.packet):
+            raise ValueError(f"Opus packet of {size} bytes is too large")
+        if not size:
+            raise ValueError("Empty opus packet")
+        self.packet_view[:size] = packet
+        channels = opus.opus_packet_get_nb_channels(self.packet)
+        if channels != self.channels and channels in (1, 2):
+            self.set_channels(channels)
+        result = opus.opus_decode(
+            self.state,
+            self.packet,
+            size,
+            frame.samples,
+            samples if fec else len(frame.samples) // self.channels,
+            int(fec),
+        )
+        return self.decoded(result, frame)
+
+    def conceal_into(self, frame: PcmFrame, samples: int) -> int:
+        """Packet loss concealment: have libopus make up samples samples per channel to stand in for a lost frame, and put them in frame."""
+        result = opus.opus_decode(self.state, None, 0, frame.samples, samples, 0)
+        return self.decoded(result, frame)
+
+    def decoded(self, result: int, frame: PcmFrame) -> int:
+        if result < 0:
+            raise RuntimeError(f"Opus decoding failed: {opus.opus_strerror(result).decode()}")
+        frame.channels = self.channels
+        frame.length = result * self.channels * 2
+        return result
+
+    def __del__(self):
+        if getattr(self, "state", None):
+            opus.opus_decoder_destroy(self.state)
@@ -1,8 +1,19 @@
-import cyal
+import json
+import os
+import threading
+from typing import Callable
+
+
+def default_path() -> str:
+    """Where the configuration is saved: sonorous/config.json in %APPDATA% on Windows, and in $XDG_CONFIG_HOME (~/.config) elsewhere"""
+    base = os.environ.get("APPDATA") or os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "sonorous", "config.json")
 
 
 class AppConfig:
-    """Holds the configuration"""
+    """Holds the configuration.
+
+    Nothing is opened until it's used: the capture extension, the output device and the context are opened the first time they're asked for, so a config can be loaded, edited and saved without touching the sound system. The device lists are saved along with the rest, so the config screen can show them straight away, and refresh_devices() enumerates them again in the background."""
 
     def __init__(
         self,
@@ -11,44 +22,131 @@ class AppConfig:
         name: str = "",
         input_device: bytes = b"",
         output_device: str = "",
+        input_devices: list[str] | None = None,
+        output_devices: list[str] | None = None,
+        default_input_device: str = "",
+        default_output_device: str = "",
     ):
-        self.capture = cyal.CaptureExtension()
+        """An empty input_device or output_device means the default one."""
         self.host = host
         self.port = port
         self.name = name
-        self.input_device_id = input_device or self.capture.default_device
-        output_device_id = output_device or cyal.get_default_all_device_specifier()
+        self.input_device_id = input_device or None
+        self._output_device_id = output_device
+        # As last enumerated
+        self.input_devices = input_devices or []
+        self.output_devices = output_devices or []
+        self.default_input_device = default_input_device
+        self.default_output_device = default_output_device
+        self.path: str | None = None  # Where it was loaded from
+        self.lock = threading.Lock()  # For opening things, which may happen from the refresh thread
+        self._capture = None
         self._output_device = None
-        self.output_device_id = output_device
-        self.context = cyal.Context(self._output_device, make_current = True)
+        self._context = None
+
+    @property
+    def capture(self):
+        with self.lock:
+            if self._capture is None:
+                import cyal
+
+                self._capture = cyal.CaptureExtension()
+            return self._capture
+
+    @property
+    def output_device(self):
+        with self.lock:
+            if self._output_device is None:
+                import cyal
+
+                self._output_device = cyal.Device(self._output_device_id or None)
+            return self._output_device
+
+    @property
+    def context(self):
+        """The OpenAL context on the output device, made current when it's created"""
+        if self._context is None:
+            import cyal
+
+            self._context = cyal.Context(self.output_device, make_current=True)
+        return self._context
 
     @property
     def output_device_id(self):
         if self._output_device is not None:
             return self._output_device.output_name
+        return self._output_device_id or None
 
     @output_device_id.setter
     def output_device_id(self, value: str):
-        if self._output_device is None:
-            self._output_device = cyal.Device(value)
-        else:
+        self._output_device_id = value
+        if self._output_device is not None:
             self._output_device.reopen(value)
 
+    def refresh_devices(self, callback: Callable[["AppConfig"], None] | None = None) -> threading.Thread:
+        """Enumerate the devices again on a thread of its own, which then calls callback with this config. Enumerating can take a while with some drivers, so it's kept off the UI thread."""
+
+        def refresh():
+            import cyal
+
+            capture = self.capture
+            self.input_devices = list(capture.devices)
+            self.default_input_device = capture.default_device.decode()
+            self.output_devices = list(cyal.get_all_device_specifiers())
+            self.default_output_device = cyal.get_default_all_device_specifier()
+            if callback is not None:
+                callback(self)
+
+        thread = threading.Thread(target=refresh, name="Device-thread", daemon=True)
+        thread.start()
+        return thread
+
     def to_json(self):
         return {
             "host": self.host,
             "port": self.port,
             "name": self.name,
-            "input_device": self.input_device_id,
-            "output_device": self.output_device_id,
+            # Device names are bytes for capture, which JSON can't hold
+            "input_device": (self.input_device_id or b"").decode(),
+            "output_device": self._output_device_id,
+            "input_devices": self.input_devices,
+            "output_devices": self.output_devices,
+            "default_input_device": self.default_input_device,
+            "default_output_device": self.default_output_device,
         }
 
     @classmethod
     def from_json(cls, json):
-        cls(
-            json["host"],
-            json["port"],
-            json["name"],
-            json["input_device"],
-            json["output_device"],
+        return cls(
+            json.get("host", ""),
+            json.get("port", 0),
+            json.get("name", ""),
+            json.get("input_device", "").encode(),
+            json.get("output_device", ""),
+            json.get("input_devices"),
+            json.get("output_devices"),
+            json.get("default_input_device", ""),
+            json.get("default_output_device", ""),
         )
+
+    @classmethod
+    def load(cls, path: str | None = None) -> "AppConfig":
+        """Loads the configuration saved at path (default_path() by default). A missing or unreadable file gives the defaults."""
+        path = path or default_path()
+        try:
+            with open(path, encoding="utf-8") as file:
+                config = cls.from_json(json.load(file))
+        except (OSError, ValueError, AttributeError):
+            config = cls()
+        config.path = path
+        return config
+
+    def save(self, path: str | None = None):
+        """Saves to path, or to where this was loaded from, or to default_path(). The file is replaced in one go, so a crash can't leave half of it."""
+        path = path or self.path or default_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(self.to_json(), file, indent=2)
+        os.replace(temporary, path)
+        self.path = path
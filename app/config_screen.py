@@ -1,6 +1,5 @@
-import cyal
 import wx
-from . import config, audio_test_dialog
+from . import config
 
 
 class ConfigScreen(wx.Frame):
@@ -10,8 +9,7 @@ class ConfigScreen(wx.Frame):
         configuration: config.AppConfig | None = None,
     ):
         super().__init__(parent, title="Configuration")
-        self.config = configuration or config.AppConfig()
-        self.capture = self.config.capture
+        self.config = configuration or config.AppConfig.load()
         tabs = wx.Treebook(self)
         # Tab 1: Host, Port, and Name
         tab1 = wx.Panel(tabs)
@@ -49,18 +47,27 @@ class ConfigScreen(wx.Frame):
         tab2_sizer.Add(self.output_device_ctrl, 1, wx.EXPAND | wx.ALL, 10)
         tab2_sizer.Add(self.test_ctrl)
         tab2.SetSizer(tab2_sizer)
+        # The lists saved with the config are shown until the devices have been enumerated again
         self.update_devices()
+        self.config.refresh_devices(lambda configuration: wx.CallAfter(self.update_devices))
+        self.Bind(wx.EVT_CLOSE, self.on_close)
         tabs.SetSelection(0)  # Start with the first tab
 
     def update_devices(self):
+        if not self:
+            return  # Closed before the devices were enumerated
         string_to_remove = "OpenAL Soft on "  # Just so we get only the device name
-        input_devices = self.capture.devices
-        output_devices = cyal.get_all_device_specifiers()
+        input_devices = self.config.input_devices
+        output_devices = self.config.output_devices
+        selected_input = self.config.input_device_id or self.config.default_input_device.encode()
+        selected_output = self.config.output_device_id or self.config.default_output_device
+        self.input_device_ctrl.Clear()
+        self.output_device_ctrl.Clear()
         for index, device in enumerate(input_devices):
             id = device.encode()
             self.input_device_ctrl.Append(device.replace(string_to_remove, "", 1), id)
             if (
-                id == self.config.input_device_id
+                id == selected_input
             ):  # It's the selected/default one, so we set selection to it
                 self.input_device_ctrl.SetSelection(index)
         for index, device in enumerate(output_devices):
@@ -69,7 +76,7 @@ class ConfigScreen(wx.Frame):
                 device.replace(string_to_remove, "", 1), id
             )  # For output devices we don't need to encode their names
             if (
-                id == self.config.output_device_id
+                id == selected_output
             ):  # It's the selected/default one, so we set selection to it
                 self.output_device_ctrl.SetSelection(index)
 
@@ -85,5 +92,17 @@ class ConfigScreen(wx.Frame):
         )
         self.config.output_device_id = device
     def on_test(self, event):
+        from . import audio_test_dialog  # Loads the codec and the sound system, which the rest of the screen doesn't need
+
         with audio_test_dialog.AudioTestDialog(self, self.config) as dlg:
-            dlg.ShowModal()
\ No newline at end of file
+            dlg.ShowModal()
+
+    def on_close(self, event):
+        self.config.host = self.host_ctrl.GetValue()
+        self.config.port = self.port_ctrl.GetValue()
+        self.config.name = self.name_ctrl.GetValue()
+        try:
+            self.config.save()
+        except OSError as e:
+            wx.MessageBox(f"Could not save the configuration: {e}", "Error", wx.ICON_ERROR, self)
+        event.Skip()
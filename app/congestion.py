@@ -0,0 +1,91 @@
+import math
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable
+
+if TYPE_CHECKING:
+    from .profiles import AudioProfile
+
+packet_loss_scale = 65536  # ENet reports packet loss as a fraction of this (ENET_PEER_PACKET_LOSS_SCALE)
+
+
+@dataclass(frozen=True)
+class EncoderDecision:
+    """Encoder settings chosen by the CongestionController, along with the stats that led to them."""
+
+    bitrate: int
+    fec: bool
+    packet_loss_percentage: int
+    rtt: int  # ms
+    loss: float  # 0 to 1
+
+
+class CongestionController:
+    """Picks an encoder bitrate, in-band FEC and expected packet loss from the round trip time and packet loss ENet measures for our peer.
+
+    Bitrate is cut multiplicatively when loss or queueing delay (round trip time above the lowest one seen) gets too high, and raised additively while the path is clean, within min_bitrate and max_bitrate. Every time the settings change the listeners are called with an EncoderDecision, from the network thread."""
+
+    def __init__(
+        self,
+        min_bitrate: int = 8000,
+        max_bitrate: int = 64000,
+        start_bitrate: int | None = None,
+        interval: int = 1000,
+        high_loss: float = 0.05,
+        low_loss: float = 0.02,
+        fec_loss: float = 0.01,
+        delay_threshold: int = 100,
+        decrease: float = 0.75,
+    ):
+        """interval is how often the peer is sampled in ms, and delay_threshold the queueing delay in ms that counts as congestion."""
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.bitrate = start_bitrate or max_bitrate
+        self.interval = interval
+        self.high_loss = high_loss
+        self.low_loss = low_loss
+        self.fec_loss = fec_loss
+        self.delay_threshold = delay_threshold
+        self.decrease = decrease
+        self.increase = max(1000, (max_bitrate - min_bitrate) // 20)
+        self.base_rtt: int | None = None
+        self.decision: EncoderDecision | None = None
+        self.listeners: list[Callable[[EncoderDecision], None]] = []
+        self.decisions = 0  # Times the settings changed
+
+    @classmethod
+    def for_profile(cls, profile: "AudioProfile", **kwargs):
+        """A controller for a Transmitter using profile. It starts at the profile's bitrate and never goes above it, as a profile picks its bitrate for a reason. Profiles that leave the bitrate to libopus start at max_bitrate. Other arguments are as for the constructor."""
+        max_bitrate = kwargs.pop("max_bitrate", 64000)
+        if profile.bitrate is not None:
+            max_bitrate = min(max_bitrate, profile.bitrate)
+        kwargs["min_bitrate"] = min(kwargs.get("min_bitrate", 8000), max_bitrate)
+        return cls(max_bitrate=max_bitrate, **kwargs)
+
+    def sample(self, rtt: int, loss: float) -> EncoderDecision | None:
+        """Feed in a round trip time in ms and a loss ratio. Returns the new decision if the settings changed."""
+        if self.base_rtt is None or rtt < self.base_rtt:
+            self.base_rtt = rtt
+        delay = rtt - self.base_rtt
+        if loss > self.high_loss or delay > self.delay_threshold:
+            self.bitrate = max(self.min_bitrate, int(self.bitrate * self.decrease))
+        elif loss < self.low_loss and delay < self.delay_threshold / 2:
+            self.bitrate = min(self.max_bitrate, self.bitrate + self.increase)
+        fec = loss >= self.fec_loss
+        percentage = min(100, math.ceil(loss * 100)) if fec else 0
+        previous = self.decision
+        if (
+            previous is not None
+            and previous.bitrate == self.bitrate
+            and previous.fec == fec
+            and previous.packet_loss_percentage == percentage
+        ):
+            return None
+        self.decision = EncoderDecision(self.bitrate, fec, percentage, rtt, loss)
+        self.decisions += 1
+        for listener in self.listeners:
+            listener(self.decision)
+        return self.decision
+
+    def sample_peer(self, peer) -> EncoderDecision | None:
+        """Sample an enet.Peer. ENet only measures loss on reliable packets, so this is an estimate for the audio channels."""
+        return self.sample(peer.roundTripTime, peer.packetLoss / packet_loss_scale)
@@ -0,0 +1,132 @@
+import time
+from collections import deque
+from enum import Enum
+from threading import Thread, Condition
+from typing import TYPE_CHECKING
+from . import metrics
+
+if TYPE_CHECKING:
+    from .remote_user import RemoteUser
+
+
+class DropPolicy(Enum):
+    DROP_OLDEST = 1  # Make room by throwing away the oldest queued packet
+    DROP_NEWEST = 2  # Refuse the incoming packet
+
+
+class DecodeWorker(Thread):
+    """Decodes the queued packets of the speakers assigned to it. Each speaker always goes to the same worker so its packets are decoded in order by a single thread."""
+
+    def __init__(self, pipeline: "DecodePipeline", index: int):
+        super().__init__(name=f"Decode-thread-{index}", daemon=True)
+        self.pipeline = pipeline
+        self.queues: dict["RemoteUser", deque[tuple[bytes, int | None, float]]] = {}
+        self.ready: deque["RemoteUser"] = deque()  # Users whose queue is not empty
+        self.condition = Condition()
+        self.running = True
+        # Statistics
+        self.decoded = 0
+        self.dropped = 0
+        self.peak_depth = 0
+        self.start()
+
+    def submit(self, user: "RemoteUser", packet: bytes, seq_number: int | None) -> bool:
+        with self.condition:
+            queue = self.queues.setdefault(user, deque())
+            if len(queue) >= self.pipeline.queue_size:
+                self.dropped += 1
+                if self.pipeline.policy is DropPolicy.DROP_NEWEST:
+                    return False
+                queue.popleft()
+            queue.append((packet, seq_number, time.monotonic()))
+            if len(queue) == 1:
+                self.ready.append(user)
+                self.condition.notify()
+            self.peak_depth = max(self.peak_depth, len(queue))
+            return True
+
+    def forget(self, user: "RemoteUser"):
+        with self.condition:
+            queue = self.queues.pop(user, None)
+            if queue:
+                self.ready.remove(user)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.ready:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                user = self.ready.popleft()
+                queue = self.queues[user]
+                packets = list(queue)
+                queue.clear()
+            for packet, seq_number, arrival in packets:
+                user.decode_packet(packet, seq_number, arrival)
+            self.decoded += len(packets)
+
+    def destroy(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.join()
+
+
+class DecodePipeline:
+    """Moves Opus decoding off the network thread. Packets are queued per speaker in bounded queues and decoded by a small pool of workers straight into each RemoteUser's jitter buffer. When a speaker's queue is full, policy decides which packet gets dropped."""
+
+    def __init__(
+        self,
+        workers: int = 2,
+        queue_size: int = 8,
+        policy: DropPolicy = DropPolicy.DROP_OLDEST,
+    ):
+        """Construct a decode pipeline. You must call destroy() to dispose of this object, otherwise the worker threads keep running."""
+        self.queue_size = queue_size
+        self.policy = policy
+        self.workers = [DecodeWorker(self, index) for index in range(workers)]
+        labels = metrics.instance_labels()
+        self.instruments = [
+            metrics.registry.gauge("decode_pipeline.queued", labels, function=lambda: sum(self.queue_depths().values())),
+            metrics.registry.gauge("decode_pipeline.peak_depth", labels, function=lambda: self.peak_depth),
+            metrics.registry.counter("decode_pipeline.decoded", labels, function=lambda: self.decoded),
+            metrics.registry.counter("decode_pipeline.dropped", labels, function=lambda: self.dropped),
+        ]
+
+    def worker_for(self, user: "RemoteUser") -> DecodeWorker:
+        return self.workers[user.id % len(self.workers)]
+
+    def submit(self, user: "RemoteUser", packet: bytes, seq_number: int | None = None) -> bool:
+        """Queue a packet for decoding. Returns False if it was dropped under the DROP_NEWEST policy."""
+        return self.worker_for(user).submit(user, packet, seq_number)
+
+    def forget(self, user: "RemoteUser"):
+        """Throw away anything queued for a user that left."""
+        self.worker_for(user).forget(user)
+
+    def queue_depths(self) -> dict[int, int]:
+        """Current queue depth per user id."""
+        depths = {}
+        for worker in self.workers:
+            with worker.condition:
+                for user, queue in worker.queues.items():
+                    depths[user.id] = len(queue)
+        return depths
+
+    @property
+    def decoded(self) -> int:
+        return sum(worker.decoded for worker in self.workers)
+
+    @property
+    def dropped(self) -> int:
+        return sum(worker.dropped for worker in self.workers)
+
+    @property
+    def peak_depth(self) -> int:
+        return max(worker.peak_depth for worker in self.workers)
+
+    def destroy(self):
+        metrics.registry.unregister(*self.instruments)
+        for worker in self.workers:
+            worker.destroy()
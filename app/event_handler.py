@@ -1,13 +1,68 @@
-from .config import AppConfig
+import queue
+import traceback
+from threading import Thread
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .config import AppConfig
+    from .recorder import Recorder
+
+stop = object()  # Queued to stop the dispatcher. None can't be used, a control message may be msgpack nil
 
 
 class EventHandler:
     """An event handler is responsible for handling packets from the server. It defines methods which corespond to either control events or audio packets. For control events, methods must be defined with the name `event_<name>`, where <name> is the name of the event as sent by the server. It must take a single argument: a dict holding data that come with this event."""
 
-    def __init__(self, client, config: AppConfig):
+    def __init__(self, client, config: "AppConfig", recorder: "Recorder | None" = None):
+        """If a recorder is given, audio() records everything received with it."""
         self.client = client
         self.config = config
+        self.recorder = recorder
+        # Looked up once here instead of with getattr for every event
+        self.handlers = {
+            name[len("event_") :]: getattr(self, name)
+            for name in dir(type(self))
+            if name.startswith("event_") and callable(getattr(self, name))
+        }
+        self.unknown_events = 0  # Events with no handler, or messages that aren't events at all
+
+    def dispatch(self, message):
+        """Calls the handler for a control message, a dict with the event name and its data."""
+        try:
+            handler = self.handlers.get(message["event"])
+        except (TypeError, KeyError):
+            handler = None
+        if handler is None:
+            self.unknown_events += 1
+            return
+        handler(message.get("data"))
 
     def audio(self, user_id: int, seq_number: int, opus_audio: bytes):
-        """Called when an audio packet is receaved"""
-        pass
+        """Called when an audio packet is receaved. Records it if there's a recorder, so overrides should call this as well."""
+        if self.recorder is not None:
+            self.recorder.record(user_id, seq_number, opus_audio)
+
+
+class ControlDispatcher(Thread):
+    """Runs control event handlers on their own thread, so a slow handler can never hold up audio on the network thread."""
+
+    def __init__(self, event_handler: EventHandler):
+        super().__init__(name="Control-thread", daemon=True)
+        self.event_handler = event_handler
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.start()
+
+    def put(self, message):
+        self.queue.put(message)
+
+    def run(self):
+        while (message := self.queue.get()) is not stop:
+            try:
+                self.event_handler.dispatch(message)
+            except Exception:
+                traceback.print_exc()  # One broken handler shouldn't stop the others
+
+    def destroy(self):
+        """Stops the thread once the events already queued were handled."""
+        self.queue.put(stop)
+        self.join()
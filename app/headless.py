@@ -0,0 +1,179 @@
+"""Runs a client without a GUI: `python -m app.headless`.
+
+Connects to the server in the saved configuration (or the one given on the command line), plays what everyone says and sends what the input device captures, until interrupted. Nothing but the network code is imported before connecting: the crypto libraries are imported in the background meanwhile, and the codec and the sound system are loaded and opened while the handshake is under way."""
+import argparse
+import importlib
+import json
+import signal
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING
+from .client import Client, ClientState
+from .config import AppConfig
+from .congestion import CongestionController
+from .event_handler import EventHandler
+from .profiles import default_profile, profiles
+
+if TYPE_CHECKING:
+    from .recorder import Recorder
+
+
+def preload(*modules: str) -> threading.Thread:
+    """Import modules on a thread of its own, so their import overlaps with other work instead of being paid for when they're first used."""
+
+    def load():
+        for module in modules:
+            importlib.import_module(module)
+
+    thread = threading.Thread(target=load, name="Preload-thread", daemon=True)
+    thread.start()
+    return thread
+
+
+class HeadlessEventHandler(EventHandler):
+    """Plays everyone through a RemoteUser, once there's a playout engine. Audio that arrives before that is dropped, but still recorded."""
+
+    def __init__(self, client, config: AppConfig, recorder: "Recorder | None" = None):
+        super().__init__(client, config, recorder)
+        self.engine = None
+        self.users = {}
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def audio(self, user_id: int, seq_number: int, opus_audio: bytes):
+        super().audio(user_id, seq_number, opus_audio)
+        if self.engine is None:
+            self.dropped += 1
+            return
+        user = self.users.get(user_id)
+        if user is None:
+            from .remote_user import RemoteUser
+
+            with self.lock:
+                user = self.users[user_id] = RemoteUser(self.engine, user_id, f"user {user_id}")
+        user.put_packet(opus_audio, seq_number)
+
+    def destroy(self):
+        with self.lock:
+            for user in self.users.values():
+                user.destroy()
+            self.users.clear()
+
+
+def main(argv: list[str] | None = None) -> int:
+    started = time.time()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default=None, help="Configuration file, the one the config screen saves by default")
+    parser.add_argument("--host", default=None, help="Overrides the configuration")
+    parser.add_argument("--port", type=int, default=None, help="Overrides the configuration")
+    parser.add_argument("--profile", choices=sorted(profiles), default=default_profile)
+    parser.add_argument("--fast-session", action="store_true")
+    parser.add_argument("--no-capture", action="store_true", help="Only listen")
+    parser.add_argument("--no-audio", action="store_true", help="Neither play nor capture anything")
+    parser.add_argument("--no-congestion", action="store_true", help="Keep sending at the profile's bitrate instead of adapting it to the connection")
+    parser.add_argument("--trace", default=None, metavar="FILE", help="Capture the packets received into a trace, for replaying with benchmarks.replay")
+    parser.add_argument("--record", default=None, metavar="DIRECTORY", help="Record everyone to Ogg Opus files in this directory")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Connect, get the audio ready, print how long each took (in ms since starting) as JSON and exit. The exit status tells whether it connected",
+    )
+    args = parser.parse_args(argv)
+    preloading = [preload("app.session")]
+    audio = not args.no_audio
+    if audio:
+        preloading.append(preload("cyal", "app.playout", "app.remote_user", "app.transmitter"))
+    config = AppConfig.load(args.config)
+    host = args.host or config.host
+    port = args.port or config.port
+    if not host or not port:
+        parser.error("No server configured, pass --host and --port")
+    connected = threading.Event()
+    closed = threading.Event()
+    timings = {}
+
+    def on_connect(client):
+        timings.setdefault("connected", time.time())
+        connected.set()
+        if transmitter is not None:
+            transmitter.transmitting = True
+
+    def on_disconnect(client):
+        if transmitter is not None:
+            transmitter.transmitting = False
+        if args.check or not client.auto_reconnect:
+            closed.set()
+
+    def send_audio(frame):
+        try:
+            client.send_audio(frame)
+        except BrokenPipeError:
+            pass  # Lost the connection since capturing
+
+    transmitter = None
+    recorder = None
+    if args.record:
+        from .recorder import Recorder
+
+        recorder = Recorder(args.record)
+    client = Client(
+        host,
+        port,
+        lambda client: HeadlessEventHandler(client, config, recorder),
+        on_disconnect=on_disconnect,
+        on_connect=on_connect,
+        on_connection_timeout=lambda client: closed.set() if args.check else None,
+        fast_session=args.fast_session,
+        auto_reconnect=not args.check,
+        call_after=lambda function, *args: function(*args),
+    )
+    if args.trace:
+        client.start_trace(args.trace)
+    client.connect()
+    handler = client.event_handler
+    engine = None
+    if audio:
+        for thread in preloading:
+            thread.join()
+        from .playout import PlayoutEngine
+
+        engine = PlayoutEngine(config.context)
+        if not args.no_capture:
+            from .transmitter import Transmitter
+
+            transmitter = Transmitter(config.input_device_id, send_audio, profile=args.profile)
+            transmitter.transmitting = client.state is ClientState.CONNECTED
+            if not args.no_congestion:
+                congestion = CongestionController.for_profile(transmitter.profile)
+                congestion.listeners.append(transmitter.apply_decision)
+                client.congestion = congestion
+        handler.engine = engine
+        timings["audio_ready"] = time.time()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        if args.check:
+            while not connected.is_set() and not closed.is_set():
+                connected.wait(0.05)
+        else:
+            while not stop.is_set() and not closed.is_set():
+                stop.wait(0.5)
+    except KeyboardInterrupt:
+        pass
+    if transmitter is not None:
+        transmitter.destroy()
+    client.destroy()
+    handler.destroy()
+    if recorder is not None:
+        recorder.destroy()
+    if engine is not None:
+        engine.destroy()
+    if args.check:
+        results = {f"{name}_ms": (moment - started) * 1000 for name, moment in timings.items()}
+        print(json.dumps({"started_at": started, **results}))
+    return 0 if connected.is_set() else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import math
+import time
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+seq_modulo = 0x10000  # Sequence numbers are 16 bit and wrap around
+
+
+def seq_diff(a: int, b: int) -> int:
+    """Signed distance from b to a, taking wraparound into account. Positive if a comes after b."""
+    return ((a - b + 0x8000) & 0xFFFF) - 0x8000
+
+
+class JitterBuffer(Generic[T]):
+    """Reorders frames by their 16 bit sequence number and releases them in order. The number of frames held back before playout starts (the target depth) follows the measured arrival jitter, so clean paths play at the lowest possible latency."""
+
+    def __init__(
+        self,
+        frame_duration: float,
+        min_depth: int = 1,
+        max_depth: int = 10,
+        jitter_factor: float = 4.0,
+        discard: Callable[[T], None] | None = None,
+        pause_threshold: float = 0.25,
+        recover: Callable[[int], T | None] | None = None,
+    ):
+        """frame_duration is the duration of a single frame in seconds. The target depth is kept between min_depth and max_depth frames. discard is called with every frame the buffer throws away, so pooled frames can be given back. A gap of more than pause_threshold seconds between packets is taken as the sender going silent (VAD or DTX), not as jitter or an underrun. recover is called with the sequence number of a frame that is due for playout but never arrived, while a later one did, and may return a frame to play in its place. It's only asked once the frame is due, so a frame that was merely reordered still gets played."""
+        self.frame_duration = frame_duration
+        self.discard = discard
+        self.recover = recover
+        self.pause_threshold = pause_threshold
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.jitter_factor = jitter_factor
+        self.frames: dict[int, T] = {}
+        self.next_seq: int | None = None
+        self.buffering = True
+        self.started = False  # Whether a frame was played since the last reset. Until then, a frame earlier than next_seq moves the start back instead of being late
+        self.jitter = 0.0  # Smoothed interarrival jitter in seconds, as in RFC 3550
+        self.target_depth = min_depth
+        self.last_seq: int | None = None
+        self.last_arrival = 0.0
+        self.starved = False  # Ran dry, and we don't know yet whether it was a pause or an underrun
+        # Statistics
+        self.received = 0
+        self.late = 0
+        self.duplicates = 0
+        self.lost = 0
+        self.underruns = 0
+        self.pauses = 0  # Times the sender went silent, these are not losses
+        self.dropped = 0  # Frames thrown away to bring latency back down to the target
+        self.recovered = 0  # Frames recover() stood in for lost ones with
+
+    def __len__(self):
+        return len(self.frames)
+
+    def reset(self):
+        """Forget every frame and the playout position, for example when the sender restarts."""
+        if self.discard is not None:
+            for frame in self.frames.values():
+                self.discard(frame)
+        self.frames.clear()
+        self.next_seq = None
+        self.last_seq = None
+        self.buffering = True
+        self.started = False
+
+    def wants(self, seq: int) -> bool:
+        """Whether a frame with this sequence number would be accepted, so work on frames that would be rejected can be skipped."""
+        if self.next_seq is None:
+            return True
+        distance = seq_diff(seq, self.next_seq)
+        return abs(distance) >= self.max_depth * 4 or (
+            (distance >= 0 or not self.started) and seq not in self.frames
+        )
+
+    def reject(self, seq: int):
+        """Counts a frame that wants() turned down as late or a duplicate."""
+        if seq in self.frames:
+            self.duplicates += 1
+        else:
+            self.late += 1
+
+    def put(self, seq: int, frame: T, arrival: float | None = None) -> bool:
+        """Store a frame. Returns False if it was rejected for being late or a duplicate, in which case the frame is still owned by the caller."""
+        if arrival is None:
+            arrival = time.monotonic()
+        if self.next_seq is None:
+            self.next_seq = seq
+        distance = seq_diff(seq, self.next_seq)
+        if abs(distance) >= self.max_depth * 4:
+            # Too far off to be jitter, the sender must have restarted or we lost a lot.
+            self.reset()
+            self.next_seq = seq
+        elif distance < 0 and not self.started:
+            # Reordered, but nothing was played yet so it's still in time
+            self.next_seq = seq
+        elif distance < 0:
+            self.late += 1
+            return False
+        elif seq in self.frames:
+            self.duplicates += 1
+            return False
+        self.frames[seq] = frame
+        self.received += 1
+        if self.starved:
+            self.starved = False
+            if arrival - self.last_arrival >= self.pause_threshold:
+                self.pauses += 1
+            else:
+                self.underruns += 1
+        self.update_jitter(seq, arrival)
+        return True
+
+    def update_jitter(self, seq: int, arrival: float):
+        if self.last_seq is not None:
+            elapsed = arrival - self.last_arrival
+            expected = seq_diff(seq, self.last_seq) * self.frame_duration
+            # A long silence between packets is a pause in the talk spurt (or DTX), not jitter.
+            if elapsed < self.pause_threshold:
+                deviation = abs(elapsed - expected)
+                self.jitter += (deviation - self.jitter) / 16
+        self.last_seq = seq
+        self.last_arrival = arrival
+        depth = 1 + math.ceil(self.jitter_factor * self.jitter / self.frame_duration)
+        self.target_depth = max(self.min_depth, min(self.max_depth, depth))
+
+    def pop(self, now: float | None = None) -> tuple[int, T | None] | None:
+        """Returns (seq_number, frame) for the next frame to be played, where frame is None if it was lost. Returns None if there is nothing to play yet. now is the time.monotonic() to play at, and defaults to now."""
+        if self.buffering:
+            if not self.frames:
+                return None
+            if now is None:
+                now = time.monotonic()
+            # Start playing once we hold enough frames, or once the sender went quiet so the tail of a talk spurt isn't stuck here
+            waited = now - self.last_arrival
+            if (
+                len(self.frames) < self.target_depth
+                and waited < self.target_depth * self.frame_duration
+            ):
+                return None
+            self.buffering = False
+            self.started = True
+        if not self.frames:
+            self.starved = True
+            self.buffering = True
+            return None
+        while len(self.frames) > self.target_depth + 2:
+            # We are holding more than jitter requires, catch up.
+            self.skip_oldest()
+        seq = self.next_seq
+        frame = self.frames.pop(seq, None)
+        if frame is None and self.recover is not None:
+            frame = self.recover(seq)
+            if frame is not None:
+                self.recovered += 1
+        if frame is None:
+            self.lost += 1
+        self.next_seq = (seq + 1) % seq_modulo
+        return seq, frame
+
+    def skip_oldest(self):
+        oldest = min(self.frames, key=lambda seq: seq_diff(seq, self.next_seq))
+        frame = self.frames.pop(oldest)
+        if self.discard is not None:
+            self.discard(frame)
+        self.dropped += 1
+        self.next_seq = (oldest + 1) % seq_modulo
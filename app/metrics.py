@@ -0,0 +1,250 @@
+import bisect
+import itertools
+import json
+import math
+import time
+from threading import Thread, Event, RLock
+from typing import Callable
+
+Labels = dict[str, str | int]
+
+# Upper bounds of the default histogram buckets, in seconds: 1 µs doubling up to about 1 s
+default_buckets = tuple(1e-6 * 2**i for i in range(21))
+instance_ids = itertools.count(1)
+
+
+def instance_labels(labels: Labels | None = None) -> Labels:
+    """labels plus an instance label no other caller gets. Components that register function backed metrics or unregister theirs on destroy label them with this, so two clients (or two RemoteUsers for the same user) never share a metric or unregister each other's."""
+    return {"instance": next(instance_ids), **(labels or {})}
+
+
+class Counter:
+    """A value that only goes up. If function is given the value is read from it when snapshotted instead, for counts something else already keeps."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, labels: Labels, function: Callable[[], int] | None = None):
+        self.name = name
+        self.labels = labels
+        self.function = function
+        self.count = 0
+
+    def __bool__(self):
+        return True
+
+    def inc(self, amount: int = 1):
+        self.count += amount
+
+    @property
+    def value(self):
+        return self.function() if self.function is not None else self.count
+
+    def snapshot(self) -> dict:
+        return {"value": self.value}
+
+
+class Gauge(Counter):
+    """A value that goes up and down, such as a queue depth or a round trip time."""
+
+    kind = "gauge"
+
+    def set(self, value: float):
+        self.count = value
+
+
+class Histogram:
+    """Counts observations (durations in seconds by default) into buckets, so percentiles can be estimated without keeping every value. Observing is a bisect and a few additions."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, labels: Labels, buckets: tuple[float, ...] = default_buckets):
+        self.name = name
+        self.labels = labels
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last one counts everything above the highest bound
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __bool__(self):
+        return True
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, point: float) -> float | None:
+        """Estimate of the given percentile: the upper bound of the bucket it falls in, capped at the largest value seen."""
+        if not self.count:
+            return None
+        rank = self.count * point / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], self.max)
+                break
+        return self.max
+
+    def snapshot(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+class NullMetric:
+    """Handed out by a disabled registry. Does nothing and is falsy, so callers can skip timing work with `if metric:`."""
+
+    kind = "null"
+
+    def __bool__(self):
+        return False
+
+    def inc(self, amount: int = 1):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+
+null_metric = NullMetric()
+
+
+class Registry:
+    """Holds every metric. Components get their metrics from the registry when they're constructed, so it must be enabled before that. A disabled registry hands out null_metric, which costs nothing to update.
+
+    Metrics are updated without locking, each from the thread that owns it, so a snapshot taken from another thread may be a little out of date."""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.metrics: dict[tuple[str, tuple], Counter | Gauge | Histogram] = {}
+        self.lock = RLock()
+
+    def get(self, cls, name: str, labels: Labels | None, **kwargs):
+        """Returns the metric with this name and labels, registering it if there's none yet. Metrics updated directly are shared by everyone who asks for them, but a function backed one reads a single owner's state, so asking for one that exists raises ValueError."""
+        if not self.enabled:
+            return null_metric
+        labels = labels or {}
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = cls(name, labels, **kwargs)
+            elif kwargs.get("function") is not None:
+                raise ValueError(f"{name} {labels} is already registered, label it with instance_labels()")
+            return metric
+
+    def counter(self, name: str, labels: Labels | None = None, function: Callable[[], int] | None = None) -> Counter | NullMetric:
+        return self.get(Counter, name, labels, function=function)
+
+    def gauge(self, name: str, labels: Labels | None = None, function: Callable[[], float] | None = None) -> Gauge | NullMetric:
+        return self.get(Gauge, name, labels, function=function)
+
+    def histogram(self, name: str, labels: Labels | None = None, buckets: tuple[float, ...] = default_buckets) -> Histogram | NullMetric:
+        return self.get(Histogram, name, labels, buckets=buckets)
+
+    def unregister(self, *metrics):
+        """Forget metrics, for example those of a user that left."""
+        with self.lock:
+            for metric in metrics:
+                if metric:
+                    key = (metric.name, tuple(sorted(metric.labels.items())))
+                    if self.metrics.get(key) is metric:
+                        del self.metrics[key]
+
+    def snapshot(self) -> dict:
+        """Returns the current value of every metric as a JSON serializable dict."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+        entries = []
+        for metric in metrics:
+            try:
+                values = metric.snapshot()
+            except Exception:  # A function backed metric whose owner is being torn down
+                continue
+            entries.append({"name": metric.name, "type": metric.kind, "labels": metric.labels, **values})
+        return {"time": time.time(), "metrics": entries}
+
+
+registry = Registry()  # The registry components use. Disabled unless enable() is called
+
+
+def enable():
+    """Turn metrics on. Only components constructed afterwards record anything."""
+    registry.enabled = True
+
+
+def disable():
+    """Turn metrics off and forget everything recorded. Components constructed while they were on keep updating their (now unreachable) metrics until they're destroyed."""
+    with registry.lock:
+        registry.enabled = False
+        registry.metrics.clear()
+
+
+class Exporter(Thread):
+    """Periodically exports snapshots of a registry, as a JSON line appended to a file and/or POSTed as JSON to an HTTP endpoint."""
+
+    def __init__(
+        self,
+        interval: float = 10.0,
+        path: str | None = None,
+        url: str | None = None,
+        registry: Registry = registry,
+    ):
+        """interval is in seconds. You must call destroy to stop the exporter, which exports one last time."""
+        super().__init__(name="Metrics-thread", daemon=True)
+        if path is None and url is None:
+            raise ValueError("Metrics need a file or an endpoint to be exported to")
+        self.interval = interval
+        self.path = path
+        self.url = url
+        self.registry = registry
+        self.errors = 0  # Failed exports, which are otherwise ignored
+        self.stopped = Event()
+        self.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+        self.export()
+
+    def export(self):
+        data = json.dumps(self.registry.snapshot())
+        try:
+            if self.path is not None:
+                with open(self.path, "a") as file:
+                    file.write(data + "\n")
+            if self.url is not None:
+                import urllib.request  # Takes longer to import than all of the rest of this module, and is only needed for endpoints
+
+                request = urllib.request.Request(
+                    self.url,
+                    data=data.encode(),
+                    headers={"Content-Type": "application/json"},
+                )
+                urllib.request.urlopen(request, timeout=self.interval).close()
+        except OSError:
+            self.errors += 1
+
+    def destroy(self):
+        self.stopped.set()
+        self.join()
@@ -0,0 +1,45 @@
+import ctypes
+from collections import deque
+import cyal
+
+
+class PcmFrame:
+    """A preallocated block of 16 bit PCM that frames get decoded into and played out of."""
+
+    __slots__ = ("data", "view", "samples", "length", "channels")
+
+    def __init__(self, capacity: int):
+        """capacity is the size of the frame in bytes."""
+        self.data = bytearray(capacity)
+        self.view = memoryview(self.data)
+        self.samples = (ctypes.c_int16 * (capacity // 2)).from_buffer(self.data)  # For handing to libopus
+        self.length = 0  # Bytes of valid audio in data
+        self.channels = 2
+
+    @property
+    def pcm(self) -> memoryview:
+        """The valid audio in this frame, without copying it."""
+        return self.view[: self.length]
+
+    @property
+    def format(self) -> cyal.BufferFormat:
+        return cyal.BufferFormat.STEREO16 if self.channels == 2 else cyal.BufferFormat.MONO16
+
+
+class FramePool:
+    """A fixed set of PcmFrames that get recycled, so the steady state audio path doesn't allocate. acquire() and release() may be called from different threads."""
+
+    def __init__(self, count: int, capacity: int):
+        self.capacity = capacity
+        self.free: deque[PcmFrame] = deque(PcmFrame(capacity) for _ in range(count))
+
+    def acquire(self) -> PcmFrame | None:
+        """Returns a free frame, or None if every frame is in use."""
+        try:
+            return self.free.popleft()
+        except IndexError:
+            return None
+
+    def release(self, frame: PcmFrame):
+        frame.length = 0
+        self.free.append(frame)
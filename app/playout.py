@@ -0,0 +1,129 @@
+import time
+from threading import Thread, RLock, Event
+from typing import TYPE_CHECKING
+import cyal
+
+if TYPE_CHECKING:
+    from .remote_user import RemoteUser
+
+try:
+    import numpy as np
+except ImportError:  # Only needed for software mixing
+    np = None
+
+
+class PlayoutEngine(Thread):
+    """Services the playout of every RemoteUser from a single thread. Users register themselves on construction and unregister on destroy(). Only users that have audio pending are visited, so an idle channel costs nothing no matter how many people are in it.
+
+    With mix=True the streams are summed in software (this needs NumPy) and played through a single OpenAL source instead of one source per user."""
+
+    def __init__(
+        self,
+        context: cyal.Context,
+        frame_size: int = 960,
+        mix: bool = False,
+        mix_buffers: int = 2,
+    ):
+        """Construct a playout engine. frame_size is the number of samples per channel the engine plays per wakeup, and decides how often it wakes up. You must call destroy() to dispose of this object, otherwise there will be a memory leak."""
+        super().__init__(name="Playout-thread", daemon=True)
+        if mix and np is None:
+            raise RuntimeError("Software mixing requires numpy to be installed")
+        self.context = context
+        self.frame_size = frame_size
+        self.interval = frame_size / 48000 / 4  # Wake up 4 times per frame so no source runs dry
+        self.mix = mix
+        self.source = None
+        if mix:
+            self.source = context.gen_source(direct_channels=True)
+            self.free_buffers = context.gen_buffers(mix_buffers)
+            # Preallocated so mixing doesn't allocate a block per frame
+            self.mixed = np.zeros((frame_size, 2), dtype=np.int32)
+            self.output = np.zeros((frame_size, 2), dtype=np.int16)
+            self.output_bytes = memoryview(self.output).cast("B")
+        self.users: dict[int, "RemoteUser"] = {}
+        self.active: set["RemoteUser"] = set()
+        self.lock = RLock()
+        self.wakeup = Event()
+        self.running = True
+        self.start()
+
+    def add(self, user):
+        """Register a user that joined."""
+        with self.lock:
+            self.users[user.id] = user
+
+    def remove(self, user):
+        """Unregister a user that left."""
+        with self.lock:
+            if self.users.get(user.id) is user:
+                del self.users[user.id]
+            self.active.discard(user)
+
+    def activate(self, user):
+        """Called by a user when it got audio, so that it gets serviced until it runs dry."""
+        with self.lock:
+            if self.users.get(user.id) is user:
+                self.active.add(user)
+        self.wakeup.set()
+
+    def deactivate(self, user):
+        with self.lock:
+            if not len(user.jitter_buffer):
+                self.active.discard(user)
+
+    def run(self):
+        while self.running:
+            if not self.active:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            if self.mix:
+                self.update_mix()
+            else:
+                for user in list(self.active):
+                    if not user.update():
+                        self.deactivate(user)
+            time.sleep(self.interval)
+
+    def update_mix(self):
+        processed = self.source.buffers_processed
+        if not processed and not self.free_buffers:
+            return
+        mixed = self.mixed
+        mixed.fill(0)
+        got_audio = False
+        for user in list(self.active):
+            filled = 0
+            while filled < self.frame_size:
+                result = user.read(self.frame_size - filled)
+                if result is None:
+                    break
+                chunk, channels = result
+                # Mono streams broadcast into both channels
+                samples = np.frombuffer(chunk, dtype=np.int16).reshape(-1, channels)
+                mixed[filled : filled + len(samples)] += samples
+                filled += len(samples)
+            if not filled:
+                self.deactivate(user)
+                continue
+            got_audio = True
+        if not got_audio:
+            return
+        if processed:
+            buffer = self.source.unqueue_buffers(max=1)[0]
+        else:
+            buffer = self.free_buffers.pop()
+        np.clip(mixed, -32768, 32767, out=mixed)
+        self.output[:] = mixed
+        buffer.set_data(self.output_bytes, sample_rate=48000, format=cyal.BufferFormat.STEREO16)
+        self.source.queue_buffers(buffer)
+        if self.source.state in [
+            cyal.SourceState.STOPPED,
+            cyal.SourceState.INITIAL,
+        ]:
+            self.source.play()
+
+    def destroy(self):
+        self.running = False
+        self.wakeup.set()
+        self.join()
@@ -0,0 +1,45 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class AudioProfile:
+    """Encoding settings for a Transmitter that are chosen together to trade latency against CPU and bandwidth."""
+
+    name: str
+    frame_size: int  # Samples per channel in a frame, at 48 kHz
+    channels: int
+    application: str  # One of "voip", "audio" or "restricted_lowdelay"
+    bitrate: int | None = None  # Bits per second, None lets libopus decide
+    complexity: int | None = None  # 0 to 10, None keeps the libopus default
+    capture_buffer_size: int = 0  # Capture device buffer in samples per channel, 0 means 4 frames
+
+    @property
+    def frame_duration(self) -> float:
+        """Frame duration in seconds"""
+        return self.frame_size / 48000
+
+    @property
+    def capture_buffer(self) -> int:
+        return self.capture_buffer_size or self.frame_size * 4
+
+
+profiles = {
+    profile.name: profile
+    for profile in [
+        AudioProfile("low_latency", 480, 1, "voip", bitrate=48000, complexity=5),
+        AudioProfile("voice", 960, 1, "voip", bitrate=32000, complexity=10),
+        AudioProfile("low_bandwidth", 2880, 1, "voip", bitrate=12000, complexity=10),
+        AudioProfile("music", 1920, 2, "audio"),  # What we've always sent
+    ]
+}
+default_profile = "music"
+
+
+def get_profile(profile: "AudioProfile | str") -> AudioProfile:
+    """Looks up a profile by name, passing AudioProfile instances through."""
+    if isinstance(profile, AudioProfile):
+        return profile
+    try:
+        return profiles[profile]
+    except KeyError:
+        raise ValueError(f"Unknown audio profile {profile!r}") from None
@@ -0,0 +1,281 @@
+import os
+import threading
+import time
+from enum import Enum
+from typing import TYPE_CHECKING
+import msgpack
+import enet
+from . import structs, channels, trace
+
+if TYPE_CHECKING:
+    from .session import Session
+
+
+class ClientState(Enum):
+    CONNECTING = 1
+    AUTHENTICATING = 2
+    CONNECTED = 3
+    TIMEOUT = 4
+    DISCONNECTED = 5
+
+
+timeout_time = 5000  # ms to connect and authenticate in
+resume_request = b"\x00resume-request"  # Starts a resume request, which otherwise could be taken for an RSA wrapped key
+resume_rejected = b"\x00resume-rejected"  # Sent by the server on the auth channel when it won't honour a resumption ticket
+bundle_delay = 0.1  # Seconds a partly filled bundle of our own frames may wait before it's sent anyway
+
+
+class ClientProtocol:
+    """Everything about talking to a server that doesn't depend on how packets get there or where they end up: the handshake and session resumption, Session crypto, audio framing and bundling, and msgpack control messages. Client drives it from its own thread, AsyncClient from an asyncio event loop.
+
+    Subclasses must have peer (the ENet peer while connected) and disconnect(), hand the ENet events of their connection to handle_event(), call tick() regularly and implement transmit(), deliver_audio(), deliver_message(), on_authenticated() and on_disconnected()."""
+
+    def __init__(
+        self,
+        fast_session: bool = False,
+        resumption: bool = False,
+        bundling: bool = False,
+        bundle_frames: int = 1,
+        bundle_size: int = 1200,
+    ):
+        self.state = ClientState.DISCONNECTED
+        self.session: "Session | None" = None
+        self.fast_session = fast_session
+        self.rejected_packets = 0  # Packets that failed authentication or were replayed
+        self.auth_random_bytes = os.urandom(32)
+        self.resumption = resumption
+        self.ticket: bytes | None = None  # Last resumption ticket from the server, they're single use
+        self.resume_key: bytes | None = None  # Key of the session the ticket belongs to
+        self.resuming = False
+        self.server_public_key: bytes | None = None
+        self.unpacker = msgpack.Unpacker()
+        self.unpacked = 0  # Bytes fed to the unpacker, to notice truncated messages
+        self.bundling = bundling
+        self.bundle_frames = bundle_frames
+        self.bundle_size = bundle_size
+        self.bundled = False  # Whether the server agreed to bundling for this connection, after which our frames go out bundled
+        self.bundle = bytearray()  # Our frames waiting to be sent as one packet
+        self.bundle_count = 0
+        self.bundle_seq_number = 0
+        self.bundle_deadline = 0.0
+        self.bundle_lock = threading.RLock()
+        self.trace: trace.TraceWriter | None = None  # Set while capturing a trace
+
+    def transmit(self, channel: int, data: bytes, flags: int):
+        """Send a packet to the server. May be called from any thread the subclass allows sending from."""
+        raise NotImplementedError
+
+    def deliver_audio(self, user_id: int, seq_number: int, opus_audio: memoryview):
+        """Called with every received audio frame"""
+        raise NotImplementedError
+
+    def deliver_message(self, message):
+        """Called with every received control message that isn't part of the protocol itself"""
+        raise NotImplementedError
+
+    def on_authenticated(self):
+        raise NotImplementedError
+
+    def on_disconnected(self):
+        """Called when the connection was lost, rather than closed with disconnect()"""
+        raise NotImplementedError
+
+    def new_connection(self):
+        """Call before connecting."""
+        self.auth_random_bytes = os.urandom(32)
+        self.reset_bundling()
+
+    def start_trace(self, path: str):
+        """Start capturing every decrypted audio and control packet received into a trace file at path, to be replayed with trace.replay(). Packets on the auth channel are left out, as they hold resumption tickets."""
+        self.stop_trace()
+        self.trace = trace.TraceWriter(path)
+
+    def stop_trace(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def tick(self):
+        """Sends a partly filled bundle that has waited long enough."""
+        if self.bundle_count and time.monotonic() >= self.bundle_deadline:
+            self.flush_bundle()
+
+    def handle_event(self, event):
+        if event.type == enet.EVENT_TYPE_CONNECT:
+            self.state = ClientState.AUTHENTICATING
+            self.session = None
+            self.server_public_key = None
+            if self.resumption and self.ticket is not None:
+                self.resume()
+        elif event.type == enet.EVENT_TYPE_DISCONNECT:
+            self.state = ClientState.DISCONNECTED
+            self.peer = None
+            self.session = None
+            self.on_disconnected()
+        elif event.type == enet.EVENT_TYPE_RECEIVE:
+            self.receive(event.channelID, event.packet.data)
+
+    def receive(self, channel: int, data: bytes):
+        if self.state is ClientState.AUTHENTICATING:
+            if channel == channels.auth:
+                if self.resuming:
+                    if data == self.auth_random_bytes:
+                        self.authenticated()
+                    elif data == resume_rejected:
+                        self.resuming = False
+                        self.session = None
+                        if self.server_public_key is not None:
+                            self.handshake(self.server_public_key)
+                    else:
+                        # The server sends its public key on connect, keep it in case the ticket gets rejected
+                        self.server_public_key = data
+                elif not self.session:
+                    # The servre gave us its public key
+                    self.handshake(data)
+                elif data == self.auth_random_bytes:
+                    self.authenticated()
+                else:
+                    return self.disconnect()
+        elif self.state is ClientState.CONNECTED:
+            try:
+                data = self.session.decrypt(data, channel)
+            except ValueError:
+                self.rejected_packets += 1
+                return
+            if self.trace is not None and channel != channels.auth:
+                if channel == channels.audio_out:
+                    kind = trace.audio
+                elif channel == channels.audio_bundle_out:
+                    kind = trace.audio_bundle
+                else:
+                    kind = trace.control
+                self.trace.record(kind, data)
+            if channel == channels.audio_out:
+                self.receive_audio(data)
+                return
+            if channel == channels.audio_bundle_out:
+                self.receive_audio(data, bundled=True)
+                return
+            for message in self.unpack(data):
+                if channel != channels.auth:
+                    self.deliver_message(message)
+                elif not isinstance(message, dict):
+                    continue
+                elif message.get("event") == "resumption_ticket":
+                    self.ticket = message["data"]["ticket"]
+                    self.resume_key = self.session.aes_key
+                elif message.get("event") == "bundling" and self.bundling:
+                    self.bundle_frames = max(1, min(self.bundle_frames, message["data"]["frames"]))
+                    self.bundle_size = min(self.bundle_size, message["data"]["size"])
+                    self.bundled = True
+
+    def receive_audio(self, data: bytes, bundled: bool = False):
+        """Delivers the frames in a decrypted audio packet, as views of the packet rather than copies. bundled is whether it came on the bundle channel: whether bundling was agreed on can't tell, as the agreement comes on the auth channel and ENet doesn't order packets across channels."""
+        for user_id, seq_number, opus_audio in trace.audio_frames(trace.audio_bundle if bundled else trace.audio, data):
+            self.deliver_audio(user_id, seq_number, opus_audio)
+
+    def unpack(self, data: bytes) -> list:
+        """Decodes the msgpack messages in a decrypted packet with the reused unpacker. A malformed packet yields nothing and doesn't affect the next ones."""
+        self.unpacker.feed(data)
+        self.unpacked += len(data)
+        try:
+            messages = list(self.unpacker)
+        except (ValueError, msgpack.UnpackException):
+            messages = []
+        if self.unpacker.tell() != self.unpacked:
+            # Leftovers of a truncated or broken message would corrupt the next packet
+            self.unpacker = msgpack.Unpacker()
+            self.unpacked = 0
+        return messages
+
+    def handshake(self, public_key: bytes):
+        """Full handshake: send the server a fresh AES key wrapped with its public key, and prove we have it."""
+        from .session import Session  # The crypto libraries take a while to import, so not before they're needed
+
+        self.session = Session(public_key, fast=self.fast_session)
+        self.transmit(channels.auth, self.session.get_encrypted_aes_key(), enet.PACKET_FLAG_RELIABLE)
+        self.transmit(channels.auth, self.session.encrypt(self.auth_random_bytes, channels.auth), enet.PACKET_FLAG_RELIABLE)
+
+    def resume(self):
+        """Ask the server to restore our last session from its ticket. A new key is derived from the old one and a fresh salt, so packet counters can start over safely. The request is resume_request followed by a msgpack map, and the server answers with our random bytes, or with resume_rejected."""
+        from .session import Session
+
+        salt = os.urandom(16)
+        self.session = Session.resume(self.resume_key, salt, fast=self.fast_session)
+        self.resuming = True
+        self.transmit(
+            channels.auth,
+            resume_request
+            + msgpack.dumps(
+                {
+                    "ticket": self.ticket,
+                    "salt": salt,
+                    "proof": self.session.encrypt(self.auth_random_bytes, channels.auth),
+                }
+            ),
+            enet.PACKET_FLAG_RELIABLE,
+        )
+        self.ticket = None
+
+    def authenticated(self):
+        self.state = ClientState.CONNECTED
+        self.resuming = False
+        if self.bundling:
+            self.send_message(channels.auth, "bundling", {"frames": self.bundle_frames, "size": self.bundle_size})
+        self.on_authenticated()
+
+    def send_message(self, channel, event, data=None):
+        # Senders don't hold the lock, so read the session once: a disconnect may clear it at any point
+        session = self.session
+        if self.state is not ClientState.CONNECTED or session is None:
+            raise BrokenPipeError(
+                "Attempted sending a packet to a client that is not connected."
+            )
+        if channel in [channels.audio_in, channels.audio_out, channels.audio_bundle_in, channels.audio_bundle_out]:
+            raise ValueError("Can't send non-audio packets to audio channel")
+        if data is None:
+            data = {}
+        self.transmit(
+            channel,
+            session.encrypt(msgpack.dumps({"event": event, "data": data}), channel),
+            enet.PACKET_FLAG_RELIABLE,
+        )
+
+    def send_frame(self, audio):
+        session = self.session
+        if self.state is not ClientState.CONNECTED or session is None:
+            raise BrokenPipeError(
+                "Attempted sending a packet to a client that is not connected."
+            )
+        if not self.bundled:
+            self.transmit(channels.audio_in, session.encrypt(audio, channels.audio_in), 0)
+            return
+        entry = structs.audio_bundle_entry
+        with self.bundle_lock:
+            if self.bundle_count and len(self.bundle) + entry.size + len(audio) > self.bundle_size:
+                self.flush_bundle()
+            if not self.bundle_count:
+                self.bundle_deadline = time.monotonic() + bundle_delay
+            self.bundle += entry.pack(0, self.bundle_seq_number, len(audio))
+            self.bundle += audio
+            self.bundle_seq_number = (self.bundle_seq_number + 1) & 0xFFFF
+            self.bundle_count += 1
+            if self.bundle_count >= self.bundle_frames:
+                self.flush_bundle()
+
+    def flush_bundle(self):
+        """Send our bundled frames as one packet."""
+        with self.bundle_lock:
+            session = self.session
+            if not self.bundle_count or session is None:
+                return
+            self.transmit(channels.audio_bundle_in, session.encrypt(self.bundle, channels.audio_bundle_in), 0)
+            self.bundle.clear()
+            self.bundle_count = 0
+
+    def reset_bundling(self):
+        """Forget what was agreed for the last connection."""
+        with self.bundle_lock:
+            self.bundled = False
+            self.bundle.clear()
+            self.bundle_count = 0
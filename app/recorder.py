@@ -0,0 +1,241 @@
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from threading import Thread, Event
+from . import metrics
+from .jitter_buffer import seq_diff
+
+ogg_page_header = struct.Struct("<4sBBqIIIB")  # capture pattern, version, flags, granule position, serial, page sequence, checksum, segment count
+first_page = 0x02
+last_page = 0x04
+max_segments = 255
+vendor = b"sonorous"
+# Ogg checksums are CRC-32 without bit reflection, zlib's are reflected. Reversing the bits of every byte going in and of the result coming out turns one into the other
+reversed_bits = bytes(int(f"{byte:08b}"[::-1], 2) for byte in range(256))
+
+
+def ogg_crc(data: bytes) -> int:
+    """The CRC of an Ogg page, computed by zlib"""
+    # XORing with the CRC of as many zeros cancels out zlib's initial value and final XOR
+    crc = zlib.crc32(data.translate(reversed_bits)) ^ zlib.crc32(bytes(len(data)))
+    return int(f"{crc:032b}"[::-1], 2)
+
+
+def opus_packet_samples(packet: bytes) -> int:
+    """Samples per channel (at 48 kHz) in an Opus packet, from its TOC byte (RFC 6716, section 3.1)"""
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:  # SILK: 10, 20, 40, 60 ms
+        frame = (480, 960, 1920, 2880)[config & 3]
+    elif config < 16:  # Hybrid: 10, 20 ms
+        frame = 480 << (config & 1)
+    else:  # CELT: 2.5, 5, 10, 20 ms
+        frame = 120 << (config & 3)
+    code = toc & 3
+    if code == 0:
+        return frame
+    if code in (1, 2):
+        return frame * 2
+    return frame * (packet[1] & 0x3F) if len(packet) > 1 else 0
+
+
+class OggOpusStream:
+    """Writes one speaker's Opus packets to an Ogg Opus file (RFC 7845) as they are, reordering them by sequence number within a small window. Granule positions follow the sequence numbers: a packet that never showed up is replaced with an empty frame of the same length, which players conceal, so the file keeps its timing."""
+
+    def __init__(self, path: str, serial: int, reorder: int = 8):
+        self.path = path
+        self.file = None
+        self.serial = serial
+        self.reorder = reorder
+        self.page_number = 0
+        self.granule = 0
+        self.held: dict[int, bytes] = {}  # Packets waiting for the ones before them
+        self.next_seq: int | None = None
+        self.last_toc: int | None = None  # For filling in lost packets
+        self.ready: list[bytes] = []  # In order, waiting to be paged
+        self.ready_granule = 0
+        self.late = 0
+        self.filled = 0
+
+    def add(self, seq_number: int, packet: bytes):
+        if not packet:
+            self.late += 1
+            return
+        if self.next_seq is None:
+            self.next_seq = seq_number
+        distance = seq_diff(seq_number, self.next_seq)
+        if abs(distance) > self.reorder * 4:
+            # Too far off to be reordering, start over from here (the speaker reconnected, or a long outage)
+            self.release_all()
+            self.next_seq = seq_number
+        elif distance < 0 or seq_number in self.held:
+            self.late += 1
+            return
+        self.held[seq_number] = packet
+        while self.held:
+            if self.next_seq in self.held:
+                self.emit(self.held.pop(self.next_seq))
+            elif len(self.held) > self.reorder:
+                self.fill()  # Give up waiting for it
+            else:
+                break
+
+    def release_all(self):
+        while self.held:
+            if self.next_seq in self.held:
+                self.emit(self.held.pop(self.next_seq))
+            else:
+                self.fill()
+
+    def emit(self, packet: bytes):
+        self.last_toc = packet[0]
+        self.ready.append(packet)
+        self.ready_granule += opus_packet_samples(packet)
+        self.next_seq = (self.next_seq + 1) & 0xFFFF
+
+    def fill(self):
+        """Stand in for a lost packet with a TOC byte alone: a frame of the same length with no data."""
+        if self.last_toc is None:
+            self.next_seq = (self.next_seq + 1) & 0xFFFF
+            return
+        self.filled += 1
+        self.emit(bytes([self.last_toc & 0xFC]))
+
+    def headers(self, channels: int) -> bytes:
+        head = struct.pack("<8sBBHIhB", b"OpusHead", 1, channels, 0, 48000, 0, 0)
+        tags = b"OpusTags" + struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", 0)
+        return self.page([head], 0, first_page) + self.page([tags], 0)
+
+    def page(self, packets: list[bytes], granule: int, flags: int = 0) -> bytes:
+        lacing = bytearray()
+        for packet in packets:
+            lacing += b"\xff" * (len(packet) // 255)
+            lacing.append(len(packet) % 255)
+        header = ogg_page_header.pack(
+            b"OggS", 0, flags, granule, self.serial, self.page_number, 0, len(lacing)
+        )
+        page = bytearray(header)
+        page += lacing
+        for packet in packets:
+            page += packet
+        struct.pack_into("<I", page, 22, ogg_crc(bytes(page)))
+        self.page_number += 1
+        return bytes(page)
+
+    def flush(self, final: bool = False) -> bytes:
+        """Returns the pages for everything ready so far. With final, also what's still held back for reordering, and the stream is ended."""
+        if final:
+            self.release_all()
+        output = bytearray()
+        if self.file is None:
+            if not self.ready:
+                return b""
+            output += self.headers(2 if self.ready[0][0] & 0x04 else 1)
+        packets, self.ready = self.ready, []
+        granule = self.granule
+        self.granule = self.ready_granule
+        page: list[bytes] = []
+        segments = 0
+        for packet in packets:
+            needed = len(packet) // 255 + 1
+            if segments + needed > max_segments:
+                output += self.page(page, granule)
+                page, segments = [], 0
+            page.append(packet)
+            segments += needed
+            granule += opus_packet_samples(packet)
+        if page or final:
+            output += self.page(page, self.granule, last_page if final else 0)
+        return bytes(output)
+
+
+class Recorder(Thread):
+    """Archives what everyone says, by writing each speaker's Opus packets straight into an Ogg Opus file of its own without decoding them.
+
+    record() is meant to be called from EventHandler.audio, and only queues the packet, so it costs the network thread next to nothing. The recorder's own thread writes everything queued every flush_interval seconds, in one write per file. At most queue_size packets are queued, anything past that is dropped and counted."""
+
+    def __init__(self, directory: str, flush_interval: float = 1.0, queue_size: int = 10000, reorder: int = 8):
+        """You must call destroy() to finish the files properly."""
+        super().__init__(name="Recorder-thread", daemon=True)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.reorder = reorder
+        self.queue: deque[tuple[int, int, bytes | None]] = deque()
+        self.streams: dict[int, OggOpusStream] = {}
+        self.started = time.strftime("%Y%m%d-%H%M%S")
+        self.serials = 0
+        self.stopped = Event()
+        # Statistics
+        self.dropped = 0
+        self.written = 0  # Bytes
+        labels = metrics.instance_labels()
+        self.instruments = [
+            metrics.registry.gauge("recorder.queued", labels, function=lambda: len(self.queue)),
+            metrics.registry.counter("recorder.dropped", labels, function=lambda: self.dropped),
+            metrics.registry.counter("recorder.written", labels, function=lambda: self.written),
+        ]
+        self.start()
+
+    def record(self, user_id: int, seq_number: int, packet: bytes):
+        """Queue a received packet for writing. packet may be a view, as long as what it views isn't changed afterwards."""
+        if len(self.queue) >= self.queue_size:
+            self.dropped += 1
+            return
+        self.queue.append((user_id, seq_number, packet))
+
+    def stop(self, user_id: int):
+        """Finish the file of a speaker that left. If they come back, they get a new file."""
+        self.queue.append((user_id, 0, None))
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.write()
+        self.write()
+        for user_id in list(self.streams):
+            self.finish(user_id)
+
+    def write(self):
+        streams = set()
+        for _ in range(len(self.queue)):
+            user_id, seq_number, packet = self.queue.popleft()
+            if packet is None:
+                if user_id in self.streams:
+                    streams.discard(self.streams[user_id])
+                    self.finish(user_id)
+                continue
+            stream = self.streams.get(user_id)
+            if stream is None:
+                stream = self.streams[user_id] = self.open(user_id)
+            stream.add(seq_number, packet)
+            streams.add(stream)
+        for stream in streams:
+            self.append(stream, stream.flush())
+
+    def open(self, user_id: int) -> OggOpusStream:
+        self.serials += 1
+        name = f"{self.started}-user{user_id}-{self.serials}.opus"
+        return OggOpusStream(os.path.join(self.directory, name), self.serials, self.reorder)
+
+    def append(self, stream: OggOpusStream, data: bytes):
+        if not data:
+            return
+        if stream.file is None:
+            stream.file = open(stream.path, "wb")
+        stream.file.write(data)
+        stream.file.flush()
+        self.written += len(data)
+
+    def finish(self, user_id: int):
+        stream = self.streams.pop(user_id)
+        self.append(stream, stream.flush(final=True))
+        if stream.file is not None:
+            stream.file.close()
+
+    def destroy(self):
+        self.stopped.set()
+        self.join()
+        metrics.registry.unregister(*self.instruments)
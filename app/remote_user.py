@@ -1,69 +1,215 @@
 import time
-from threading import Thread, RLock
-from collections import deque
-from pyogg.opus_decoder import OpusDecoder
+from functools import partial
+from threading import Lock, RLock
 import cyal
+from .codec import Decoder
+from .decode_pipeline import DecodePipeline
+from .jitter_buffer import JitterBuffer, seq_diff
+from .pcm_pool import FramePool, PcmFrame
+from .playout import PlayoutEngine
+from . import metrics
 
+playout_buffers = 4  # OpenAL buffers per source, enough to cover playout_time with short frames
+playout_time = 0.04  # Seconds of audio kept queued on the source. The jitter buffer does the real buffering, but the device may consume audio in larger periods than a frame
+max_frame_size = 2880  # Samples per channel in the longest frame we accept (60 ms)
 
-class RemoteUser(Thread):
+
+class RemoteUser:
     """Represents another connected user"""
 
     def __init__(
         self,
-        context: cyal.Context,
+        engine: PlayoutEngine,
         id: int,
         display_name: str,
-        jitter_buffer_size: int = 3,
+        jitter_buffer_size: int = 10,
+        frame_size: int = 1920,
+        pipeline: DecodePipeline | None = None,
+        recovery: int = 0,
     ):
-        """Construct a new RemoteUser. You must call destroy() to dispose of this object otherwise a memory leak happens."""
-        super().__init__(name=f"RemoteUser-{id}-{display_name}", daemon=True)
-        self.context = context
+        """Construct a new RemoteUser and register it with the playout engine. frame_size is only a first guess, the frame size and channel count of the sender are picked up from its packets. jitter_buffer_size is the most frames the jitter buffer may hold back when the network gets jittery. If a decode pipeline is given, put_packet() only queues packets and the pipeline's workers decode them, otherwise they're decoded by the calling thread. recovery is the most missing frames in a row that are filled in, once they're due for playout without having arrived: the last one from the in-band FEC in the packet after it (if the sender enabled it), the others with packet loss concealment. As that's decided at playout, a frame that was only reordered is played as sent. 0 leaves gaps. You must call destroy() to dispose of this object otherwise a memory leak happens."""
+        self.engine = engine
+        self.pipeline = pipeline
+        self.context = engine.context
         self.id = id
         self.display_name = display_name
         self.jitter_buffer_size = jitter_buffer_size
-        self.chunks = deque(maxlen=jitter_buffer_size)
-        self.buffering = True
-        self.decoder = OpusDecoder()
-        self.decoder.set_sampling_frequency(48000)
-        self.decoder.set_channels(2)
-        self.source = context.gen_source(direct_channels=True)
+        self.recovery = recovery
+        # Enough frames for a full jitter buffer, plus the ones being decoded or recovered and the one being played
+        self.pool = FramePool(jitter_buffer_size + 4 + recovery, max_frame_size * 2 * 2)
+        self.jitter_buffer: JitterBuffer[PcmFrame] = JitterBuffer(
+            frame_size / 48000,
+            max_depth=jitter_buffer_size,
+            discard=self.pool.release,
+            recover=self.recover if recovery else None,
+        )
+        self.next_seq_number = 0  # Used for packets that come without a sequence number
+        self.decoder = Decoder(channels=2)
+        # Recovery decodes on the playout thread, while packets are decoded wherever they're received
+        self.decoder_lock = Lock()
+        self.decode_drops = 0  # Packets dropped because every frame in the pool was in use
+        self.last_decoded: int | None = None  # Sequence number of the last packet the decoder saw
+        self.last_samples = 0  # Samples per channel in that packet
+        # Copies of packets that arrived after a gap, by sequence number, for the FEC data they carry about the frame before them
+        self.fec_packets: dict[int, bytes] = {}
+        self.last_recovered: int | None = None
+        self.recovered_run = 0  # Frames recovered in a row
+        # When the engine mixes in software it owns the only source
+        if engine.mix:
+            self.source = None
+            self.free_buffers = []
+        else:
+            self.source = self.context.gen_source(direct_channels=True)
+            self.free_buffers = self.context.gen_buffers(playout_buffers)
+        self.source_format = cyal.BufferFormat.STEREO16
+        self.current: PcmFrame | None = None  # Frame being read in software mixing mode
+        self.offset = 0
         self.lock = RLock()
-        self.running = True
-        self.start()
-
-    def put_packet(self, packet: bytes):
-        self.chunks.append(bytes(self.decoder.decode(memoryview(bytearray(packet)))))
-        if self.buffering and len(self.chunks) >= self.jitter_buffer_size:
-            self.buffering = False
+        labels = metrics.instance_labels({"user": id})
+        self.decode_time = metrics.registry.histogram("remote_user.decode_time", labels)
+        # Everything else is read from the jitter buffer's own statistics when snapshotted
+        self.instruments = [
+            self.decode_time,
+            metrics.registry.counter("remote_user.decode_drops", labels, partial(getattr, self, "decode_drops")),
+            metrics.registry.gauge("remote_user.jitter_depth", labels, self.jitter_buffer.__len__),
+            metrics.registry.gauge("remote_user.target_depth", labels, partial(getattr, self.jitter_buffer, "target_depth")),
+            metrics.registry.gauge("remote_user.jitter", labels, partial(getattr, self.jitter_buffer, "jitter")),
+        ]
+        for name in ["received", "late", "duplicates", "lost", "underruns", "dropped", "recovered"]:
+            self.instruments.append(
+                metrics.registry.counter(f"remote_user.{name}", labels, partial(getattr, self.jitter_buffer, name))
+            )
+        engine.add(self)
 
-    def get_chunk(self):
-        chunk = self.chunks.pop()
-        return chunk
+    def put_packet(self, packet: bytes, seq_number: int | None = None):
+        if self.pipeline is not None:
+            self.pipeline.submit(self, packet, seq_number)
+        else:
+            self.decode_packet(packet, seq_number)
 
-    def update(self):
-        if self.buffering or not self.chunks:
+    def decode_packet(
+        self, packet: bytes, seq_number: int | None = None, arrival: float | None = None
+    ):
+        """Decode a packet into the jitter buffer. arrival is the time.monotonic() the packet was received at, and defaults to now."""
+        if seq_number is None:
+            seq_number = self.next_seq_number
+        self.next_seq_number = (seq_number + 1) & 0xFFFF
+        if self.recovery:
+            with self.lock:
+                wanted = self.jitter_buffer.wants(seq_number)
+                if not wanted:
+                    self.jitter_buffer.reject(seq_number)
+                elif self.last_decoded is not None and seq_diff(seq_number, self.last_decoded) > 1:
+                    # The frames before this one may never show up
+                    if len(self.fec_packets) >= self.jitter_buffer_size:
+                        del self.fec_packets[next(iter(self.fec_packets))]
+                    self.fec_packets[seq_number] = bytes(packet)
+            if not wanted:
+                return  # Too late to play
+        frame = self.pool.acquire()
+        if frame is None:
+            self.decode_drops += 1
+            return
+        if self.decode_time:
+            started = time.perf_counter()
+        try:
+            with self.decoder_lock:
+                samples = self.decoder.decode_into(packet, frame)
+        except (RuntimeError, ValueError):
+            self.pool.release(frame)
+            return
+        if self.decode_time:
+            self.decode_time.observe(time.perf_counter() - started)
+        self.last_decoded = seq_number
+        self.last_samples = samples
+        with self.lock:
+            if samples:
+                self.jitter_buffer.frame_duration = samples / 48000
+            accepted = self.jitter_buffer.put(seq_number, frame, arrival)
+        if not accepted:
+            self.pool.release(frame)
             return
+        self.engine.activate(self)
+
+    def recover(self, seq_number: int) -> PcmFrame | None:
+        """Called by the jitter buffer, with the lock held, when the frame with this sequence number is due for playout but never arrived. Rebuilds it from the FEC data in the packet after it if we have that packet, or conceals it, as long as no more than recovery frames in a row were recovered. The decoder has moved past the lost frame by then, so this is a little rougher than recovering in order, but nothing that merely arrives late is replaced."""
+        if self.last_recovered is not None and seq_number == (self.last_recovered + 1) & 0xFFFF:
+            self.recovered_run += 1
+        else:
+            self.recovered_run = 1
+        self.last_recovered = seq_number
+        following = self.fec_packets.pop((seq_number + 1) & 0xFFFF, None)
+        if self.recovered_run > self.recovery or not self.last_samples:
+            return None
+        frame = self.pool.acquire()
+        if frame is None:
+            self.decode_drops += 1
+            return None
+        try:
+            with self.decoder_lock:
+                if following is not None:
+                    self.decoder.decode_into(following, frame, fec=True, samples=self.last_samples)
+                else:
+                    self.decoder.conceal_into(frame, self.last_samples)
+        except (RuntimeError, ValueError):
+            self.pool.release(frame)
+            return None
+        return frame
+
+    def get_chunk(self, now: float | None = None) -> PcmFrame | None:
+        """Returns the next frame to play, skipping over lost ones, or None if there's nothing to play right now. The caller must give the frame back to the pool once it's done with it."""
+        while (entry := self.jitter_buffer.pop(now)) is not None:
+            if entry[1] is not None:
+                return entry[1]
+        return None
+
+    def read(self, samples: int, now: float | None = None) -> tuple[memoryview, int] | None:
+        """Returns up to samples samples per channel of PCM for software mixing, along with its channel count, or None if there's nothing to play right now. The returned view is only valid until the next call. now is as for JitterBuffer.pop()."""
         with self.lock:
-            if self.source.buffers_processed:
+            if self.current is not None and self.offset >= self.current.length:
+                self.pool.release(self.current)
+                self.current = None
+            if self.current is None:
+                self.current = self.get_chunk(now)
+                self.offset = 0
+                if self.current is None:
+                    return None
+            start = self.offset
+            self.offset = min(start + samples * self.current.channels * 2, self.current.length)
+            return self.current.view[start : self.offset], self.current.channels
+
+    def update(self) -> bool:
+        """Feeds the source from the jitter buffer. Called by the playout engine. Returns whether there is still audio pending or playing."""
+        with self.lock:
+            playing = self.source.state == cyal.SourceState.PLAYING
+            processed = self.source.buffers_processed
+            if not processed:
+                queued = self.source.buffers_queued * self.jitter_buffer.frame_duration
+                if not self.free_buffers or (playing and queued >= playout_time):
+                    return True
+            frame = self.get_chunk()
+            if frame is None:
+                return playing or bool(len(self.jitter_buffer))
+            if frame.format != self.source_format:
+                # Every buffer queued on a source must have the same format, so start over when the sender switches channel count
+                self.source.stop()
+                self.free_buffers.extend(self.source.unqueue_buffers())
+                self.source_format = frame.format
+                processed = 0
+                playing = False
+            if processed:
                 buffer = self.source.unqueue_buffers(max=1)[0]
-            elif self.source.buffers_queued < self.jitter_buffer_size:
-                buffer = self.context.gen_buffer()
             else:
-                return
-            chunk = self.get_chunk()
-            buffer.set_data(chunk, sample_rate=48000, format=cyal.BufferFormat.STEREO16)
+                buffer = self.free_buffers.pop()
+            buffer.set_data(frame.pcm, sample_rate=48000, format=frame.format)
+            self.pool.release(frame)  # OpenAL has its own copy now
             self.source.queue_buffers(buffer)
-            if self.source.state in [
-                cyal.SourceState.STOPPED,
-                cyal.SourceState.INITIAL,
-            ]:
+            if not playing:
                 self.source.play()
-
-    def run(self):
-        while self.running:
-            self.update()
-            time.sleep(0.001)
+            return True
 
     def destroy(self):
-        self.running = False
-        self.join()
+        self.engine.remove(self)
+        metrics.registry.unregister(*self.instruments)
+        if self.pipeline is not None:
+            self.pipeline.forget(self)
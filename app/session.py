@@ -1,27 +1,158 @@
+import itertools
 import os
+import time
+from Crypto.Hash import SHA256
+from Crypto.Protocol.KDF import HKDF
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import AES, PKCS1_OAEP
+from . import channels, metrics
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:  # Optional, lets fast sessions keep one cipher object per direction
+    AESGCM = None
+
+counter_size = 8  # Bytes of packet counter sent in front of every fast mode packet
+tag_size = 16
+
+
+class ReplayWindow:
+    """Remembers which of the last size packet counters were received, so replayed packets can be rejected (as in RFC 4303)."""
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self.highest = -1
+        self.bitmap = 0  # Bit n is set if highest - n was received
+
+    def check(self, counter: int) -> bool:
+        """Returns whether a packet with this counter may be accepted."""
+        if counter > self.highest:
+            return True
+        offset = self.highest - counter
+        return offset < self.size and not (self.bitmap >> offset) & 1
+
+    def update(self, counter: int):
+        """Marks a counter as received. Only call this once the packet was authenticated."""
+        if counter > self.highest:
+            shift = counter - self.highest
+            self.bitmap = ((self.bitmap << shift) | 1) & ((1 << self.size) - 1)
+            self.highest = counter
+        else:
+            self.bitmap |= 1 << (self.highest - counter)
 
 
 class Session:
-    """Handles encryption/decryption for a session."""
+    """Handles encryption/decryption for a session.
 
-    def __init__(self, public_key: bytes):
+    In the default mode packets are a 12 byte nonce followed by the AES-GCM ciphertext, with no tag. In fast mode (which the server must be using too) separate keys are derived for each direction, the nonce is the channel and a packet counter of which only counter_size bytes are sent, the GCM tag is appended and checked, and replayed packets are rejected.
+
+    Fast mode counts packets and checks for replays per channel, because ENet delivers every channel on its own: a reliable packet that had to be resent arrives after any number of newer packets on the other channels, and would be too old for a window shared with them."""
+
+    def __init__(
+        self,
+        public_key: bytes | None,
+        fast: bool = False,
+        aes_key: bytes | None = None,
+        server: bool = False,
+    ):
+        """public_key is the server's RSA key. aes_key and server are for the server's side of a session, which already has the key and sends in the other direction."""
         self.public_key = public_key
-        self.rsa = RSA.import_key(public_key)
-        self.rsa_cipher = PKCS1_OAEP.new(self.rsa)
-        self.aes_key = os.urandom(32)
+        if public_key is not None:
+            self.rsa = RSA.import_key(public_key)
+            self.rsa_cipher = PKCS1_OAEP.new(self.rsa)
+        self.aes_key = aes_key or os.urandom(32)
+        self.fast = fast
+        # Nonces are unique per key as long as the counter doesn't repeat, so no syscall is needed per packet
+        self.counter = itertools.count()
+        # Both directions use aes_key in the default mode, so the first byte says which side sent the packet and their nonces can't collide
+        self.nonce_prefix = bytes([1 if server else 0]) + os.urandom(3)
+        self.encrypt_time = metrics.registry.histogram("session.encrypt_time")
+        self.decrypt_time = metrics.registry.histogram("session.decrypt_time")
+        if fast:
+            client_key, server_key = HKDF(
+                self.aes_key, 32, b"", SHA256, num_keys=2, context=b"sonorous session"
+            )
+            self.send_key, self.receive_key = (
+                (server_key, client_key) if server else (client_key, server_key)
+            )
+            # The channel is part of the nonce, so nonces stay unique with a counter per channel and a packet can't be moved to another channel
+            self.nonce_prefixes = [bytes(11 - counter_size) + bytes([channel]) for channel in range(channels.count)]
+            self.counters = [itertools.count() for channel in range(channels.count)]
+            self.replay_windows = [ReplayWindow() for channel in range(channels.count)]
+            if AESGCM is not None:
+                self.send_cipher = AESGCM(self.send_key)
+                self.receive_cipher = AESGCM(self.receive_key)
+
+    @classmethod
+    def for_server(cls, aes_key: bytes, fast: bool = False):
+        """The server's side of a session, for a client that sent us aes_key."""
+        return cls(None, fast=fast, aes_key=aes_key, server=True)
+
+    @classmethod
+    def resume(cls, previous_key: bytes, salt: bytes, fast: bool = False, server: bool = False):
+        """A session resumed from a ticket. Its key is derived from the key of the session being resumed and a fresh salt, so nonces are never reused under the old key."""
+        key = HKDF(previous_key, 32, salt, SHA256, context=b"sonorous resume")
+        return cls(None, fast=fast, aes_key=key, server=server)
 
     def get_encrypted_aes_key(self):
         return self.rsa_cipher.encrypt(self.aes_key)
 
-    def encrypt(self, data: bytes) -> bytes:
-        """Returns the encrypted data, with the 12 byte long nonce prepended to it."""
-        nonce = os.urandom(12)
-        aes_cipher = AES.new(self.aes_key, AES.MODE_GCM, nonce=nonce)
-        return nonce + aes_cipher.encrypt(data)
+    def encrypt(self, data: bytes, channel: int = 0) -> bytes:
+        """Returns the encrypted data, with the 12 byte long nonce prepended to it (or the packet counter and tag in fast mode). channel is the ENet channel the packet will be sent on, which fast mode depends on."""
+        if not self.encrypt_time:
+            return self.seal(data, channel)
+        started = time.perf_counter()
+        try:
+            return self.seal(data, channel)
+        finally:
+            self.encrypt_time.observe(time.perf_counter() - started)
+
+    def decrypt(self, data: bytes, channel: int = 0) -> bytes:
+        """Returns the decrypted version of data as a bytes object. Data must have a 12 bytes nonce prepended before it. channel is the ENet channel the packet arrived on. In fast mode, raises ValueError if the packet fails authentication or was replayed."""
+        if not self.decrypt_time:
+            return self.open(data, channel)
+        started = time.perf_counter()
+        try:
+            return self.open(data, channel)
+        finally:
+            self.decrypt_time.observe(time.perf_counter() - started)
+
+    def seal(self, data: bytes, channel: int) -> bytes:
+        if not self.fast:
+            nonce = self.nonce_prefix + next(self.counter).to_bytes(counter_size, "big")
+            aes_cipher = AES.new(self.aes_key, AES.MODE_GCM, nonce=nonce)
+            return nonce + aes_cipher.encrypt(data)
+        counter = next(self.counters[channel]).to_bytes(counter_size, "big")
+        nonce = self.nonce_prefixes[channel] + counter
+        if AESGCM is not None:
+            return counter + self.send_cipher.encrypt(nonce, data, None)
+        aes_cipher = AES.new(self.send_key, AES.MODE_GCM, nonce=nonce)
+        ciphertext, tag = aes_cipher.encrypt_and_digest(data)
+        return counter + ciphertext + tag
 
-    def decrypt(self, data: bytes) -> bytes:
-        """Returns the decrypted version of data as a bytes object. Data must have a 12 bytes nonce prepended before it."""
-        aes_cipher = AES.new(self.aes_key, AES.MODE_GCM, nonce=data[:12])
-        return aes_cipher.decrypt(data[12:])
+    def open(self, data: bytes, channel: int) -> bytes:
+        if not self.fast:
+            aes_cipher = AES.new(self.aes_key, AES.MODE_GCM, nonce=data[:12])
+            return aes_cipher.decrypt(data[12:])
+        if len(data) < counter_size + tag_size:
+            raise ValueError("Packet too short")
+        if not 0 <= channel < channels.count:
+            raise ValueError("Packet on an unknown channel")
+        counter = int.from_bytes(data[:counter_size], "big")
+        replay_window = self.replay_windows[channel]
+        if not replay_window.check(counter):
+            raise ValueError("Replayed packet")
+        nonce = self.nonce_prefixes[channel] + bytes(data[:counter_size])
+        if AESGCM is not None:
+            try:
+                plaintext = self.receive_cipher.decrypt(nonce, data[counter_size:], None)
+            except InvalidTag:
+                raise ValueError("Packet failed authentication") from None
+        else:
+            aes_cipher = AES.new(self.receive_key, AES.MODE_GCM, nonce=nonce)
+            plaintext = aes_cipher.decrypt_and_verify(
+                data[counter_size:-tag_size], data[-tag_size:]
+            )
+        replay_window.update(counter)
+        return plaintext
@@ -0,0 +1,110 @@
+import time
+from collections import deque
+from . import metrics
+
+
+class Speaker:
+    """What the selector knows about one sender"""
+
+    __slots__ = ("level", "last_packet", "selected_at", "pre_roll")
+
+    def __init__(self, pre_roll: int):
+        self.level = 0.0  # Smoothed packet size in bytes
+        self.last_packet = 0.0
+        self.selected_at: float | None = None  # None while not selected
+        self.pre_roll: deque[tuple[int, bytes]] = deque(maxlen=pre_roll)
+
+
+class SpeakerSelector:
+    """Picks the max_speakers most active senders, so only their audio is decoded and played however many people are in the channel.
+
+    Activity is the smoothed size of a sender's Opus packets: with VBR, speech takes many more bytes than silence, and senders using VAD or DTX stop sending altogether. A selected speaker keeps its place until it has been silent for hangover seconds, or until someone at least margin (a fraction) more active comes along after it has been selected for min_hold seconds, so speakers don't flap. The last pre_roll packets of every speaker that isn't selected are kept, and handed over along with the packet that gets it selected, so the start of what it says isn't cut off.
+
+    Called from the thread audio packets are received on."""
+
+    def __init__(
+        self,
+        max_speakers: int = 3,
+        hangover: float = 0.5,
+        min_hold: float = 1.0,
+        margin: float = 0.25,
+        smoothing: float = 0.2,
+        pre_roll: int = 3,
+    ):
+        if max_speakers < 1:
+            raise ValueError("A selector needs room for at least one speaker, use none to decode everyone")
+        self.max_speakers = max_speakers
+        self.hangover = hangover
+        self.min_hold = min_hold
+        self.margin = margin
+        self.smoothing = smoothing
+        self.pre_roll = pre_roll
+        self.speakers: dict[int, Speaker] = {}
+        self.selected: set[int] = set()
+        # Statistics
+        self.admitted = 0
+        self.suppressed = 0
+        self.handovers = 0
+        labels = metrics.instance_labels()
+        self.instruments = [
+            metrics.registry.counter("speaker_selection.admitted", labels, function=lambda: self.admitted),
+            metrics.registry.counter("speaker_selection.suppressed", labels, function=lambda: self.suppressed),
+            metrics.registry.counter("speaker_selection.handovers", labels, function=lambda: self.handovers),
+            metrics.registry.gauge("speaker_selection.selected", labels, function=lambda: len(self.selected)),
+        ]
+
+    def score(self, speaker: Speaker, now: float) -> float:
+        return speaker.level if now - speaker.last_packet < self.hangover else 0.0
+
+    def admit(self, user_id: int, seq_number: int, packet: bytes, now: float | None = None) -> list[tuple[int, bytes]]:
+        """Feed a received packet. Returns the (seq_number, packet) pairs to decode: nothing if the sender isn't selected, the packet itself if it is, and the packets held back from before as well if it just got selected."""
+        if now is None:
+            now = time.monotonic()
+        speaker = self.speakers.get(user_id)
+        if speaker is None:
+            speaker = self.speakers[user_id] = Speaker(self.pre_roll)
+            speaker.level = len(packet)
+        else:
+            speaker.level += (len(packet) - speaker.level) * self.smoothing
+        speaker.last_packet = now
+        if speaker.selected_at is not None:
+            self.admitted += 1
+            return [(seq_number, packet)]
+        if len(self.selected) >= self.max_speakers and not self.replace(speaker, now):
+            # Copied, as packet may be a view of a buffer that gets reused
+            speaker.pre_roll.append((seq_number, bytes(packet)))
+            self.suppressed += 1
+            return []
+        speaker.selected_at = now
+        self.selected.add(user_id)
+        packets = list(speaker.pre_roll)
+        speaker.pre_roll.clear()
+        packets.append((seq_number, packet))
+        self.admitted += len(packets)
+        return packets
+
+    def replace(self, candidate: Speaker, now: float) -> bool:
+        """Deselect the least active speaker if candidate should take its place."""
+        weakest_id = min(self.selected, key=lambda id: self.score(self.speakers[id], now))
+        weakest = self.speakers[weakest_id]
+        weakest_score = self.score(weakest, now)
+        if weakest_score and (
+            now - weakest.selected_at < self.min_hold
+            or self.score(candidate, now) <= weakest_score * (1 + self.margin)
+        ):
+            return False
+        weakest.selected_at = None
+        self.selected.discard(weakest_id)
+        self.handovers += 1
+        return True
+
+    def is_selected(self, user_id: int) -> bool:
+        return user_id in self.selected
+
+    def forget(self, user_id: int):
+        """Call when a user leaves."""
+        self.speakers.pop(user_id, None)
+        self.selected.discard(user_id)
+
+    def destroy(self):
+        metrics.registry.unregister(*self.instruments)
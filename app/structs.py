@@ -1,3 +1,4 @@
 import struct
 
 audio_packet_header = struct.Struct("<HH")  # ushort ID, ushort seq_number
+audio_bundle_entry = struct.Struct("<HHH")  # ushort ID, ushort seq_number, ushort length of the opus frame that follows
@@ -3,14 +3,14 @@ import time
 
 class Timer:
     def __init__(self):
-        self.start = time.time()
+        self.start = time.monotonic()
 
     @property
     def elapsed(self):
         """Elapsed time in ms"""
-        now = time.time()
+        now = time.monotonic()
         return (now - self.start) * 1000
 
     def restart(self):
         """Restart timer"""
-        self.start = time.time()
+        self.start = time.monotonic()
@@ -0,0 +1,103 @@
+import struct
+import time
+from typing import Callable, Iterable, Iterator
+import msgpack
+from . import structs
+
+trace_header = struct.Struct("<4sBd")  # Magic, version, time.time() the trace was started at
+trace_record = struct.Struct("<IBI")  # µs since the previous record, kind, payload size
+magic = b"SNTR"
+version = 1
+# Record kinds
+audio = 0  # An audio packet holding one frame: an audio_packet_header, then the Opus frame
+audio_bundle = 1  # A bundled audio packet: entries of an audio_bundle_entry followed by the Opus frame
+control = 2  # msgpack control messages
+
+Record = tuple[float, int, bytes]  # Seconds since the trace was started, kind, decrypted payload
+
+
+class TraceWriter:
+    """Writes decrypted packets to a trace file along with when they were received, on the monotonic clock. Each record is a trace_record followed by the payload, after a trace_header. Writes go through a buffer of buffer_size bytes, so recording a packet costs a couple of small copies."""
+
+    def __init__(self, path: str, buffer_size: int = 65536):
+        self.file = open(path, "wb", buffering=buffer_size)
+        self.file.write(trace_header.pack(magic, version, time.time()))
+        self.last = time.monotonic_ns()
+        self.records = 0
+
+    def record(self, kind: int, payload: bytes):
+        now = time.monotonic_ns()
+        delta = min((now - self.last) // 1000, 0xFFFFFFFF)
+        self.last += delta * 1000  # Rather than now, so rounding errors don't add up
+        self.file.write(trace_record.pack(delta, kind, len(payload)))
+        self.file.write(payload)
+        self.records += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_trace(path: str) -> Iterator[Record]:
+    """Yields the records of a trace file. A record cut short, as happens when the client didn't get to close the trace, ends it."""
+    with open(path, "rb") as file:
+        header = file.read(trace_header.size)
+        if len(header) < trace_header.size or header[:4] != magic:
+            raise ValueError(f"{path} is not a trace")
+        if trace_header.unpack(header)[1] != version:
+            raise ValueError(f"{path} is a trace of an unsupported version")
+        elapsed = 0
+        while len(header := file.read(trace_record.size)) == trace_record.size:
+            delta, kind, size = trace_record.unpack(header)
+            payload = file.read(size)
+            if len(payload) < size:
+                break
+            elapsed += delta
+            yield elapsed / 1e6, kind, payload
+
+
+def audio_frames(kind: int, payload: bytes) -> Iterator[tuple[int, int, memoryview]]:
+    """Yields (user_id, seq_number, opus_audio) for the frames in a decrypted audio packet of the given kind, as views of it. A bundle entry cut short by the end of the packet is dropped."""
+    view = memoryview(payload)
+    if kind == audio:
+        user_id, seq_number = structs.audio_packet_header.unpack_from(view)
+        yield user_id, seq_number, view[structs.audio_packet_header.size :]
+        return
+    entry = structs.audio_bundle_entry
+    offset = 0
+    while offset + entry.size <= len(view):
+        user_id, seq_number, length = entry.unpack_from(view, offset)
+        offset += entry.size
+        if offset + length > len(view):
+            return
+        yield user_id, seq_number, view[offset : offset + length]
+        offset += length
+
+
+def replay(
+    records: Iterable[Record],
+    event_handler,
+    realtime: bool = True,
+    advance: Callable[[float], None] | None = None,
+) -> int:
+    """Feeds the records of a trace to an event handler the way Client would: audio frames to audio(), control messages to dispatch(), both on the calling thread. With realtime, records are fed at the pace they were received at, otherwise as fast as possible. advance is called with the time of every record (in seconds since the trace was started) right before it's fed, so a simulated clock can be kept in step. Returns the number of records fed."""
+    started = time.monotonic()
+    count = 0
+    for moment, kind, payload in records:
+        if realtime and (delay := started + moment - time.monotonic()) > 0:
+            time.sleep(delay)
+        if advance is not None:
+            advance(moment)
+        if kind == control:
+            unpacker = msgpack.Unpacker()
+            unpacker.feed(payload)
+            try:
+                messages = list(unpacker)
+            except (ValueError, msgpack.UnpackException):
+                messages = []
+            for message in messages:
+                event_handler.dispatch(message)
+        else:
+            for user_id, seq_number, opus_audio in audio_frames(kind, payload):
+                event_handler.audio(user_id, seq_number, opus_audio)
+        count += 1
+    return count
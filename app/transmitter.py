@@ -1,8 +1,13 @@
+import ctypes
 import time
 from typing import Callable
 from threading import Thread, RLock
-from pyogg.opus_encoder import OpusEncoder
 import cyal
+from .codec import Encoder
+from .congestion import EncoderDecision
+from . import metrics
+from .profiles import AudioProfile, default_profile, get_profile
+from .vad import VoiceActivityDetector
 
 
 class Transmitter(Thread):
@@ -10,47 +15,121 @@ class Transmitter(Thread):
 
     def __init__(
         self,
-        device: bytes,
+        device,
         callback: Callable[[bytes], None],
-        channels: int = 2,
-        frame_size: int = 1920,
+        profile: AudioProfile | str = default_profile,
+        vad_threshold: float | None = None,
+        vad_hangover: int = 8,
+        dtx: bool = False,
+        expected_loss: int | None = None,
     ):
-        """Construct a transmitter. You must call destroy to properly dispose of this object, otherwise there will be a memory leak"""
+        """Construct a transmitter. profile is an AudioProfile or the name of one in profiles.profiles, and sets the frame size, channel count, bitrate, complexity and capture buffer. The callback gets a view of the encoded frame that's only valid until it returns.
+
+        device is the name of the capture device to open (None for the default one), or an object that behaves like an opened cyal.CaptureDevice (capturing(), available_samples and capture_samples()), such as a source of synthetic audio.
+
+        If vad_threshold (in dBFS) is given, frames quieter than it are neither encoded nor sent, except for vad_hangover frames after speech. With dtx, the encoder's own discontinuous transmission is enabled and the tiny packets it produces for silence aren't sent. expected_loss (a percentage) turns on loss resilience: in-band FEC is enabled, with enough redundancy for that much loss, so receivers can rebuild a lost frame from the next packet. Decisions from a congestion controller never go below it. You must call destroy to properly dispose of this object, otherwise there will be a memory leak"""
         super().__init__(name="Transmitter-thread", daemon=True)
-        self.capture = cyal.CaptureExtension()
-        self.frame_size = frame_size
-        self.channels = channels
-        self.device = self.capture.open_device(
-            device,
-            format=cyal.BufferFormat.STEREO16
-            if channels == 2
-            else cyal.BufferFormat.MONO16,
-            sample_rate=48000,
-            buf_size=frame_size,
-        )
+        self.profile = get_profile(profile)
+        self.frame_size = self.profile.frame_size
+        self.channels = self.profile.channels
+        if device is None or isinstance(device, (bytes, str)):
+            self.capture = cyal.CaptureExtension()
+            self.device = self.capture.open_device(
+                device,
+                format=cyal.BufferFormat.STEREO16
+                if self.channels == 2
+                else cyal.BufferFormat.MONO16,
+                sample_rate=48000,
+                buf_size=self.profile.capture_buffer,
+            )
+        else:
+            self.capture = None
+            self.device = device
         self.callback = callback
-        self.encoder = OpusEncoder()
-        self.encoder.set_application("audio")
-        self.encoder.set_sampling_frequency(48000)
-        self.encoder.set_channels(2)
+        self.encoder = Encoder(channels=self.channels, application=self.profile.application)
+        if self.profile.bitrate is not None:
+            self.encoder.set_bitrate(self.profile.bitrate)
+        if self.profile.complexity is not None:
+            self.encoder.set_complexity(self.profile.complexity)
+        self.dtx = dtx
+        if dtx:
+            self.encoder.set_dtx(True)
+        self.expected_loss = expected_loss
+        if expected_loss is not None:
+            self.encoder.set_inband_fec(True)
+            self.encoder.set_packet_loss_percentage(expected_loss)
+        self.vad = (
+            VoiceActivityDetector(vad_threshold, vad_hangover)
+            if vad_threshold is not None
+            else None
+        )
+        self.suppressed = 0  # Silent frames that were not sent
+        self.decision: EncoderDecision | None = None  # Latest settings from the congestion controller
+        self.applied_decision: EncoderDecision | None = None
+        labels = metrics.instance_labels()
+        self.encode_time = metrics.registry.histogram("transmitter.encode_time", labels)
+        self.frames_sent = metrics.registry.counter("transmitter.frames_sent", labels)
+        self.frames_suppressed = metrics.registry.counter(
+            "transmitter.frames_suppressed", labels, function=lambda: self.suppressed
+        )
+        self.encoder_bitrate = self.profile.bitrate  # What the encoder was last set to, None while libopus decides
+        self.bitrate = metrics.registry.gauge("transmitter.bitrate", labels, function=lambda: self.encoder_bitrate)
         self.running = True
         self.transmitting = False
-        self.buffer = bytearray(frame_size * 2*channels)
+        self.buffer = bytearray(self.frame_size * 2 * self.channels)
+        self.pcm = (ctypes.c_int16 * (self.frame_size * self.channels)).from_buffer(self.buffer)
         self.start()
 
     def run(self):
+        # Poll a few times per frame, available_samples counts samples per channel
+        interval = min(0.004, self.profile.frame_duration / 4)
         while self.running:
             if not self.transmitting:
                 time.sleep(0.01)  # Sleep for longer when paused
                 continue
             with self.device.capturing():
                 while self.running and self.transmitting:
-                    if self.device.available_samples >= self.frame_size * self.channels:
+                    while self.device.available_samples >= self.frame_size:
                         self.device.capture_samples(self.buffer)
-                        encoded = self.encoder.encode(self.buffer)
-                        self.callback(encoded)
-                    time.sleep(0.004)
+                        self.process_frame()
+                    time.sleep(interval)
+
+    def apply_decision(self, decision: EncoderDecision):
+        """Use the encoder settings a CongestionController picked. Safe to call from any thread, they're applied before the next frame is encoded. The bitrate is capped at the profile's, if it sets one."""
+        self.decision = decision
+
+    def process_frame(self):
+        decision = self.decision
+        if decision is not self.applied_decision:
+            self.applied_decision = decision
+            bitrate = decision.bitrate
+            if self.profile.bitrate is not None:
+                bitrate = min(bitrate, self.profile.bitrate)
+            if bitrate != self.encoder_bitrate:
+                self.encoder.set_bitrate(bitrate)
+                self.encoder_bitrate = bitrate
+            if self.expected_loss is None:
+                self.encoder.set_inband_fec(decision.fec)
+                self.encoder.set_packet_loss_percentage(decision.packet_loss_percentage)
+            else:
+                self.encoder.set_packet_loss_percentage(
+                    max(self.expected_loss, decision.packet_loss_percentage)
+                )
+        if self.vad is not None and not self.vad.is_speech(self.buffer):
+            self.suppressed += 1
+            return
+        if self.encode_time:
+            started = time.perf_counter()
+        encoded = self.encoder.encode(self.pcm, self.frame_size)
+        if self.encode_time:
+            self.encode_time.observe(time.perf_counter() - started)
+        if self.dtx and len(encoded) <= 2:
+            self.suppressed += 1
+            return
+        self.callback(encoded)
+        self.frames_sent.inc()
 
     def destroy(self):
         self.running = False
         self.join()
+        metrics.registry.unregister(self.encode_time, self.frames_sent, self.frames_suppressed, self.bitrate)
@@ -0,0 +1,36 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:  # Only needed for voice activity detection
+    np = None
+
+
+class VoiceActivityDetector:
+    """Energy based voice activity detection. A frame counts as speech when its level is above threshold, and speech is kept going for hangover frames after the level drops so word endings aren't cut off."""
+
+    def __init__(self, threshold: float = -45.0, hangover: int = 8):
+        """threshold is in dBFS."""
+        if np is None:
+            raise RuntimeError("Voice activity detection requires numpy to be installed")
+        self.threshold = threshold
+        self.hangover = hangover
+        self.remaining = 0  # Frames of hangover left
+
+    @staticmethod
+    def level(pcm) -> float:
+        """Returns the RMS level of 16 bit PCM in dBFS."""
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        rms = math.sqrt(float(np.mean(samples * samples))) if len(samples) else 0.0
+        if rms == 0:
+            return -math.inf
+        return 20 * math.log10(rms / 32768)
+
+    def is_speech(self, pcm) -> bool:
+        if self.level(pcm) >= self.threshold:
+            self.remaining = self.hangover
+            return True
+        if self.remaining:
+            self.remaining -= 1
+            return True
+        return False
@@ -0,0 +1,106 @@
+"""Bot benchmark: many AsyncClients on one asyncio event loop.
+
+Run from the repository root with `python -m benchmarks.bots --bots 200 --talkers 2`. Every bot connects to a local stand-in server and reads the audio the server relays to it, while the first few of them also talk, sending one pre-encoded Opus frame per frame duration. Nothing is decoded. Reports how long connecting took, frames received and dropped, CPU, and the number of threads in this process (the one running the loop, unless something else started some), as JSON."""
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from app.async_client import AsyncClient
+from app.profiles import default_profile, get_profile, profiles
+from .e2e import rss_kb
+from .server import StandInServer
+from .talkers import TalkerSimulation
+
+
+async def listen(bot: AsyncClient, received: list[int], index: int):
+    async for _ in bot.audio():
+        received[index] += 1
+
+
+async def talk(bot: AsyncClient, frames: list[bytes], frame_duration: float, stop: asyncio.Event):
+    next_frame = time.perf_counter()
+    index = 0
+    while not stop.is_set():
+        await bot.send_audio(frames[index])
+        index = (index + 1) % len(frames)
+        next_frame += frame_duration
+        await asyncio.sleep(max(0.0, next_frame - time.perf_counter()))
+
+
+async def run(args) -> dict:
+    profile = get_profile(args.profile)
+    frames = TalkerSimulation(0, profile).frames
+    bots = [
+        AsyncClient("127.0.0.1", args.port, fast_session=args.fast_session, bundling=args.bundling)
+        for _ in range(args.bots)
+    ]
+    started = time.perf_counter()
+    await asyncio.gather(*(bot.connect() for bot in bots))
+    connect_time = time.perf_counter() - started
+    received = [0] * len(bots)
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(listen(bot, received, index)) for index, bot in enumerate(bots)]
+    tasks += [
+        asyncio.create_task(talk(bot, frames, profile.frame_duration, stop))
+        for bot in bots[: args.talkers]
+    ]
+    await asyncio.sleep(args.warmup)
+    received_before = sum(received)
+    rss_before = rss_kb()
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_before
+    rss_after = rss_kb()
+    frames_received = sum(received) - received_before
+    threads = threading.active_count()
+    stop.set()
+    for bot in bots:
+        await bot.close()
+    await asyncio.gather(*tasks)
+    return {
+        "bots": args.bots,
+        "talkers": args.talkers,
+        "connect_seconds": connect_time,
+        "duration": elapsed,
+        "frames_received": frames_received,
+        "frames_expected": round(args.talkers * (args.bots - 1) * elapsed / profile.frame_duration),
+        "frames_dropped": sum(bot.dropped_frames for bot in bots),
+        "rejected_packets": sum(bot.rejected_packets for bot in bots),
+        "cpu_percent": cpu / elapsed * 100,
+        "threads": threads,
+        "wx_imported": "wx" in sys.modules,
+        "rss_kb": {
+            "before": rss_before,
+            "after": rss_after,
+            "growth": None if rss_before is None else rss_after - rss_before,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bots", type=int, default=100)
+    parser.add_argument("--talkers", type=int, default=2, help="How many of the bots send audio")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to measure for")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds to run before measuring")
+    parser.add_argument("--profile", choices=sorted(profiles), default=default_profile)
+    parser.add_argument("--fast-session", action="store_true")
+    parser.add_argument("--bundling", action="store_true", help="Have the server bundle frames into fewer packets")
+    parser.add_argument("--port", type=int, default=47952)
+    args = parser.parse_args()
+    server, stop_server, server_results = StandInServer.spawn(
+        args.port, fast_session=args.fast_session, max_peers=args.bots + 1
+    )
+    results = asyncio.run(run(args))
+    stop_server.set()
+    results["server"] = server_results.get(timeout=10)
+    server.join()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
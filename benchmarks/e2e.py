@@ -0,0 +1,267 @@
+"""End to end benchmark: N clients send synthetic audio to each other through a local stand-in server.
+
+Run from the repository root with `python -m benchmarks.e2e`. Needs no GUI and no audio hardware: capture is synthetic and playout goes to OpenAL's null backend. Every client gets a Client, a Transmitter, a playout engine and a RemoteUser per other client, all in this process, while the server runs in its own. Results are printed as JSON.
+
+Latency is measured from the moment a Transmitter hands over an encoded frame until the receiving client gave it to the RemoteUser (so it includes decoding unless a decode pipeline is used). CPU is this process's CPU time, the server's is reported separately."""
+import os
+
+os.environ.setdefault("ALSOFT_DRIVERS", "null")  # Must be set before OpenAL is loaded
+
+import argparse
+import json
+import threading
+import time
+from array import array
+import cyal
+from app import metrics
+from app.client import Client
+from app.congestion import CongestionController
+from app.decode_pipeline import DecodePipeline
+from app.event_handler import EventHandler
+from app.playout import PlayoutEngine
+from app.profiles import default_profile, get_profile, profiles
+from app.remote_user import RemoteUser
+from app.transmitter import Transmitter
+from .server import StandInServer
+from .synthetic import SyntheticCapture
+
+
+class Recorder:
+    """Send times and measured latencies, shared by every client"""
+
+    def __init__(self, clients: int):
+        # Send time of every sequence number, per sender. Preallocated so recording doesn't show up as memory growth
+        self.sent_at = [array("d", bytes(8 * 65536)) for _ in range(clients)]
+        self.sent = [0] * clients
+        self.latencies = array("d")
+        self.received = 0
+        self.recording = False  # Off during warmup
+
+    def sending(self, sender: int):
+        """Called right before a packet is sent, as the answer may come back before send returns"""
+        self.sent_at[sender][self.sent[sender] & 0xFFFF] = time.perf_counter()
+
+    def sent_packet(self, sender: int):
+        self.sent[sender] += 1
+
+    def packet_received(self, sender: int, seq_number: int):
+        if self.recording:
+            self.latencies.append(time.perf_counter() - self.sent_at[sender][seq_number])
+            self.received += 1
+
+    def restart(self):
+        self.latencies = array("d")
+        self.received = 0
+        self.recording = True
+
+
+class BenchmarkEventHandler(EventHandler):
+    """Plays the audio of every other client through a RemoteUser, and records its latency"""
+
+    def __init__(self, client, latency: Recorder, engine: PlayoutEngine, pipeline, jitter_buffer_size: int):
+        super().__init__(client, None)
+        self.latency = latency
+        self.engine = engine
+        self.pipeline = pipeline
+        self.jitter_buffer_size = jitter_buffer_size
+        self.users: dict[int, RemoteUser] = {}
+
+    def audio(self, user_id: int, seq_number: int, opus_audio: bytes):
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = RemoteUser(
+                self.engine,
+                user_id,
+                f"user {user_id}",
+                jitter_buffer_size=self.jitter_buffer_size,
+                pipeline=self.pipeline,
+            )
+        user.put_packet(opus_audio, seq_number)
+        # User ids are handed out in the order clients connect, starting at 1
+        self.latency.packet_received(user_id - 1, seq_number)
+
+    def destroy(self):
+        for user in self.users.values():
+            user.destroy()
+
+
+class Participant:
+    """One simulated client"""
+
+    def __init__(self, index: int, args, recorder: Recorder, context: cyal.Context):
+        self.index = index
+        self.recorder = recorder
+        self.connected = threading.Event()
+        self.send_errors = 0
+        self.engine = PlayoutEngine(context, mix=args.mix)
+        self.pipeline = DecodePipeline(args.pipeline) if args.pipeline else None
+        self.client = Client(
+            "127.0.0.1",
+            args.port,
+            lambda client: BenchmarkEventHandler(
+                client, recorder, self.engine, self.pipeline, args.jitter_buffer_size
+            ),
+            on_disconnect=lambda client: None,
+            on_connect=lambda client: self.connected.set(),
+            on_connection_timeout=lambda client: None,
+            fast_session=args.fast_session,
+            call_after=lambda function, *args: function(*args),
+            bundling=args.bundling,
+            bundle_frames=args.bundle_frames,
+        )
+        profile = get_profile(args.profile)
+        self.transmitter = Transmitter(
+            SyntheticCapture(profile.channels, frequency=200.0 + 100 * index),
+            self.send,
+            profile=profile,
+        )
+        self.congestion = None
+        if args.congestion:
+            self.congestion = CongestionController.for_profile(profile, interval=args.congestion_interval)
+            self.congestion.listeners.append(self.transmitter.apply_decision)
+            self.client.congestion = self.congestion
+
+    def send(self, packet):
+        self.recorder.sending(self.index)
+        try:
+            self.client.send_audio(packet)
+        except BrokenPipeError:
+            self.send_errors += 1
+            return
+        self.recorder.sent_packet(self.index)
+
+    def stats(self) -> dict:
+        users = self.client.event_handler.users.values()
+        totals = {"decode_drops": sum(user.decode_drops for user in users)}
+        for name in ["late", "duplicates", "lost", "underruns", "pauses", "dropped", "recovered"]:
+            totals[name] = sum(getattr(user.jitter_buffer, name) for user in users)
+        totals["rejected_packets"] = self.client.rejected_packets
+        totals["send_errors"] = self.send_errors
+        if self.pipeline is not None:
+            totals["pipeline_dropped"] = self.pipeline.dropped
+        if self.congestion is not None:
+            totals["bitrate_changes"] = self.congestion.decisions
+        return totals
+
+    def destroy(self):
+        self.transmitter.destroy()
+        self.client.destroy()
+        self.client.event_handler.destroy()
+        if self.pipeline is not None:
+            self.pipeline.destroy()
+        self.engine.destroy()
+
+
+def rss_kb() -> int | None:
+    """Resident memory of this process in KiB, if the platform tells us"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def percentiles(values, points=(50, 90, 99)) -> dict:
+    """Nearest rank percentiles of values, in ms"""
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+    result = {
+        f"p{point}": ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))] * 1000
+        for point in points
+    }
+    result["max"] = ordered[-1] * 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to measure for")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds to run before measuring")
+    parser.add_argument("--profile", choices=sorted(profiles), default=default_profile)
+    parser.add_argument("--fast-session", action="store_true")
+    parser.add_argument("--bundling", action="store_true", help="Have the server bundle frames into fewer packets")
+    parser.add_argument("--bundle-frames", type=int, default=1, help="Frames each client puts in one packet, with --bundling")
+    parser.add_argument("--mix", action="store_true", help="Mix in software")
+    parser.add_argument("--pipeline", type=int, default=0, help="Decode worker threads, 0 decodes on the network thread")
+    parser.add_argument("--jitter-buffer-size", type=int, default=10)
+    parser.add_argument("--echo", action="store_true", help="Have the server send every client its own audio too")
+    parser.add_argument("--port", type=int, default=47950)
+    parser.add_argument("--metrics", action="store_true", help="Turn metrics on and include a snapshot in the results")
+    parser.add_argument("--congestion", action="store_true", help="Adapt every client's bitrate to its connection")
+    parser.add_argument("--congestion-interval", type=int, default=1000, help="ms between congestion controller samples")
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable()
+    server, stop_server, server_results = StandInServer.spawn(
+        args.port, fast_session=args.fast_session, echo=args.echo
+    )
+    device = cyal.Device()
+    context = cyal.Context(device, make_current=True)
+    recorder = Recorder(args.clients)
+    participants = []
+    # Connect one at a time, so that user ids follow the participants' order
+    for index in range(args.clients):
+        participant = Participant(index, args, recorder, context)
+        participants.append(participant)
+        participant.client.connect()
+        if not participant.connected.wait(10):
+            raise RuntimeError(f"Client {index} could not connect")
+    for participant in participants:
+        participant.transmitter.transmitting = True
+    time.sleep(args.warmup)
+    recorder.restart()
+    sent_before = sum(recorder.sent)
+    rss_before = rss_kb()
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_before
+    rss_after = rss_kb()
+    recorder.recording = False
+    sent = sum(recorder.sent) - sent_before
+    stats = [participant.stats() for participant in participants]
+    bitrates = [participant.transmitter.encoder_bitrate for participant in participants]
+    snapshot = metrics.registry.snapshot() if args.metrics else None
+    for participant in participants:
+        participant.destroy()
+    stop_server.set()
+    server_stats = server_results.get(timeout=10)
+    server.join()
+    receivers = args.clients if args.echo else args.clients - 1
+    results = {
+        "clients": args.clients,
+        "profile": args.profile,
+        "fast_session": args.fast_session,
+        "mix": args.mix,
+        "pipeline": args.pipeline,
+        "duration": elapsed,
+        "packets_sent": sent,
+        "packets_received": recorder.received,
+        "packets_expected": sent * receivers,
+        "packets_per_second": recorder.received / elapsed,
+        "latency_ms": percentiles(recorder.latencies),
+        "cpu_percent": cpu / elapsed * 100,
+        "cpu_percent_per_client": cpu / elapsed * 100 / args.clients,
+        "rss_kb": {
+            "before": rss_before,
+            "after": rss_after,
+            "growth": None if rss_before is None else rss_after - rss_before,
+        },
+        "receivers": {name: sum(stat.get(name, 0) for stat in stats) for name in stats[0]},
+        "server": server_stats,
+    }
+    if args.congestion:
+        results["bitrates"] = bitrates  # What each client's encoder was set to at the end
+    if snapshot is not None:
+        results["metrics"] = snapshot["metrics"]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""Load generator: how one client copes with many simultaneous talkers.
+
+Run from the repository root with `python -m benchmarks.load --talkers 10 50 200`. For every talker count a stand-in server is started that sends a single real Client the pre-encoded audio of that many fake talkers, through a simulated network with jitter, loss, reordering and talkers joining and leaving. The client decodes and plays everything through OpenAL's null backend. Reports underruns, dropped and lost frames, time spent per frame on the network thread and CPU time per thread, as JSON."""
+import os
+
+os.environ.setdefault("ALSOFT_DRIVERS", "null")  # Must be set before OpenAL is loaded
+
+import argparse
+import json
+import threading
+import time
+import cyal
+from app.client import Client
+from app.decode_pipeline import DecodePipeline
+from app.event_handler import EventHandler
+from app.playout import PlayoutEngine
+from app.profiles import default_profile, profiles
+from app.recorder import Recorder
+from app.remote_user import RemoteUser
+from app.speaker_selection import SpeakerSelector
+from .e2e import rss_kb
+from .server import StandInServer
+
+jitter_stats = ["received", "late", "duplicates", "lost", "underruns", "pauses", "dropped", "recovered"]
+
+
+class LoadEventHandler(EventHandler):
+    """Plays every talker through a RemoteUser, and records every talker if given a recorder. The stand-in server sends no leave events, so users that went quiet for idle_timeout seconds are destroyed as if they left."""
+
+    def __init__(
+        self,
+        client,
+        engine: PlayoutEngine,
+        pipeline,
+        jitter_buffer_size: int,
+        recovery: int = 0,
+        selector: SpeakerSelector | None = None,
+        idle_timeout: float = 1.0,
+        recorder: Recorder | None = None,
+    ):
+        super().__init__(client, None, recorder)
+        self.engine = engine
+        self.pipeline = pipeline
+        self.jitter_buffer_size = jitter_buffer_size
+        self.recovery = recovery
+        self.selector = selector
+        self.idle_timeout = idle_timeout
+        self.now: float | None = None  # Simulated time.monotonic() to use instead of the clock, when replaying a trace
+        self.users: dict[int, RemoteUser] = {}
+        self.last_seen: dict[int, float] = {}
+        self.last_sweep = time.perf_counter()
+        self.departed = {name: 0 for name in jitter_stats + ["decode_drops"]}  # Totals of destroyed users
+        self.created = 0
+        self.packets = 0
+        self.handler_time = 0.0
+        self.handler_max = 0.0
+
+    def audio(self, user_id: int, seq_number: int, opus_audio: bytes):
+        started = time.perf_counter()
+        self.last_seen[user_id] = started
+        super().audio(user_id, seq_number, opus_audio)
+        if self.selector is None:
+            self.play(user_id, seq_number, opus_audio)
+        else:
+            for seq_number, packet in self.selector.admit(user_id, seq_number, opus_audio, self.now):
+                self.play(user_id, seq_number, packet)
+        if started - self.last_sweep >= self.idle_timeout:
+            self.last_sweep = started
+            for id, seen in list(self.last_seen.items()):
+                if started - seen >= self.idle_timeout:
+                    self.remove(id)
+        elapsed = time.perf_counter() - started
+        self.packets += 1
+        self.handler_time += elapsed
+        self.handler_max = max(self.handler_max, elapsed)
+
+    def play(self, user_id: int, seq_number: int, opus_audio: bytes):
+        self.user(user_id).put_packet(opus_audio, seq_number)
+
+    def user(self, user_id: int) -> RemoteUser:
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = RemoteUser(
+                self.engine,
+                user_id,
+                f"talker {user_id}",
+                jitter_buffer_size=self.jitter_buffer_size,
+                pipeline=self.pipeline,
+                recovery=self.recovery,
+            )
+            self.created += 1
+        return user
+
+    def remove(self, user_id: int):
+        del self.last_seen[user_id]
+        if self.recorder is not None:
+            self.recorder.stop(user_id)
+        if self.selector is not None:
+            self.selector.forget(user_id)
+        user = self.users.pop(user_id, None)
+        if user is None:
+            return  # Never selected
+        user.destroy()
+        for name in jitter_stats:
+            self.departed[name] += getattr(user.jitter_buffer, name)
+        self.departed["decode_drops"] += user.decode_drops
+
+    def stats(self) -> dict:
+        totals = dict(self.departed)
+        for user in list(self.users.values()):
+            for name in jitter_stats:
+                totals[name] += getattr(user.jitter_buffer, name)
+            totals["decode_drops"] += user.decode_drops
+        totals["users_created"] = self.created
+        totals["users_active"] = len(self.users)
+        if self.selector is not None:
+            totals["selection"] = {
+                "admitted": self.selector.admitted,
+                "suppressed": self.selector.suppressed,
+                "handovers": self.selector.handovers,
+            }
+        if self.recorder is not None:
+            totals["recording"] = {
+                "files": self.recorder.serials,
+                "bytes_written": self.recorder.written,
+                "dropped": self.recorder.dropped,
+            }
+        return totals
+
+    def destroy(self):
+        for user_id in list(self.last_seen):
+            self.remove(user_id)
+        if self.selector is not None:
+            self.selector.destroy()
+
+
+def thread_cpu() -> dict[int, tuple[str, float]]:
+    """CPU seconds used by each live thread so far, by thread id, if the platform tells us"""
+    if not hasattr(time, "pthread_getcpuclockid"):
+        return {}
+    result = {}
+    for thread in threading.enumerate():
+        try:
+            clock = time.pthread_getcpuclockid(thread.ident)
+            result[thread.ident] = (thread.name, time.clock_gettime(clock))
+        except (OSError, TypeError):
+            pass  # Exited in the meantime
+    return result
+
+
+def run(talkers: int, args, context: cyal.Context) -> dict:
+    server, stop_server, server_results = StandInServer.spawn(
+        args.port,
+        fast_session=args.fast_session,
+        talkers={
+            "talkers": talkers,
+            "profile": args.profile,
+            "jitter": args.jitter / 1000,
+            "loss": args.loss,
+            "reorder": args.reorder,
+            "churn": args.churn,
+            "seed": args.seed,
+            "expected_loss": args.fec,
+            "activity": args.activity,
+        },
+    )
+    engine = PlayoutEngine(context, mix=args.mix)
+    pipeline = DecodePipeline(args.pipeline) if args.pipeline else None
+    recorder = Recorder(os.path.join(args.record, f"{talkers}-talkers")) if args.record else None
+    connected = threading.Event()
+    client = Client(
+        "127.0.0.1",
+        args.port,
+        lambda client: LoadEventHandler(
+            client,
+            engine,
+            pipeline,
+            args.jitter_buffer_size,
+            args.recovery,
+            SpeakerSelector(args.speakers) if args.speakers else None,
+            recorder=recorder,
+        ),
+        on_disconnect=lambda client: None,
+        on_connect=lambda client: connected.set(),
+        on_connection_timeout=lambda client: None,
+        fast_session=args.fast_session,
+        call_after=lambda function, *args: function(*args),
+        bundling=args.bundling,
+    )
+    if args.trace:
+        os.makedirs(args.trace, exist_ok=True)
+        client.start_trace(os.path.join(args.trace, f"{talkers}-talkers.trace"))
+    client.connect()
+    if not connected.wait(10):
+        raise RuntimeError("Could not connect to the stand-in server")
+    handler = client.event_handler
+    time.sleep(args.warmup)
+    before = handler.stats()
+    packets_before = handler.packets
+    handler_time_before = handler.handler_time
+    handler.handler_max = 0.0
+    threads_before = thread_cpu()
+    rss_before = rss_kb()
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_before
+    threads_after = thread_cpu()
+    rss_after = rss_kb()
+    after = handler.stats()
+    packets = handler.packets - packets_before
+    handler_time = handler.handler_time - handler_time_before
+    pipeline_stats = None
+    if pipeline is not None:
+        depths = pipeline.queue_depths().values()
+        pipeline_stats = {
+            "dropped": pipeline.dropped,
+            "peak_depth": pipeline.peak_depth,
+            "queued": sum(depths),
+            "deepest": max(depths, default=0),
+        }
+    client.destroy()
+    handler.destroy()
+    if recorder is not None:
+        recorder.destroy()
+    if pipeline is not None:
+        pipeline.destroy()
+    engine.destroy()
+    stop_server.set()
+    server_stats = server_results.get(timeout=10)
+    server.join()
+    threads = {}
+    for ident, (name, seconds) in threads_after.items():
+        if ident in threads_before:
+            seconds -= threads_before[ident][1]
+        threads[name] = threads.get(name, 0) + seconds / elapsed * 100
+    return {
+        "talkers": talkers,
+        "duration": elapsed,
+        # Frames rather than packets, as with bundling a packet may hold many
+        "frames_received": packets,
+        "frames_per_second": packets / elapsed,
+        "handler_us": {
+            "mean": handler_time / packets * 1e6 if packets else None,
+            "max": handler.handler_max * 1e6,
+        },
+        "network_thread_busy_percent": handler_time / elapsed * 100,
+        "cpu_percent": cpu / elapsed * 100,
+        "thread_cpu_percent": threads,
+        "rss_kb": {
+            "before": rss_before,
+            "after": rss_after,
+            "growth": None if rss_before is None else rss_after - rss_before,
+        },
+        "receiver": {
+            name: after[name] - before[name] if name in jitter_stats + ["decode_drops"] else after[name]
+            for name in after
+        },
+        "rejected_packets": client.rejected_packets,
+        "pipeline": pipeline_stats,
+        "server": server_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--talkers", type=int, nargs="+", default=[10, 50, 200], help="Talker counts to run one after the other")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to measure each run for")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds to run before measuring")
+    parser.add_argument("--profile", choices=sorted(profiles), default=default_profile)
+    parser.add_argument("--jitter", type=float, default=0.0, help="Most delay added to a packet, in ms")
+    parser.add_argument("--loss", type=float, default=0.0, help="Chance of a packet getting lost, 0 to 1")
+    parser.add_argument("--reorder", type=float, default=0.0, help="Chance of a packet arriving after the next ones, 0 to 1")
+    parser.add_argument("--churn", type=float, default=0.0, help="Talkers leaving and being replaced per second")
+    parser.add_argument("--activity", type=float, default=1.0, help="Share of the time talkers speak rather than send silence, 0 to 1")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--fast-session", action="store_true")
+    parser.add_argument("--bundling", action="store_true", help="Have the server bundle frames into fewer packets")
+    parser.add_argument("--mix", action="store_true", help="Mix in software")
+    parser.add_argument("--pipeline", type=int, default=0, help="Decode worker threads, 0 decodes on the network thread")
+    parser.add_argument("--jitter-buffer-size", type=int, default=10)
+    parser.add_argument("--fec", type=int, default=None, help="Have the talkers use in-band FEC for this much loss, in percent")
+    parser.add_argument("--speakers", type=int, default=0, help="Only decode this many of the most active talkers, 0 decodes all of them")
+    parser.add_argument("--recovery", type=int, default=0, help="Missing frames in a row the client fills in with FEC and PLC")
+    parser.add_argument("--record", default=None, metavar="DIRECTORY", help="Also record every talker to Ogg Opus files in this directory")
+    parser.add_argument("--trace", default=None, metavar="DIRECTORY", help="Capture the packets the client receives into a trace in this directory, for benchmarks.replay")
+    parser.add_argument("--port", type=int, default=47951)
+    args = parser.parse_args()
+    device = cyal.Device()
+    context = cyal.Context(device, make_current=True)
+    results = [run(talkers, args, context) for talkers in args.talkers]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Replays a packet trace into the receive pipeline.
+
+Run from the repository root with `python -m benchmarks.replay TRACE`. Traces are captured with `python -m app.headless --trace FILE` or `python -m benchmarks.load --trace DIRECTORY`. Every talker in the trace is played through a RemoteUser as in benchmarks.load, so jitter buffer settings can be compared on the same real traffic.
+
+By default the trace is fed at the pace it was received at, into a playout engine on OpenAL's null backend. With --fast it's fed as fast as possible on a simulated clock, and a stand-in for the playout engine reads a frame from every user for each frame of trace time. The results then only depend on the trace and the settings, and the time taken is what decoding and jitter buffering cost. Reports the receiver statistics and the time taken as JSON."""
+import os
+
+os.environ.setdefault("ALSOFT_DRIVERS", "null")  # Must be set before OpenAL is loaded
+
+import argparse
+import json
+import math
+import time
+from app.trace import read_trace, replay
+from app.speaker_selection import SpeakerSelector
+from .load import LoadEventHandler
+
+drain_time = 1.0  # Seconds of playout after the last packet, so what's still buffered gets played
+
+
+class VirtualPlayout:
+    """Stands in for PlayoutEngine with --fast. Rather than a thread playing in real time, advance() plays up to a moment of trace time, reading frame_size samples from every active user per frame the way software mixing does. Needs no OpenAL."""
+
+    mix = True  # So RemoteUsers don't create sources
+    context = None
+
+    def __init__(self, frame_size: int = 960):
+        self.frame_size = frame_size
+        self.interval = frame_size / 48000
+        self.users = {}
+        self.active = set()
+        self.next_play = 0.0
+        self.played = 0  # Samples per channel read from users
+
+    def add(self, user):
+        self.users[user.id] = user
+
+    def remove(self, user):
+        if self.users.get(user.id) is user:
+            del self.users[user.id]
+        self.active.discard(user)
+
+    def activate(self, user):
+        if self.users.get(user.id) is user:
+            self.active.add(user)
+
+    def deactivate(self, user):
+        if not len(user.jitter_buffer):
+            self.active.discard(user)
+
+    def advance(self, now: float):
+        while self.next_play <= now:
+            self.play(self.next_play)
+            self.next_play += self.interval
+
+    def play(self, now: float):
+        for user in list(self.active):
+            filled = 0
+            while filled < self.frame_size:
+                result = user.read(self.frame_size - filled, now)
+                if result is None:
+                    break
+                chunk, channels = result
+                filled += len(chunk) // (2 * channels)
+            if not filled:
+                self.deactivate(user)
+            self.played += filled
+
+    def destroy(self):
+        pass
+
+
+class ReplayEventHandler(LoadEventHandler):
+    """Hands packets to the speaker selector and RemoteUsers with the simulated time they arrived at, decoding them right away."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.now = 0.0
+
+    def play(self, user_id: int, seq_number: int, opus_audio: bytes):
+        self.user(user_id).decode_packet(opus_audio, seq_number, self.now)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace")
+    parser.add_argument("--fast", action="store_true", help="Replay as fast as possible on a simulated clock")
+    parser.add_argument("--jitter-buffer-size", type=int, default=10)
+    parser.add_argument("--recovery", type=int, default=0, help="Missing frames in a row filled in with FEC and PLC")
+    parser.add_argument("--speakers", type=int, default=0, help="Only decode this many of the most active talkers, 0 decodes all of them")
+    parser.add_argument("--pipeline", type=int, default=0, help="Decode worker threads, not with --fast")
+    parser.add_argument("--mix", action="store_true", help="Mix in software, not with --fast")
+    args = parser.parse_args()
+    if args.fast and (args.pipeline or args.mix):
+        parser.error("--pipeline and --mix need a real playout engine, so they can't be used with --fast")
+    records = list(read_trace(args.trace))  # Read up front so reading the file isn't timed
+    duration = records[-1][0] if records else 0.0
+    selector = SpeakerSelector(args.speakers) if args.speakers else None
+    pipeline = None
+    if args.fast:
+        engine = VirtualPlayout()
+        # Nobody is timed out, as that would depend on how fast the replay runs
+        handler = ReplayEventHandler(
+            None, engine, None, args.jitter_buffer_size, args.recovery, selector, idle_timeout=math.inf
+        )
+
+        def advance(now: float):
+            handler.now = now
+            engine.advance(now)
+
+    else:
+        import cyal
+        from app.decode_pipeline import DecodePipeline
+        from app.playout import PlayoutEngine
+
+        device = cyal.Device()
+        context = cyal.Context(device, make_current=True)
+        engine = PlayoutEngine(context, mix=args.mix)
+        pipeline = DecodePipeline(args.pipeline) if args.pipeline else None
+        handler = LoadEventHandler(None, engine, pipeline, args.jitter_buffer_size, args.recovery, selector)
+        advance = None
+    cpu_before = time.process_time()
+    started = time.perf_counter()
+    count = replay(records, handler, realtime=not args.fast, advance=advance)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_before
+    if args.fast:
+        engine.advance(duration + drain_time)
+    else:
+        time.sleep(drain_time)
+    stats = handler.stats()
+    handler.destroy()
+    if pipeline is not None:
+        pipeline.destroy()
+    engine.destroy()
+    frames = handler.packets
+    results = {
+        "trace": args.trace,
+        "records": count,
+        "frames": frames,
+        "trace_duration": duration,
+        "fast": args.fast,
+        "elapsed": elapsed,
+        "cpu_percent": cpu / elapsed * 100 if elapsed else None,
+        "us_per_frame": elapsed / frames * 1e6 if frames else None,
+        "handler_us": {
+            "mean": handler.handler_time / frames * 1e6 if frames else None,
+            "max": handler.handler_max * 1e6,
+        },
+        "receiver": stats,
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
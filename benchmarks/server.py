@@ -0,0 +1,227 @@
+"""A minimal local stand-in for the sonorous server, enough to benchmark clients against.
+
+It speaks the auth channel handshake (and resumption, if asked to), assigns user ids in the order clients authenticate and relays every audio packet to the other clients with the audio_packet_header in front, or in bundles on the bundle channel to clients that asked for bundling. Control events are ignored. Run it in its own process with StandInServer.spawn, so its CPU time isn't charged to the clients."""
+import itertools
+import multiprocessing
+import os
+import time
+import enet
+import msgpack
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from app import channels, structs
+from app.protocol import resume_rejected, resume_request
+from app.session import Session
+from app.trace import audio_bundle, audio_frames
+
+
+class ServerPeer:
+    """State the server keeps for a connected peer"""
+
+    def __init__(self, peer):
+        self.peer = peer
+        self.session: Session | None = None
+        self.user_id: int | None = None  # Assigned once authenticated
+        self.seq_number = 0
+        self.bundle_size: int | None = None  # Set once bundling was agreed on
+        self.bundle = bytearray()  # Frames waiting to go out to this peer
+
+
+class StandInServer:
+    def __init__(
+        self,
+        port: int,
+        fast_session: bool = False,
+        resumption: bool = False,
+        echo: bool = False,
+        max_peers: int = 64,
+        talkers: dict | None = None,
+        bundle_frames: int = 16,
+        bundle_size: int = 1200,
+    ):
+        """With resumption, a resumption ticket is handed to every client that authenticates. With echo, audio is relayed back to its sender too, so a single client can measure its own round trip. talkers are the arguments of a talkers.TalkerSimulation, whose packets are sent to every client once one has authenticated. bundle_frames and bundle_size are the most the server accepts when a client asks for bundling, in which case the frames for that client that are ready at the same time go out in one packet."""
+        self.port = port
+        self.fast_session = fast_session
+        self.resumption = resumption
+        self.echo = echo
+        self.bundle_frames = bundle_frames
+        self.bundle_size = bundle_size
+        self.rsa = RSA.generate(2048)
+        self.public_key = self.rsa.public_key().export_key()
+        self.rsa_cipher = PKCS1_OAEP.new(self.rsa)
+        self.net = enet.Host(enet.Address(b"127.0.0.1", port), max_peers, channels.count, 0, 0)
+        self.peers: dict[int, ServerPeer] = {}
+        self.tickets: dict[bytes, bytes] = {}  # Resumption ticket: key of the session it resumes
+        self.user_ids = itertools.count(1)
+        self.relayed = 0
+        self.rejected = 0
+        self.simulation = None
+        if talkers is not None:
+            from .talkers import TalkerSimulation  # Needs libopus
+
+            self.simulation = TalkerSimulation(**talkers)
+        # Simulated packets go out unsequenced, or ENet would drop the reordered ones before the client sees them
+        self.audio_flags = enet.PACKET_FLAG_UNSEQUENCED if self.simulation is not None else 0
+
+    @classmethod
+    def spawn(cls, port: int, **kwargs):
+        """Starts a server in a new process. Returns the process, an Event that stops it and a Queue that gets its stats once it stopped."""
+        ready = multiprocessing.Event()
+        stop = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=cls.serve,
+            args=(port, kwargs, ready, stop, results),
+            name="Stand-in-server",
+            daemon=True,
+        )
+        process.start()
+        if not ready.wait(30):
+            process.terminate()
+            raise RuntimeError("The stand-in server didn't start")
+        return process, stop, results
+
+    @classmethod
+    def serve(cls, port: int, kwargs: dict, ready, stop, results):
+        server = cls(port, **kwargs)
+        ready.set()
+        server.run(stop)
+        results.put(server.stats())
+
+    def run(self, stop):
+        # Fake talkers need finer timing than relaying does
+        timeout = 1 if self.simulation is not None else 5
+        while not stop.is_set():
+            event = self.net.service(timeout)
+            while event is not None and event.type != enet.EVENT_TYPE_NONE:
+                self.handle_event(event)
+                event = self.net.check_events()
+            if self.simulation is not None:
+                self.simulate()
+            for peer in self.peers.values():
+                self.flush_bundle(peer)
+            self.net.flush()
+
+    def simulate(self):
+        receivers = [peer for peer in self.peers.values() if peer.user_id is not None]
+        if not receivers:
+            return
+        for user_id, seq_number, frame in self.simulation.tick(time.perf_counter()):
+            for peer in receivers:
+                self.deliver(peer, user_id, seq_number, frame)
+
+    def stats(self) -> dict:
+        stats = {
+            "relayed": self.relayed,
+            "rejected": self.rejected,
+            "cpu_seconds": time.process_time(),
+        }
+        if self.simulation is not None:
+            stats["talkers"] = self.simulation.stats()
+        return stats
+
+    def handle_event(self, event):
+        key = event.peer.incomingPeerID
+        if event.type == enet.EVENT_TYPE_CONNECT:
+            self.peers[key] = ServerPeer(event.peer)
+            self.send(event.peer, channels.auth, self.public_key)
+        elif event.type == enet.EVENT_TYPE_DISCONNECT:
+            self.peers.pop(key, None)
+        elif event.type == enet.EVENT_TYPE_RECEIVE:
+            peer = self.peers.get(key)
+            if peer is None:
+                return
+            if peer.user_id is None:
+                if event.channelID == channels.auth:
+                    self.authenticate(peer, event.packet.data)
+            elif event.channelID in (channels.audio_in, channels.audio_bundle_in):
+                self.relay(peer, event.channelID, event.packet.data)
+            elif event.channelID == channels.auth:
+                self.negotiate(peer, event.packet.data)
+
+    def send(self, peer, channel: int, data: bytes, flags: int = enet.PACKET_FLAG_RELIABLE):
+        peer.send(channel, enet.Packet(data, flags=flags))
+
+    def authenticate(self, peer: ServerPeer, data: bytes):
+        if peer.session is None:
+            if self.resumption and data.startswith(resume_request):
+                return self.resume(peer, msgpack.loads(data[len(resume_request) :]))
+            peer.session = Session.for_server(self.rsa_cipher.decrypt(data), self.fast_session)
+            return
+        try:
+            proof = peer.session.decrypt(data, channels.auth)
+        except ValueError:
+            self.rejected += 1
+            return peer.peer.disconnect_now()
+        self.authenticated(peer, proof)
+
+    def resume(self, peer: ServerPeer, request: dict):
+        key = self.tickets.pop(request["ticket"], None)
+        if key is None:
+            return self.send(peer.peer, channels.auth, resume_rejected)
+        peer.session = Session.resume(key, request["salt"], fast=self.fast_session, server=True)
+        try:
+            proof = peer.session.decrypt(request["proof"], channels.auth)
+        except ValueError:
+            self.rejected += 1
+            return peer.peer.disconnect_now()
+        self.authenticated(peer, proof)
+
+    def authenticated(self, peer: ServerPeer, proof: bytes):
+        self.send(peer.peer, channels.auth, proof)
+        peer.user_id = next(self.user_ids)
+        if self.resumption:
+            ticket = os.urandom(16)
+            self.tickets[ticket] = peer.session.aes_key
+            message = {"event": "resumption_ticket", "data": {"ticket": ticket}}
+            self.send(peer.peer, channels.auth, peer.session.encrypt(msgpack.dumps(message), channels.auth))
+
+    def negotiate(self, peer: ServerPeer, data: bytes):
+        """Answers a client that asks for bundling with the sizes we accept."""
+        try:
+            message = msgpack.loads(peer.session.decrypt(data, channels.auth))
+        except ValueError:
+            self.rejected += 1
+            return
+        if message.get("event") != "bundling":
+            return
+        frames = min(self.bundle_frames, message["data"]["frames"])
+        peer.bundle_size = min(self.bundle_size, message["data"]["size"])
+        reply = {"event": "bundling", "data": {"frames": frames, "size": peer.bundle_size}}
+        self.send(peer.peer, channels.auth, peer.session.encrypt(msgpack.dumps(reply), channels.auth))
+
+    def relay(self, sender: ServerPeer, channel: int, data: bytes):
+        try:
+            data = sender.session.decrypt(data, channel)
+        except ValueError:
+            self.rejected += 1
+            return
+        if channel == channels.audio_in:
+            return self.relay_frame(sender, data)
+        for _, _, frame in audio_frames(audio_bundle, data):
+            self.relay_frame(sender, frame)
+
+    def relay_frame(self, sender: ServerPeer, frame: bytes):
+        seq_number = sender.seq_number
+        sender.seq_number = (seq_number + 1) & 0xFFFF
+        for peer in self.peers.values():
+            if peer.user_id is None or (peer is sender and not self.echo):
+                continue
+            self.deliver(peer, sender.user_id, seq_number, frame)
+            self.relayed += 1
+
+    def deliver(self, peer: ServerPeer, user_id: int, seq_number: int, frame: bytes):
+        """Sends a frame to a peer, or adds it to the peer's bundle if it asked for bundling."""
+        if peer.bundle_size is None:
+            packet = structs.audio_packet_header.pack(user_id, seq_number) + frame
+            return self.send(peer.peer, channels.audio_out, peer.session.encrypt(packet, channels.audio_out), flags=self.audio_flags)
+        entry = structs.audio_bundle_entry
+        if peer.bundle and len(peer.bundle) + entry.size + len(frame) > peer.bundle_size:
+            self.flush_bundle(peer)
+        peer.bundle += entry.pack(user_id, seq_number, len(frame))
+        peer.bundle += frame
+
+    def flush_bundle(self, peer: ServerPeer):
+        if peer.bundle:
+            self.send(peer.peer, channels.audio_bundle_out, peer.session.encrypt(peer.bundle, channels.audio_bundle_out), flags=self.audio_flags)
+            peer.bundle.clear()
@@ -0,0 +1,64 @@
+"""Startup benchmark: how long a cold headless client takes to connect.
+
+Run from the repository root with `python -m benchmarks.startup`. Starts `python -m app.headless --check` as a fresh process the given number of times against a local stand-in server, with a throwaway configuration file, and reports percentiles of the time from starting the process to being connected (authenticated) and to having the audio ready, as well as how much of it went by before main() got to run (interpreter start up and imports). Playout goes to OpenAL's null backend, and nothing is captured."""
+import os
+
+os.environ.setdefault("ALSOFT_DRIVERS", "null")  # Inherited by the clients
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from app.config import AppConfig
+from .e2e import percentiles
+from .server import StandInServer
+
+
+def run_client(args, config_path: str) -> dict:
+    command = [sys.executable, "-m", "app.headless", "--check", "--no-capture", "--config", config_path]
+    if args.no_audio:
+        command.append("--no-audio")
+    if args.fast_session:
+        command.append("--fast-session")
+    spawned = time.time()
+    output = subprocess.run(command, capture_output=True, text=True, timeout=30)
+    exited = time.time()
+    if output.returncode != 0:
+        raise RuntimeError(f"The client failed to connect: {output.stderr.strip()}")
+    timings = json.loads(output.stdout)
+    before_main = timings.pop("started_at") - spawned
+    result = {"before_main": before_main, "exited": exited - spawned}
+    for name, value in timings.items():
+        result[name.removesuffix("_ms")] = before_main + value / 1000
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--no-audio", action="store_true", help="Don't open the sound system either")
+    parser.add_argument("--fast-session", action="store_true")
+    parser.add_argument("--port", type=int, default=47953)
+    args = parser.parse_args()
+    server, stop_server, server_results = StandInServer.spawn(args.port, fast_session=args.fast_session)
+    with tempfile.TemporaryDirectory() as directory:
+        config_path = os.path.join(directory, "config.json")
+        AppConfig(host="127.0.0.1", port=args.port).save(config_path)
+        runs = [run_client(args, config_path) for _ in range(args.runs)]
+    stop_server.set()
+    server_results.get(timeout=10)
+    server.join()
+    results = {
+        "runs": args.runs,
+        "audio": not args.no_audio,
+        "fast_session": args.fast_session,
+        # In ms since the process was started
+        **{name: percentiles([run[name] for run in runs], (50, 90)) for name in runs[0]},
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Synthetic audio input, so benchmarks don't need a microphone."""
+import math
+import struct
+import time
+from contextlib import contextmanager
+
+
+class SyntheticCapture:
+    """Stands in for an opened cyal.CaptureDevice and can be passed to Transmitter. Produces a sine tone at 48 kHz, paced by the wall clock like a real device."""
+
+    def __init__(self, channels: int = 1, frequency: float = 400.0, amplitude: float = 0.3):
+        self.channels = channels
+        # One second of tone, played in a loop
+        tone = [
+            int(amplitude * 32767 * math.sin(2 * math.pi * frequency * i / 48000))
+            for i in range(48000)
+        ]
+        samples = [sample for sample in tone for _ in range(channels)]
+        self.tone = struct.pack(f"<{len(samples)}h", *samples)
+        self.position = 0  # Byte offset in the tone
+        self.started: float | None = None
+        self.captured = 0  # Samples per channel handed out since capturing started
+
+    @contextmanager
+    def capturing(self):
+        self.started = time.perf_counter()
+        self.captured = 0
+        try:
+            yield self
+        finally:
+            self.started = None
+
+    @property
+    def available_samples(self) -> int:
+        if self.started is None:
+            return 0
+        return int((time.perf_counter() - self.started) * 48000) - self.captured
+
+    def capture_samples(self, buffer: bytearray):
+        size = len(buffer)
+        filled = 0
+        while filled < size:
+            chunk = min(size - filled, len(self.tone) - self.position)
+            buffer[filled : filled + chunk] = self.tone[self.position : self.position + chunk]
+            filled += chunk
+            self.position = (self.position + chunk) % len(self.tone)
+        self.captured += size // (2 * self.channels)
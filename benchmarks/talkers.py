@@ -0,0 +1,149 @@
+"""Fake talkers for the stand-in server, so one client can be loaded with many speakers."""
+import ctypes
+import heapq
+import itertools
+import random
+from app.codec import Encoder
+from app.profiles import AudioProfile, get_profile
+from .synthetic import SyntheticCapture
+
+
+class Talker:
+    def __init__(self, user_id: int, start: float, seq_number: int):
+        self.user_id = user_id
+        self.next_frame = start
+        self.seq_number = seq_number
+        self.frame = 0  # Index of the next pre-encoded frame
+        self.active = True
+        self.speaking = True
+        self.spurt_end = 0.0  # When speaking changes next
+
+
+class TalkerSimulation:
+    """Produces the audio packets of a number of fake talkers, as the server would relay them, through a simulated network.
+
+    Every talker sends one pre-encoded Opus frame per frame duration. Each packet is lost with probability loss, delayed by up to jitter seconds, and with probability reorder held back by two frames so it arrives after the ones that follow it. churn is the number of talkers per second that leave and are replaced by a new one, with a new user id and sequence number. expected_loss turns on in-band FEC for that much loss, as in Transmitter. activity is the share of time talkers speak, in spurts of a few seconds. The rest of the time they send encoded silence."""
+
+    def __init__(
+        self,
+        talkers: int,
+        profile: AudioProfile | str,
+        jitter: float = 0.0,
+        loss: float = 0.0,
+        reorder: float = 0.0,
+        churn: float = 0.0,
+        seed: int | None = None,
+        first_user_id: int = 1000,
+        expected_loss: int | None = None,
+        activity: float = 1.0,
+    ):
+        self.profile = get_profile(profile)
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.churn = churn
+        self.random = random.Random(seed)
+        self.activity = activity
+        self.frames = self.encode_frames(50, expected_loss)
+        self.silence = self.encode_frames(50, expected_loss, silent=True)
+        self.user_ids = itertools.count(first_user_id)
+        self.talkers: list[Talker] = []
+        self.schedule: list[tuple[float, int, Talker]] = []  # Heap of (next frame time, tiebreak, talker)
+        self.in_flight: list[tuple[float, int, tuple[int, int, bytes]]] = []  # Heap of (delivery time, tiebreak, (user id, sequence number, frame))
+        self.order = itertools.count()
+        self.talker_count = talkers
+        self.started: float | None = None
+        self.departures = 0.0  # Talkers owed a departure, fractional
+        self.last_tick = 0.0
+        # Statistics
+        self.generated = 0
+        self.lost = 0
+        self.reordered = 0
+        self.joined = 0
+        self.left = 0
+
+    def encode_frames(self, count: int, expected_loss: int | None, silent: bool = False) -> list[bytes]:
+        """Encodes count frames of a tone (or of silence) once, so producing packets costs nothing"""
+        profile = self.profile
+        encoder = Encoder(channels=profile.channels, application=profile.application)
+        if profile.bitrate is not None:
+            encoder.set_bitrate(profile.bitrate)
+        if expected_loss is not None:
+            encoder.set_inband_fec(True)
+            encoder.set_packet_loss_percentage(expected_loss)
+        capture = SyntheticCapture(profile.channels, amplitude=0.0 if silent else 0.3)
+        buffer = bytearray(profile.frame_size * 2 * profile.channels)
+        pcm = (ctypes.c_int16 * (profile.frame_size * profile.channels)).from_buffer(buffer)
+        frames = []
+        for _ in range(count):
+            capture.capture_samples(buffer)
+            frames.append(bytes(encoder.encode(pcm, profile.frame_size)))
+        return frames
+
+    def join(self, now: float):
+        # Start somewhere in the frame so talkers don't all send at once
+        talker = Talker(
+            next(self.user_ids) & 0xFFFF,
+            now + self.random.uniform(0, self.profile.frame_duration),
+            self.random.randrange(0x10000),
+        )
+        self.talkers.append(talker)
+        heapq.heappush(self.schedule, (talker.next_frame, next(self.order), talker))
+        self.joined += 1
+
+    def leave(self):
+        talker = self.talkers.pop(self.random.randrange(len(self.talkers)))
+        talker.active = False  # Dropped from the schedule when it comes up
+        self.left += 1
+
+    def tick(self, now: float) -> list[tuple[int, int, bytes]]:
+        """Returns the user id, sequence number and Opus frame of every packet that arrives by now."""
+        if self.started is None:
+            self.started = self.last_tick = now
+            for _ in range(self.talker_count):
+                self.join(now)
+        if self.churn and self.talkers:
+            self.departures += self.churn * (now - self.last_tick)
+            while self.departures >= 1:
+                self.departures -= 1
+                self.leave()
+                self.join(now)
+        self.last_tick = now
+        while self.schedule and self.schedule[0][0] <= now:
+            sent, _, talker = heapq.heappop(self.schedule)
+            if not talker.active:
+                continue
+            self.send(talker, sent)
+            talker.next_frame = sent + self.profile.frame_duration
+            heapq.heappush(self.schedule, (talker.next_frame, next(self.order), talker))
+        arrived = []
+        while self.in_flight and self.in_flight[0][0] <= now:
+            arrived.append(heapq.heappop(self.in_flight)[2])
+        return arrived
+
+    def send(self, talker: Talker, sent: float):
+        seq_number = talker.seq_number
+        talker.seq_number = (seq_number + 1) & 0xFFFF
+        if self.activity < 1 and sent >= talker.spurt_end:
+            talker.speaking = self.random.random() < self.activity
+            talker.spurt_end = sent + self.random.uniform(1, 4)
+        frame = (self.frames if talker.speaking else self.silence)[talker.frame]
+        talker.frame = (talker.frame + 1) % len(self.frames)
+        self.generated += 1
+        if self.random.random() < self.loss:
+            self.lost += 1
+            return
+        delay = self.random.uniform(0, self.jitter)
+        if self.random.random() < self.reorder:
+            delay += 2 * self.profile.frame_duration
+            self.reordered += 1
+        heapq.heappush(self.in_flight, (sent + delay, next(self.order), (talker.user_id, seq_number, frame)))
+
+    def stats(self) -> dict:
+        return {
+            "generated": self.generated,
+            "lost": self.lost,
+            "reordered": self.reordered,
+            "joined": self.joined,
+            "left": self.left,
+        }
@@ -0,0 +1,84 @@
+"""The steady state receive path is meant to work out of preallocated frames. These run it for many frames under tracemalloc and check that nothing is kept per frame, and that no frame sized buffer is allocated even for a moment. A few hundred bytes may stay behind whatever the number of frames, from containers growing once and the loop's own variables, but any object kept per frame would take at least 16 bytes each."""
+import ctypes
+import math
+import tracemalloc
+import pytest
+from pyogg import opus
+from app.codec import Decoder
+from app.jitter_buffer import JitterBuffer
+from app.pcm_pool import FramePool
+
+frame_size = 960  # Samples per channel, 20 ms at 48 kHz
+capacity = frame_size * 2 * 2  # Bytes of a stereo frame
+frames = 10000
+
+
+def measure(step, warmup: int = 200) -> tuple[float, int]:
+    """Returns how many bytes per frame running step frames times left allocated, and the most that was allocated at once while it ran."""
+    for i in range(warmup):
+        step(i)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        for i in range(warmup, warmup + frames):
+            step(i)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (current - before) / frames, peak - before
+
+
+@pytest.fixture(scope="module")
+def packet() -> bytes:
+    """A stereo Opus frame of a tone."""
+    error = ctypes.c_int()
+    encoder = opus.opus_encoder_create(48000, 2, opus.OPUS_APPLICATION_AUDIO, ctypes.byref(error))
+    assert error.value == opus.OPUS_OK
+    pcm = (ctypes.c_int16 * (frame_size * 2))(*(int(8000 * math.sin(i / 10)) for i in range(frame_size * 2)))
+    output = (ctypes.c_ubyte * 4000)()
+    size = opus.opus_encode(encoder, pcm, frame_size, output, len(output))
+    opus.opus_encoder_destroy(encoder)
+    assert size > 0
+    return bytes(output[:size])
+
+
+def test_frame_pool():
+    pool = FramePool(4, capacity)
+
+    def step(i):
+        pool.release(pool.acquire())
+
+    kept, peak = measure(step)
+    assert kept < 1
+    assert peak < capacity
+
+
+def test_jitter_buffer():
+    pool = FramePool(16, capacity)
+    buffer = JitterBuffer(0.02, discard=pool.release)
+
+    def step(i):
+        buffer.put(i & 0xFFFF, pool.acquire())
+        result = buffer.pop()
+        if result is not None and result[1] is not None:
+            pool.release(result[1])
+
+    kept, peak = measure(step)
+    assert kept < 1
+    assert peak < capacity
+    assert buffer.lost == 0
+
+
+def test_decode_into(packet):
+    decoder = Decoder()
+    pool = FramePool(1, capacity)
+    frame = pool.acquire()
+
+    def step(i):
+        assert decoder.decode_into(packet, frame) == frame_size
+
+    kept, peak = measure(step)
+    assert kept < 1
+    assert peak < capacity
+    assert frame.length == capacity
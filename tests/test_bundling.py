@@ -0,0 +1,95 @@
+import pytest
+from app import channels, structs, trace
+from app.protocol import ClientProtocol, ClientState
+
+entry = structs.audio_bundle_entry
+
+
+def bundle(*frames: tuple[int, int, bytes]) -> bytes:
+    return b"".join(entry.pack(user_id, seq, len(frame)) + frame for user_id, seq, frame in frames)
+
+
+class PlainSession:
+    def encrypt(self, data: bytes, channel: int) -> bytes:
+        return bytes(data)
+
+
+class Protocol(ClientProtocol):
+    """Connected with bundling agreed on, keeping what it sends and receives."""
+
+    def __init__(self, **kwargs):
+        super().__init__(bundling=True, **kwargs)
+        self.state = ClientState.CONNECTED
+        self.session = PlainSession()
+        self.bundled = True
+        self.sent = []
+        self.received = []
+
+    def transmit(self, channel, data, flags):
+        self.sent.append((channel, data))
+
+    def deliver_audio(self, user_id, seq_number, opus_audio):
+        self.received.append((user_id, seq_number, bytes(opus_audio)))
+
+
+def frames(packet: bytes) -> list[tuple[int, int, bytes]]:
+    return [(user_id, seq, bytes(frame)) for user_id, seq, frame in trace.audio_frames(trace.audio_bundle, packet)]
+
+
+def test_parses_bundles():
+    packet = bundle((1, 7, b"one"), (2, 65535, b""), (3, 9, b"three"))
+    assert frames(packet) == [(1, 7, b"one"), (2, 65535, b""), (3, 9, b"three")]
+
+
+def test_parses_single_frames():
+    packet = structs.audio_packet_header.pack(4, 10) + b"opus"
+    assert [(user_id, seq, bytes(frame)) for user_id, seq, frame in trace.audio_frames(trace.audio, packet)] == [(4, 10, b"opus")]
+
+
+@pytest.mark.parametrize("tail", [entry.pack(3, 9, 10) + b"cut", entry.pack(3, 9, 10), b"\x03\x00"])
+def test_drops_a_truncated_final_entry(tail):
+    packet = bundle((1, 7, b"one"), (2, 8, b"two")) + tail
+    assert frames(packet) == [(1, 7, b"one"), (2, 8, b"two")]
+
+
+def test_receive_audio():
+    protocol = Protocol()
+    protocol.receive_audio(structs.audio_packet_header.pack(1, 5) + b"single")
+    protocol.receive_audio(bundle((2, 6, b"one"), (3, 7, b"two")) + entry.pack(4, 8, 100), bundled=True)
+    assert protocol.received == [(1, 5, b"single"), (2, 6, b"one"), (3, 7, b"two")]
+
+
+def test_packs_bundle_frames_per_packet():
+    protocol = Protocol(bundle_frames=3)
+    for seq in range(7):
+        protocol.send_frame(bytes([seq]) * 20)
+    assert [channel for channel, _ in protocol.sent] == [channels.audio_bundle_in] * 2
+    protocol.flush_bundle()
+    packets = [frames(packet) for _, packet in protocol.sent]
+    assert [[seq for _, seq, _ in packet] for packet in packets] == [[0, 1, 2], [3, 4, 5], [6]]
+    assert packets[1][0][2] == bytes([3]) * 20
+
+
+def test_packs_up_to_bundle_size():
+    size = 2 * (entry.size + 100)
+    protocol = Protocol(bundle_frames=10, bundle_size=size)
+    for seq in range(5):
+        protocol.send_frame(bytes(100))
+    protocol.flush_bundle()
+    assert [len(frames(packet)) for _, packet in protocol.sent] == [2, 2, 1]
+    assert all(len(packet) <= size for _, packet in protocol.sent)
+
+
+def test_a_frame_too_big_for_a_bundle_goes_alone():
+    protocol = Protocol(bundle_frames=10, bundle_size=50)
+    protocol.send_frame(bytes(10))
+    protocol.send_frame(bytes(100))
+    protocol.flush_bundle()
+    assert [len(frames(packet)) for _, packet in protocol.sent] == [1, 1]
+
+
+def test_sends_single_frames_until_bundling_is_agreed():
+    protocol = Protocol(bundle_frames=3)
+    protocol.bundled = False
+    protocol.send_frame(b"frame")
+    assert protocol.sent == [(channels.audio_in, b"frame")]
@@ -0,0 +1,88 @@
+import pytest
+from app.congestion import CongestionController, packet_loss_scale
+from app.profiles import profiles
+
+
+class Peer:
+    def __init__(self, rtt: int, loss: float):
+        self.roundTripTime = rtt
+        self.packetLoss = int(loss * packet_loss_scale)
+
+
+@pytest.fixture
+def controller() -> CongestionController:
+    return CongestionController(min_bitrate=8000, max_bitrate=64000, start_bitrate=32000)
+
+
+def test_cuts_bitrate_on_loss(controller):
+    decision = controller.sample(50, 0.10)
+    assert decision.bitrate == 24000
+    assert decision.fec
+    assert decision.packet_loss_percentage == 10
+
+
+def test_cuts_bitrate_on_queueing_delay(controller):
+    assert controller.sample(40, 0.0).bitrate == 34800
+    # Loss is fine, but the round trip grew 150 ms over the lowest one seen
+    assert controller.sample(190, 0.0).bitrate == 26100
+    assert controller.base_rtt == 40
+
+
+def test_raises_bitrate_while_the_path_is_clean(controller):
+    bitrates = [controller.sample(40, 0.0).bitrate for _ in range(3)]
+    assert bitrates == [34800, 37600, 40400]
+
+
+def test_holds_bitrate_in_between(controller):
+    # Between low_loss and high_loss
+    assert controller.sample(40, 0.03).bitrate == 32000
+    assert controller.sample(40, 0.03) is None
+    assert controller.bitrate == 32000
+
+
+def test_stays_within_bounds(controller):
+    for _ in range(50):
+        controller.sample(40, 0.5)
+    assert controller.bitrate == controller.min_bitrate
+    for _ in range(100):
+        controller.sample(40, 0.0)
+    assert controller.bitrate == controller.max_bitrate
+
+
+def test_fec_and_expected_loss(controller):
+    assert not controller.sample(40, 0.005).fec
+    decision = controller.sample(40, 0.012)
+    assert decision.fec
+    assert decision.packet_loss_percentage == 2  # Rounded up
+    assert controller.sample(40, 1.5).packet_loss_percentage == 100
+    assert controller.sample(40, 0.0).packet_loss_percentage == 0
+
+
+def test_only_decides_when_settings_change():
+    controller = CongestionController(max_bitrate=32000)
+    decisions = []
+    controller.listeners.append(decisions.append)
+    assert controller.sample(40, 0.0) is not None  # The first sample always decides
+    assert controller.sample(40, 0.0) is None  # Already at max_bitrate, nothing changed
+    assert controller.sample(60, 0.02) is not None  # FEC turned on
+    assert controller.decisions == len(decisions) == 2
+    assert decisions[-1] is controller.decision
+
+
+def test_for_profile_caps_at_the_profiles_bitrate():
+    controller = CongestionController.for_profile(profiles["low_bandwidth"])
+    assert controller.max_bitrate == controller.bitrate == 12000
+    assert controller.min_bitrate == 8000
+    for _ in range(10):
+        controller.sample(40, 0.0)
+    assert controller.bitrate == 12000
+    capped = CongestionController.for_profile(profiles["voice"], min_bitrate=48000)
+    assert capped.min_bitrate == capped.max_bitrate == 32000
+    assert CongestionController.for_profile(profiles["music"]).max_bitrate == 64000
+
+
+def test_sample_peer(controller):
+    decision = controller.sample_peer(Peer(80, 0.25))
+    assert decision.rtt == 80
+    assert decision.loss == pytest.approx(0.25)
+    assert decision.packet_loss_percentage == 25
@@ -0,0 +1,110 @@
+import threading
+import time
+import pytest
+from app.decode_pipeline import DecodePipeline, DropPolicy
+
+
+class User:
+    """Records what it was asked to decode. With block, the first decode waits for release, so packets pile up in the queues."""
+
+    def __init__(self, id: int, block: bool = False):
+        self.id = id
+        self.decoded = []
+        self.busy = threading.Event()
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+
+    def decode_packet(self, packet, seq_number, arrival):
+        self.busy.set()
+        self.release.wait(5)
+        self.decoded.append(seq_number)
+
+
+def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+@pytest.fixture
+def make_pipeline():
+    pipelines = []
+
+    def make(**kwargs):
+        pipelines.append(DecodePipeline(**kwargs))
+        return pipelines[-1]
+
+    yield make
+    for pipeline in pipelines:
+        pipeline.destroy()
+
+
+def hold(pipeline: DecodePipeline, user: User):
+    """Keeps the user's worker busy decoding packet 0."""
+    pipeline.submit(user, b"", 0)
+    assert user.busy.wait(5)
+
+
+def test_decodes_in_order(make_pipeline):
+    pipeline = make_pipeline(workers=2, queue_size=32)
+    user = User(1)
+    for seq in range(20):
+        assert pipeline.submit(user, b"", seq)
+    wait_for(lambda: pipeline.decoded == 20)
+    assert user.decoded == list(range(20))
+    assert pipeline.dropped == 0
+
+
+def test_drop_oldest(make_pipeline):
+    pipeline = make_pipeline(workers=1, queue_size=4, policy=DropPolicy.DROP_OLDEST)
+    user = User(1, block=True)
+    hold(pipeline, user)
+    for seq in range(1, 7):
+        assert pipeline.submit(user, b"", seq)
+    assert pipeline.dropped == 2
+    user.release.set()
+    wait_for(lambda: pipeline.decoded == 5)
+    assert user.decoded == [0, 3, 4, 5, 6]
+
+
+def test_drop_newest(make_pipeline):
+    pipeline = make_pipeline(workers=1, queue_size=4, policy=DropPolicy.DROP_NEWEST)
+    user = User(1, block=True)
+    hold(pipeline, user)
+    accepted = [pipeline.submit(user, b"", seq) for seq in range(1, 7)]
+    assert accepted == [True, True, True, True, False, False]
+    assert pipeline.dropped == 2
+    user.release.set()
+    wait_for(lambda: pipeline.decoded == 5)
+    assert user.decoded == [0, 1, 2, 3, 4]
+
+
+def test_queues_are_bounded_per_user(make_pipeline):
+    pipeline = make_pipeline(workers=1, queue_size=4)
+    busy, other = User(1, block=True), User(2)
+    hold(pipeline, busy)
+    for seq in range(1, 5):
+        pipeline.submit(busy, b"", seq)
+        pipeline.submit(other, b"", seq)
+    # A full queue doesn't take packets from anyone else's
+    assert pipeline.queue_depths() == {1: 4, 2: 4}
+    assert pipeline.peak_depth == 4
+    assert pipeline.dropped == 0
+    busy.release.set()
+    wait_for(lambda: pipeline.decoded == 9)
+    assert other.decoded == [1, 2, 3, 4]
+
+
+def test_forget(make_pipeline):
+    pipeline = make_pipeline(workers=1)
+    busy, leaving = User(1, block=True), User(2)
+    hold(pipeline, busy)
+    pipeline.submit(leaving, b"", 1)
+    pipeline.forget(leaving)
+    assert 2 not in pipeline.queue_depths()
+    pipeline.submit(busy, b"", 1)
+    busy.release.set()
+    wait_for(lambda: pipeline.decoded == 2)
+    assert leaving.decoded == []
@@ -0,0 +1,85 @@
+import threading
+import msgpack
+from app.event_handler import ControlDispatcher, EventHandler
+from app.headless import HeadlessEventHandler
+from app.recorder import Recorder
+
+
+class Handler(EventHandler):
+    def __init__(self):
+        super().__init__(None, None)
+        self.handled = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def event_joined(self, data):
+        self.release.wait(5)
+        self.handled.append(("joined", data))
+
+    def event_left(self, data):
+        self.handled.append(("left", data))
+
+    def event_broken(self, data):
+        raise RuntimeError("broken handler")
+
+
+def test_dispatch_calls_the_handler():
+    handler = Handler()
+    handler.dispatch({"event": "joined", "data": {"id": 1}})
+    handler.dispatch({"event": "left"})
+    assert handler.handled == [("joined", {"id": 1}), ("left", None)]
+    assert handler.unknown_events == 0
+
+
+def test_dispatch_counts_unknown_events():
+    handler = Handler()
+    for message in ({"event": "nope"}, {"data": {}}, None, 5, "joined", [1]):
+        handler.dispatch(message)
+    assert handler.unknown_events == 6
+    assert handler.handled == []
+
+
+def test_dispatcher_keeps_order():
+    handler = Handler()
+    dispatcher = ControlDispatcher(handler)
+    for i in range(100):
+        dispatcher.put({"event": "joined" if i % 2 else "left", "data": i})
+    dispatcher.destroy()
+    assert [data for _, data in handler.handled] == list(range(100))
+
+
+def test_dispatcher_survives_nil_and_broken_handlers(capsys):
+    handler = Handler()
+    dispatcher = ControlDispatcher(handler)
+    dispatcher.put(msgpack.unpackb(msgpack.packb(None)))
+    dispatcher.put({"event": "broken"})
+    dispatcher.put({"event": "left", "data": 1})
+    dispatcher.destroy()
+    assert handler.handled == [("left", 1)]
+    assert handler.unknown_events == 1
+    assert "broken handler" in capsys.readouterr().err
+
+
+def test_destroy_handles_what_was_queued_first():
+    handler = Handler()
+    handler.release.clear()
+    dispatcher = ControlDispatcher(handler)
+    dispatcher.put({"event": "joined", "data": 1})
+    dispatcher.put({"event": "left", "data": 2})
+    threading.Timer(0.05, handler.release.set).start()
+    dispatcher.destroy()
+    assert not dispatcher.is_alive()
+    assert handler.handled == [("joined", 1), ("left", 2)]
+
+
+def test_records_audio(tmp_path):
+    recorder = Recorder(str(tmp_path))
+    handler = HeadlessEventHandler(None, None, recorder)
+    for seq in range(3):
+        handler.audio(1, seq, bytes([0xFC, seq]))
+    recorder.destroy()
+    # There's no playout engine yet, so nothing was played, but everything was recorded
+    assert handler.dropped == 3
+    (path,) = tmp_path.iterdir()
+    assert path.name.endswith("-user1-1.opus")
+    assert path.read_bytes().startswith(b"OggS")
@@ -0,0 +1,188 @@
+from app.jitter_buffer import JitterBuffer, seq_diff
+
+frame = 0.02
+
+
+def drain(buffer: JitterBuffer, now: float = 10.0) -> list:
+    """Pops everything the buffer has to play, as (seq_number, frame) pairs."""
+    played = []
+    while buffer.frames:
+        result = buffer.pop(now)
+        if result is None:
+            break
+        played.append(result)
+    return played
+
+
+def test_seq_diff():
+    assert seq_diff(5, 3) == 2
+    assert seq_diff(3, 5) == -2
+    assert seq_diff(2, 0xFFFE) == 4
+    assert seq_diff(0xFFFE, 2) == -4
+    assert seq_diff(0x8000, 0) == -0x8000
+
+
+def test_reorders_frames():
+    buffer = JitterBuffer(frame, min_depth=3)
+    for seq in (10, 12, 11, 13):
+        assert buffer.put(seq, f"frame {seq}", 0.0)
+    assert drain(buffer) == [(seq, f"frame {seq}") for seq in range(10, 14)]
+    assert buffer.lost == 0
+
+
+def test_reordering_before_playout_starts():
+    buffer = JitterBuffer(frame, min_depth=3)
+    assert buffer.put(11, "b", 0.0)
+    assert buffer.wants(10)
+    assert buffer.put(10, "a", 0.0)
+    assert drain(buffer) == [(10, "a"), (11, "b")]
+    assert buffer.late == 0
+    # Once playout started, earlier frames are late again
+    assert not buffer.wants(9)
+    assert not buffer.put(9, "z", 10.0)
+    assert buffer.late == 1
+
+
+def test_waits_for_target_depth():
+    buffer = JitterBuffer(frame, min_depth=3)
+    buffer.put(1, "a", 0.0)
+    buffer.put(2, "b", 0.0)
+    assert buffer.pop(0.0) is None
+    buffer.put(3, "c", 0.0)
+    assert buffer.pop(0.0) == (1, "a")
+
+
+def test_releases_the_tail_of_a_talk_spurt():
+    buffer = JitterBuffer(frame, min_depth=3)
+    # The sender went quiet long ago, so there's no point waiting for the target depth
+    buffer.put(1, "a", 0.0)
+    assert buffer.pop(1.0) == (1, "a")
+
+
+def test_late_and_duplicate_frames():
+    buffer = JitterBuffer(frame, min_depth=1)
+    buffer.put(1, "a", 0.0)
+    buffer.put(2, "b", 0.0)
+    assert not buffer.put(2, "b", 0.0)
+    assert buffer.pop(0.0) == (1, "a")
+    assert not buffer.wants(1)
+    assert not buffer.put(1, "a", 0.0)
+    assert buffer.duplicates == 1
+    assert buffer.late == 1
+
+
+def test_lost_frame():
+    buffer = JitterBuffer(frame, min_depth=1)
+    buffer.put(1, "a", 0.0)
+    buffer.put(3, "c", 0.0)
+    assert drain(buffer) == [(1, "a"), (2, None), (3, "c")]
+    assert buffer.lost == 1
+
+
+def test_wraparound():
+    buffer = JitterBuffer(frame, min_depth=3)
+    for seq in (0xFFFE, 0, 0xFFFF, 1):
+        buffer.put(seq, seq, 0.0)
+    assert [seq for seq, _ in drain(buffer)] == [0xFFFE, 0xFFFF, 0, 1]
+
+
+def test_restarts_on_large_jumps_either_way():
+    buffer = JitterBuffer(frame, min_depth=1, max_depth=4)
+    buffer.put(1000, "old", 0.0)
+    buffer.put(5, "new", 0.0)
+    assert drain(buffer) == [(5, "new")]
+    buffer.put(2000, "newer", 0.0)
+    assert drain(buffer) == [(2000, "newer")]
+    assert buffer.late == 0
+
+
+def test_catches_up_when_holding_too_much():
+    discarded = []
+    buffer = JitterBuffer(frame, min_depth=2, max_depth=2, discard=discarded.append)
+    for seq in range(6):
+        buffer.put(seq, seq, 0.0)
+    # Holding more than 2 frames past the target depth, the oldest are dropped
+    assert buffer.pop(0.0) == (2, 2)
+    assert buffer.dropped == 2
+    assert discarded == [0, 1]
+
+
+def test_reset_discards_held_frames():
+    discarded = []
+    buffer = JitterBuffer(frame, discard=discarded.append)
+    buffer.put(1, "a", 0.0)
+    buffer.put(2, "b", 0.0)
+    buffer.reset()
+    assert sorted(discarded) == ["a", "b"]
+    assert len(buffer) == 0
+
+
+def test_rejecting_frames_it_doesnt_want():
+    buffer = JitterBuffer(frame, min_depth=1)
+    buffer.put(1, "a", 0.0)
+    buffer.put(2, "b", 0.0)
+    buffer.pop(0.0)
+    assert not buffer.wants(2)
+    buffer.reject(2)
+    assert not buffer.wants(1)
+    buffer.reject(1)
+    assert buffer.wants(3)
+    assert buffer.duplicates == 1
+    assert buffer.late == 1
+
+
+def test_recovers_only_frames_that_never_arrived():
+    asked = []
+
+    def recover(seq):
+        asked.append(seq)
+        return f"recovered {seq}"
+
+    buffer = JitterBuffer(frame, min_depth=3, recover=recover)
+    # 11 is reordered rather than lost, 13 is lost
+    for seq in (10, 12, 11, 14, 15):
+        buffer.put(seq, f"frame {seq}", 0.0)
+    played = drain(buffer)
+    assert played == [
+        (10, "frame 10"),
+        (11, "frame 11"),
+        (12, "frame 12"),
+        (13, "recovered 13"),
+        (14, "frame 14"),
+        (15, "frame 15"),
+    ]
+    assert asked == [13]
+    assert buffer.recovered == 1
+    assert buffer.lost == 0
+    assert buffer.duplicates == 0
+
+
+def test_target_depth_follows_jitter():
+    steady = JitterBuffer(frame, max_depth=10)
+    jittery = JitterBuffer(frame, max_depth=10)
+    for seq in range(50):
+        steady.put(seq, seq, seq * frame)
+        jittery.put(seq, seq, seq * frame + (0.06 if seq % 2 else 0.0))
+    assert steady.target_depth <= 2
+    assert jittery.target_depth > 3
+
+
+def test_pause_is_not_an_underrun():
+    buffer = JitterBuffer(frame, min_depth=1, pause_threshold=0.25)
+    buffer.put(1, "a", 0.0)
+    assert buffer.pop(0.0) == (1, "a")
+    assert buffer.pop(0.02) is None
+    buffer.put(2, "b", 1.0)
+    assert buffer.pauses == 1
+    assert buffer.underruns == 0
+    assert buffer.pop(1.0) == (2, "b")
+
+
+def test_underrun():
+    buffer = JitterBuffer(frame, min_depth=1, pause_threshold=0.25)
+    buffer.put(1, "a", 0.0)
+    assert buffer.pop(0.0) == (1, "a")
+    assert buffer.pop(0.02) is None
+    buffer.put(2, "b", 0.05)
+    assert buffer.underruns == 1
+    assert buffer.pauses == 0
@@ -0,0 +1,115 @@
+import json
+import pytest
+from app import metrics
+from app.metrics import Registry, null_metric
+
+
+@pytest.fixture
+def registry() -> Registry:
+    return Registry(enabled=True)
+
+
+def test_histogram_buckets(registry):
+    histogram = registry.histogram("latency", buckets=(1.0, 2.0, 4.0))
+    for value in (0.5, 1.0, 1.5, 3.0, 10.0):
+        histogram.observe(value)
+    # A value on a bound counts in that bound's bucket, and the last bucket takes everything above the highest bound
+    assert histogram.counts == [2, 1, 1, 1]
+    assert histogram.count == 5
+    assert histogram.sum == 16.0
+    assert (histogram.min, histogram.max) == (0.5, 10.0)
+
+
+def test_histogram_percentiles(registry):
+    histogram = registry.histogram("latency", buckets=(1.0, 2.0, 4.0))
+    assert histogram.percentile(50) is None
+    assert histogram.snapshot() == {"count": 0}
+    for value in [0.5] * 90 + [3.0] * 9 + [10.0]:
+        histogram.observe(value)
+    # The upper bound of the bucket the percentile falls in
+    assert histogram.percentile(50) == histogram.percentile(90) == 1.0
+    assert histogram.percentile(99) == 4.0
+    assert histogram.percentile(100) == 10.0  # Above the highest bound, so the largest value seen
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 100
+    assert snapshot["mean"] == pytest.approx(0.82)
+    assert snapshot["p99"] == 4.0
+
+
+def test_percentiles_are_capped_at_the_largest_value(registry):
+    histogram = registry.histogram("latency", buckets=(1.0, 2.0, 4.0))
+    histogram.observe(2.5)
+    assert histogram.percentile(50) == 2.5
+
+
+def test_counters_and_gauges(registry):
+    counter = registry.counter("packets")
+    counter.inc()
+    counter.inc(4)
+    assert registry.counter("packets") is counter  # Shared by everyone who asks
+    assert counter.value == 5
+    gauge = registry.gauge("depth", function=lambda: 7)
+    assert gauge.value == 7
+
+
+def test_disabled_registry_hands_out_null_metrics():
+    registry = Registry()
+    counter = registry.counter("packets", function=lambda: 1)
+    histogram = registry.histogram("latency")
+    assert counter is histogram is null_metric
+    assert not histogram
+    histogram.observe(1.0)
+    counter.inc()
+    counter.set(2)
+    registry.unregister(counter, histogram)
+    assert registry.snapshot()["metrics"] == []
+
+
+def test_function_metrics_need_an_owner_each(registry):
+    registry.counter("decoded", function=lambda: 1)
+    with pytest.raises(ValueError):
+        registry.counter("decoded", function=lambda: 2)
+
+
+def test_instance_labels():
+    first = metrics.instance_labels({"user": 3})
+    second = metrics.instance_labels({"user": 3})
+    assert first["user"] == second["user"] == 3
+    assert first["instance"] != second["instance"]
+    assert "instance" in metrics.instance_labels()
+
+
+def test_instances_dont_share_metrics(registry):
+    first = registry.counter("decoded", metrics.instance_labels(), function=lambda: 1)
+    second = registry.counter("decoded", metrics.instance_labels(), function=lambda: 2)
+    assert first is not second
+    values = sorted(entry["value"] for entry in registry.snapshot()["metrics"])
+    assert values == [1, 2]
+
+
+def test_unregister(registry):
+    old = registry.gauge("depth", {"user": 1})
+    registry.unregister(old)
+    assert registry.snapshot()["metrics"] == []
+    new = registry.gauge("depth", {"user": 1})
+    assert new is not old
+    # Unregistering a metric that was already replaced leaves the new one alone
+    registry.unregister(old)
+    assert registry.gauge("depth", {"user": 1}) is new
+
+
+def test_snapshot_skips_metrics_that_fail(registry):
+    registry.gauge("broken", function=lambda: 1 / 0)
+    registry.counter("fine").inc()
+    entries = registry.snapshot()["metrics"]
+    assert [(entry["name"], entry["type"], entry["value"]) for entry in entries] == [("fine", "counter", 1)]
+
+
+def test_exporter_writes_a_last_snapshot(registry, tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    registry.counter("packets").inc(3)
+    exporter = metrics.Exporter(interval=60, path=str(path), registry=registry)
+    exporter.destroy()
+    (line,) = path.read_text().splitlines()
+    assert json.loads(line)["metrics"][0]["value"] == 3
+    assert exporter.errors == 0
@@ -0,0 +1,42 @@
+import pytest
+from app.playout import PlayoutEngine
+from benchmarks.replay import VirtualPlayout
+
+
+class User:
+    def __init__(self, id: int):
+        self.id = id
+        self.jitter_buffer = [b"frame"]
+
+    def update(self) -> bool:
+        return True
+
+
+@pytest.fixture(params=["engine", "virtual"])
+def playout(request):
+    if request.param == "virtual":
+        yield VirtualPlayout()
+        return
+    engine = PlayoutEngine(None)
+    yield engine
+    engine.destroy()
+
+
+def test_activates_registered_users(playout):
+    user = User(1)
+    playout.activate(user)
+    assert user not in playout.active
+    playout.add(user)
+    playout.activate(user)
+    assert user in playout.active
+
+
+def test_ignores_users_that_were_replaced(playout):
+    """A user that left can still get audio from the decode pipeline after someone with the same id joined."""
+    old, new = User(1), User(1)
+    playout.add(old)
+    playout.add(new)
+    playout.activate(old)
+    assert old not in playout.active
+    playout.remove(old)
+    assert playout.users[1] is new
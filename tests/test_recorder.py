@@ -0,0 +1,113 @@
+import struct
+from app.recorder import OggOpusStream, ogg_crc, ogg_page_header, opus_packet_samples
+
+toc = 0xFC  # CELT, 20 ms, stereo, one frame per packet
+
+
+def reference_crc(data: bytes) -> int:
+    """CRC-32 the way the Ogg spec defines it: polynomial 0x04C11DB7, no bit reflection, no initial value or final XOR."""
+    crc = 0
+    for byte in data:
+        crc ^= byte << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+            crc &= 0xFFFFFFFF
+    return crc
+
+
+def packet(seq_number: int) -> bytes:
+    return bytes([toc]) + seq_number.to_bytes(2, "big")
+
+
+def pages(data: bytes) -> list[tuple[tuple, list[bytes]]]:
+    """Splits an Ogg stream into (header fields, packets) per page, checking every page's CRC."""
+    result = []
+    offset = 0
+    while offset < len(data):
+        header = ogg_page_header.unpack_from(data, offset)
+        segments = header[-1]
+        start = offset + ogg_page_header.size
+        lacing = data[start : start + segments]
+        end = start + segments + sum(lacing)
+        page = bytearray(data[offset:end])
+        struct.pack_into("<I", page, 22, 0)
+        assert reference_crc(bytes(page)) == header[6]
+        packets, current, position = [], b"", start + segments
+        for size in lacing:
+            current += data[position : position + size]
+            position += size
+            if size < 255:
+                packets.append(current)
+                current = b""
+        result.append((header, packets))
+        offset = end
+    return result
+
+
+def audio_packets(stream: OggOpusStream) -> list[bytes]:
+    return [packet for _, packets in pages(stream.flush(final=True))[2:] for packet in packets]
+
+
+def test_ogg_crc():
+    assert ogg_crc(b"") == 0
+    assert ogg_crc(b"123456789") == reference_crc(b"123456789") == 0x89A1897F
+    data = bytes(range(256)) * 3
+    assert ogg_crc(data) == reference_crc(data)
+
+
+def test_opus_packet_samples():
+    assert opus_packet_samples(bytes([toc])) == 960
+    assert opus_packet_samples(bytes([toc | 1])) == 1920  # Two frames
+    assert opus_packet_samples(bytes([0x00])) == 480  # SILK, 10 ms
+    assert opus_packet_samples(bytes([toc | 3, 3])) == 2880  # Three frames, signalled in the second byte
+
+
+def test_pages_are_valid_ogg_opus(tmp_path):
+    stream = OggOpusStream(str(tmp_path / "out.opus"), serial=7)
+    for seq in range(100):
+        stream.add(seq, packet(seq))
+    result = pages(stream.flush(final=True))
+    (_, (head,)), (_, (tags,)) = result[:2]
+    assert head.startswith(b"OpusHead")
+    assert head[9] == 2  # Channels
+    assert tags.startswith(b"OpusTags")
+    assert [header[5] for header, _ in result] == list(range(len(result)))  # Page sequence numbers
+    _, _, flags, granule, serial, _, _, _ = result[-1][0]
+    assert flags & 0x04  # Last page
+    assert granule == 100 * 960
+    assert serial == 7
+
+
+def test_reorders_within_the_window(tmp_path):
+    stream = OggOpusStream(str(tmp_path / "out.opus"), serial=1, reorder=4)
+    for seq in (0, 2, 1, 3):
+        stream.add(seq, packet(seq))
+    assert audio_packets(stream) == [packet(seq) for seq in range(4)]
+    assert stream.filled == 0
+
+
+def test_fills_lost_packets(tmp_path):
+    stream = OggOpusStream(str(tmp_path / "out.opus"), serial=1, reorder=2)
+    for seq in (0, 1, 3, 4, 5):
+        stream.add(seq, packet(seq))
+    assert audio_packets(stream) == [packet(0), packet(1), bytes([toc]), packet(3), packet(4), packet(5)]
+    assert stream.filled == 1
+
+
+def test_late_and_duplicate_packets(tmp_path):
+    stream = OggOpusStream(str(tmp_path / "out.opus"), serial=1, reorder=2)
+    for seq in (0, 1, 1, 0, 2):
+        stream.add(seq, packet(seq))
+    stream.add(3, b"")
+    assert audio_packets(stream) == [packet(seq) for seq in range(3)]
+    assert stream.late == 3
+
+
+def test_starts_over_when_sequence_numbers_jump_back(tmp_path):
+    stream = OggOpusStream(str(tmp_path / "out.opus"), serial=1)
+    for seq in range(5000, 5050):
+        stream.add(seq, packet(seq))
+    for seq in range(50):
+        stream.add(seq, packet(seq))
+    assert len(audio_packets(stream)) == 100
+    assert stream.late == 0
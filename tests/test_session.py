@@ -0,0 +1,105 @@
+import os
+import pytest
+from app import channels
+from app.session import ReplayWindow, Session
+
+
+def accept(window: ReplayWindow, counter: int) -> bool:
+    if not window.check(counter):
+        return False
+    window.update(counter)
+    return True
+
+
+def test_replay_window_rejects_repeats():
+    window = ReplayWindow()
+    assert accept(window, 0)
+    assert accept(window, 1)
+    assert not accept(window, 1)
+    assert not accept(window, 0)
+
+
+def test_replay_window_accepts_reordering_within_the_window():
+    window = ReplayWindow(size=64)
+    assert accept(window, 10)
+    assert accept(window, 5)
+    assert accept(window, 100)
+    assert accept(window, 37)
+    assert not accept(window, 37)
+
+
+def test_replay_window_rejects_counters_behind_the_window():
+    window = ReplayWindow(size=64)
+    assert accept(window, 100)
+    assert accept(window, 37)  # 63 behind
+    assert not accept(window, 36)  # 64 behind
+
+
+def test_check_alone_doesnt_mark_counters():
+    window = ReplayWindow()
+    assert window.check(3)
+    assert window.check(3)
+
+
+@pytest.fixture
+def sessions() -> tuple[Session, Session]:
+    client = Session.resume(bytes(32), bytes(16), fast=True)
+    server = Session.resume(bytes(32), bytes(16), fast=True, server=True)
+    return client, server
+
+
+@pytest.mark.parametrize("fast", [False, True])
+def test_round_trip(fast):
+    client = Session.resume(bytes(32), bytes(16), fast=fast)
+    server = Session.resume(bytes(32), bytes(16), fast=fast, server=True)
+    assert server.decrypt(client.encrypt(b"hello", channels.audio_in), channels.audio_in) == b"hello"
+    assert client.decrypt(server.encrypt(b"hi", channels.audio_out), channels.audio_out) == b"hi"
+
+
+def test_fast_rejects_replays(sessions):
+    client, server = sessions
+    packet = client.encrypt(b"hello", channels.auth)
+    server.decrypt(packet, channels.auth)
+    with pytest.raises(ValueError):
+        server.decrypt(packet, channels.auth)
+
+
+def test_fast_rejects_tampering(sessions):
+    client, server = sessions
+    packet = bytearray(client.encrypt(b"hello", channels.auth))
+    packet[-1] ^= 1
+    with pytest.raises(ValueError):
+        server.decrypt(bytes(packet), channels.auth)
+
+
+def test_fast_rejects_packets_moved_to_another_channel(sessions):
+    client, server = sessions
+    packet = client.encrypt(b"hello", channels.audio_in)
+    with pytest.raises(ValueError):
+        server.decrypt(packet, channels.auth)
+
+
+def test_fast_counts_per_channel(sessions):
+    """A reliable packet that ENet had to resend arrives after many newer packets on other channels, and must still be accepted."""
+    client, server = sessions
+    resent = client.encrypt(b"control", channels.auth)
+    for i in range(200):
+        server.decrypt(client.encrypt(b"audio", channels.audio_in), channels.audio_in)
+    assert server.decrypt(resent, channels.auth) == b"control"
+
+
+def test_fast_uses_a_key_per_direction(sessions):
+    client, server = sessions
+    with pytest.raises(ValueError):
+        client.decrypt(client.encrypt(b"hello", channels.auth), channels.auth)
+
+
+def test_default_mode_nonces_differ_per_direction(monkeypatch):
+    """Both sides encrypt with the same key in the default mode, so even if their random prefixes came out the same their nonces must not."""
+    monkeypatch.setattr(os, "urandom", lambda size: bytes(size))
+    client = Session.resume(bytes(32), bytes(16))
+    server = Session.resume(bytes(32), bytes(16), server=True)
+    sent = {client.encrypt(b"hello", channels.audio_in)[:12] for i in range(10)}
+    received = {server.encrypt(b"hello", channels.audio_out)[:12] for i in range(10)}
+    assert len(sent) == len(received) == 10
+    assert not sent & received
@@ -0,0 +1,65 @@
+import pytest
+from app.speaker_selection import SpeakerSelector
+
+
+@pytest.fixture
+def selector():
+    selector = SpeakerSelector(max_speakers=2, hangover=0.5, min_hold=1.0, margin=0.25, pre_roll=3)
+    yield selector
+    selector.destroy()
+
+
+def test_needs_room_for_a_speaker():
+    with pytest.raises(ValueError):
+        SpeakerSelector(max_speakers=0)
+
+
+def test_selects_up_to_max_speakers(selector):
+    assert selector.admit(1, 0, b"a" * 100, 0.0) == [(0, b"a" * 100)]
+    assert selector.admit(2, 0, b"b" * 100, 0.0) == [(0, b"b" * 100)]
+    assert selector.admit(3, 0, b"c" * 100, 0.0) == []
+    assert selector.selected == {1, 2}
+    assert selector.suppressed == 1
+
+
+def test_hands_over_held_packets(selector):
+    selector.admit(1, 0, b"a" * 100, 0.0)
+    selector.admit(2, 0, b"b" * 100, 0.0)
+    for seq in range(5):
+        selector.admit(3, seq, bytes([seq]) * 100, 0.0)
+    # Speaker 1 went quiet past the hangover, so speaker 3 takes its place along with its last pre_roll packets
+    admitted = selector.admit(3, 5, b"c" * 100, 0.6)
+    assert [seq for seq, _ in admitted] == [2, 3, 4, 5]
+    assert not selector.is_selected(1)
+    assert selector.is_selected(3)
+    assert selector.handovers == 1
+
+
+def test_holds_speakers_for_min_hold(selector):
+    selector.admit(1, 0, b"a" * 10, 0.0)
+    selector.admit(2, 0, b"b" * 10, 0.0)
+    selector.admit(1, 1, b"a" * 10, 0.4)
+    selector.admit(2, 1, b"b" * 10, 0.4)
+    # Far more active, but the others were only just selected
+    assert selector.admit(3, 0, b"c" * 500, 0.5) == []
+    selector.admit(1, 2, b"a" * 10, 1.1)
+    selector.admit(2, 2, b"b" * 10, 1.1)
+    assert selector.admit(3, 1, b"c" * 500, 1.2) != []
+    assert selector.handovers == 1
+
+
+def test_needs_margin_to_replace(selector):
+    selector.admit(1, 0, b"a" * 100, 0.0)
+    selector.admit(2, 0, b"b" * 100, 0.0)
+    selector.admit(1, 1, b"a" * 100, 2.0)
+    selector.admit(2, 1, b"b" * 100, 2.0)
+    assert selector.admit(3, 0, b"c" * 110, 2.0) == []  # Not 25% more active
+    assert selector.admit(3, 1, b"c" * 130, 2.0) == []  # Smoothed to 114
+    assert selector.admit(3, 2, b"c" * 200, 2.0) == [(0, b"c" * 110), (1, b"c" * 130), (2, b"c" * 200)]
+
+
+def test_forget_makes_room(selector):
+    selector.admit(1, 0, b"a" * 100, 0.0)
+    selector.admit(2, 0, b"b" * 100, 0.0)
+    selector.forget(1)
+    assert selector.admit(3, 0, b"c" * 100, 0.1) == [(0, b"c" * 100)]
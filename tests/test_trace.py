@@ -0,0 +1,68 @@
+import msgpack
+import pytest
+from app import structs, trace
+
+
+class Handler:
+    def __init__(self):
+        self.frames = []
+        self.messages = []
+
+    def audio(self, user_id, seq_number, opus_audio):
+        self.frames.append((user_id, seq_number, bytes(opus_audio)))
+
+    def dispatch(self, message):
+        self.messages.append(message)
+
+
+def bundle(*frames: tuple[int, int, bytes]) -> bytes:
+    return b"".join(structs.audio_bundle_entry.pack(user_id, seq, len(frame)) + frame for user_id, seq, frame in frames)
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "capture.trace")
+    single = structs.audio_packet_header.pack(1, 7) + b"opus"
+    bundled = bundle((2, 8, b"one"), (3, 9, b"two"))
+    control = msgpack.dumps({"event": "joined", "data": {}})
+    writer = trace.TraceWriter(path)
+    writer.record(trace.audio, single)
+    writer.record(trace.audio_bundle, bundled)
+    writer.record(trace.control, control)
+    writer.close()
+    records = list(trace.read_trace(path))
+    assert [(kind, payload) for _, kind, payload in records] == [
+        (trace.audio, single),
+        (trace.audio_bundle, bundled),
+        (trace.control, control),
+    ]
+    times = [moment for moment, _, _ in records]
+    assert times == sorted(times)
+    handler = Handler()
+    assert trace.replay(records, handler, realtime=False) == 3
+    assert handler.frames == [(1, 7, b"opus"), (2, 8, b"one"), (3, 9, b"two")]
+    assert handler.messages == [{"event": "joined", "data": {}}]
+
+
+def test_truncated_record_ends_the_trace(tmp_path):
+    path = str(tmp_path / "capture.trace")
+    writer = trace.TraceWriter(path)
+    writer.record(trace.control, msgpack.dumps(1))
+    writer.record(trace.control, msgpack.dumps(2))
+    writer.close()
+    with open(path, "r+b") as file:
+        file.truncate(file.seek(0, 2) - 1)
+    assert len(list(trace.read_trace(path))) == 1
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "not.trace"
+    path.write_bytes(b"OggS" + bytes(20))
+    with pytest.raises(ValueError):
+        list(trace.read_trace(str(path)))
+
+
+def test_advance_follows_trace_time(tmp_path):
+    records = [(0.0, trace.control, msgpack.dumps(1)), (0.5, trace.control, msgpack.dumps(2))]
+    moments = []
+    trace.replay(records, Handler(), realtime=False, advance=moments.append)
+    assert moments == [0.0, 0.5]